@@ -0,0 +1,41 @@
+"""
+複数のコンテナで共通のモジュールのコピーが同じ内容か確認する
+
+各コンテナはディレクトリごとにビルドするため、共通のモジュールは同じ内容のファイルを各ディレクトリに置いている。
+どれかを変更したら全てのコピーに反映し、このスクリプトで確認する（一致しない場合は差分を表示して終了コード1）。
+
+python elasticsearch/check_shared_modules.py
+"""
+import os
+import sys
+import difflib
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# モジュール名と、コピーを置いているディレクトリ（先頭を基準に比較する）
+SHARED_MODULES = {
+    'keyword_cache.py': ['indexer', 'extractor'],
+    'kana_normalize.py': ['indexer', 'suggester'],
+}
+
+
+def main():
+    mismatched = 0
+    for module, directories in SHARED_MODULES.items():
+        paths = [os.path.join(BASE_DIR, directory, module) for directory in directories]
+        with open(paths[0], encoding='utf-8') as f:
+            expected = f.readlines()
+        for path in paths[1:]:
+            with open(path, encoding='utf-8') as f:
+                actual = f.readlines()
+            if actual == expected:
+                print(f"OK: {os.path.relpath(path, BASE_DIR)}")
+                continue
+            mismatched += 1
+            print(f"Mismatch: {os.path.relpath(path, BASE_DIR)} differs from {os.path.relpath(paths[0], BASE_DIR)}")
+            sys.stdout.writelines(difflib.unified_diff(expected, actual, paths[0], path))
+    return 1 if mismatched else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
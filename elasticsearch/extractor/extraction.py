@@ -0,0 +1,190 @@
+"""
+キーワード抽出モデルとマイクロバッチ処理
+
+Flaskのapp.pyとASGIのserver.pyの両方から使用する。
+"""
+from sentence_transformers import SentenceTransformer
+from keybert import KeyBERT
+from sklearn.feature_extraction.text import CountVectorizer
+import numpy as np
+import re
+import logging
+import threading
+import traceback
+import os
+from micro_batcher import MicroBatcher
+from keyword_cache import KeywordCache
+
+logger = logging.getLogger(__name__)
+
+# キーワード抽出に使うモデル
+MODEL_NAME = os.environ.get('EXTRACTOR_MODEL', 'sonoisa/sentence-bert-base-ja-mean-tokens')
+# 起動時にモデルを読み込むか
+PRELOAD_MODEL = os.environ.get('EXTRACTOR_PRELOAD', '1') == '1'
+# SentenceTransformer.encodeに一度に渡す文数
+ENCODE_BATCH_SIZE = int(os.environ.get('EXTRACTOR_ENCODE_BATCH_SIZE', '64'))
+# 複数リクエストをまとめて推論する際の最大テキスト数と最大待ち時間（ミリ秒）
+MAX_BATCH_SIZE = int(os.environ.get('EXTRACTOR_MAX_BATCH_SIZE', '64'))
+MAX_WAIT_MS = float(os.environ.get('EXTRACTOR_MAX_WAIT_MS', '5'))
+# キーフレーズ候補のn-gram範囲（KeyBERTと同じ設定）
+KEYPHRASE_NGRAM_RANGE = (1, 2)
+# 抽出済みキーワードをメモリに保持する件数（0ならキャッシュしない）
+KEYWORD_CACHE_SIZE = int(os.environ.get('KEYWORD_CACHE_SIZE', '100000'))
+# 抽出済みキーワードを保存するSQLiteファイル（空ならメモリのみ。再起動後も再利用する場合に指定）
+KEYWORD_CACHE_PATH = os.environ.get('KEYWORD_CACHE_PATH', '')
+
+def _normalize(embeddings):
+    """コサイン類似度を内積で計算できるよう、各ベクトルを正規化する"""
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+# キーワード抽出クラス
+class KeywordExtractor:
+    def __init__(self, model_name=MODEL_NAME):
+        self.model = SentenceTransformer(model_name)
+        self.kw_model = KeyBERT(model=self.model)
+
+    def warmup(self):
+        # 初回推論の遅延（スレッドプールやメモリ確保）を起動時に済ませておく
+        self.extract_keywords("ウォームアップ用のテキストです")
+
+    def extract_keywords(self, text, top_n=5):
+        return self.extract_keywords_batch([text], top_n=top_n)[0]
+
+    def extract_keywords_batch(self, texts, top_n=5, batch_size=ENCODE_BATCH_SIZE):
+        """複数の文書からまとめてキーワードを抽出し、入力と同じ順序で返す
+
+        KeyBERTのコサイン類似度による抽出と同じ結果を、全文書と全候補語を
+        まとめてencodeし、類似度の計算と上位の選択をNumPyでまとめて行うことで求める。
+        """
+        results = [[] for _ in texts]
+        targets = [(i, text) for i, text in enumerate(texts) if text]
+        if not targets:
+            return results
+        positions, docs = zip(*targets)
+
+        # 候補となるn-gramを全文書分まとめて抽出
+        try:
+            count = CountVectorizer(ngram_range=KEYPHRASE_NGRAM_RANGE, stop_words="english").fit(docs)
+        except ValueError:
+            # 候補語が1つもない
+            return results
+        words = count.get_feature_names_out()
+        candidates = count.transform(docs).tocsr()
+
+        # 文書と候補語をそれぞれ大きなバッチでencode
+        doc_embeddings = _normalize(self.model.encode(list(docs), batch_size=batch_size, convert_to_numpy=True))
+        word_embeddings = _normalize(self.model.encode(list(words), batch_size=batch_size, convert_to_numpy=True))
+
+        # 各文書に含まれる候補語（疎行列の非ゼロ要素）の類似度を取り出す
+        rows = np.repeat(np.arange(candidates.shape[0]), np.diff(candidates.indptr))
+        cols = candidates.indices
+        scores = (doc_embeddings @ word_embeddings.T)[rows, cols]
+
+        # 文書ごとに類似度の降順に並べ、上位top_n件だけを残す
+        order = np.lexsort((-scores, rows))
+        ranks = np.arange(len(order)) - candidates.indptr[rows[order]]
+        selected = order[ranks < top_n]
+        for row, col in zip(rows[selected], cols[selected]):
+            results[positions[row]].append(words[col])
+        return results
+
+# プロセス内で共有するKeywordExtractor（推論は読み取りのみのため、リクエストスレッド間で共有できる）
+_extractor = None
+_extractor_lock = threading.Lock()
+_extractor_error = None
+
+def get_extractor(warmup=True):
+    """モデルを1回だけ読み込み、以降は同じインスタンスを返す
+
+    forkする前の親プロセスで読み込む場合はwarmup=Falseとし、推論は子プロセスで行う。
+    """
+    global _extractor, _extractor_error
+    if _extractor is None:
+        with _extractor_lock:
+            if _extractor is None:
+                try:
+                    logger.info("Loading keyword extraction model %s...", MODEL_NAME)
+                    extractor = KeywordExtractor()
+                    if warmup:
+                        extractor.warmup()
+                    _extractor = extractor
+                    _extractor_error = None
+                    logger.info("Keyword extraction model loaded.")
+                except Exception as e:
+                    _extractor_error = str(e)
+                    logger.error("Failed to load keyword extraction model: %s\n%s", e, traceback.format_exc())
+                    raise
+    return _extractor
+
+def is_loaded():
+    return _extractor is not None
+
+def ready_status():
+    """/ready用の状態とHTTPステータスを返す"""
+    if _extractor is not None:
+        return {'status': 'ready', 'model': MODEL_NAME}, 200
+    status = {'status': 'loading', 'model': MODEL_NAME}
+    if _extractor_error:
+        status.update({'status': 'error', 'error': _extractor_error})
+    return status, 503
+
+# 抽出済みキーワードのキャッシュ（モデルとn-gram範囲が変われば別のキーになる）
+keyword_cache = None
+if KEYWORD_CACHE_SIZE > 0:
+    keyword_cache = KeywordCache(
+        f"{MODEL_NAME}:ngram={KEYPHRASE_NGRAM_RANGE[0]}-{KEYPHRASE_NGRAM_RANGE[1]}",
+        max_entries=KEYWORD_CACHE_SIZE,
+        path=KEYWORD_CACHE_PATH or None
+    )
+
+def extract_keywords_cached(texts, top_n=5):
+    """キャッシュに無いテキストだけをまとめて推論し、入力と同じ順序で返す"""
+    if keyword_cache is None:
+        return get_extractor().extract_keywords_batch(texts, top_n=top_n)
+
+    results = keyword_cache.get_many(texts, top_n)
+    missing = [i for i, keywords in enumerate(results) if keywords is None]
+    if missing:
+        # 同じリクエスト内で重複するテキストは1回だけ推論する
+        unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+        extracted = get_extractor().extract_keywords_batch(unique_texts, top_n=top_n)
+        keyword_cache.put_many(unique_texts, extracted, top_n)
+        keyword_cache.flush()
+        by_text = dict(zip(unique_texts, extracted))
+        for i in missing:
+            results[i] = by_text[texts[i]]
+    return results
+
+# 同時に届いたリクエストのレコードをまとめて推論するキュー
+batcher = MicroBatcher(
+    extract_keywords_cached,
+    max_batch_size=MAX_BATCH_SIZE,
+    max_wait_ms=MAX_WAIT_MS
+)
+
+def metrics():
+    metrics = batcher.metrics()
+    if keyword_cache is not None:
+        metrics['keyword_cache'] = keyword_cache.stats()
+    return metrics
+
+def request_texts(data):
+    """スキルのリクエストから各レコードの本文を取り出す"""
+    return [record['data'].get('Text') or '' for record in data['values']]
+
+def build_response(data, texts, keywords_list):
+    """抽出したキーワードとハッシュタグをスキルのレスポンス形式にする"""
+    results = []
+    for record, text_data, keywords in zip(data['values'], texts, keywords_list):
+        hashtags = re.findall(r'#\w+', text_data)
+
+        results.append({
+            'recordId': record['recordId'],
+            'data': {
+                'HashTags': ' '.join(hashtags),
+                'Keywords': ' '.join(keywords)
+            }
+        })
+
+    return {'values': results}
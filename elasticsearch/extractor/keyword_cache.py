@@ -0,0 +1,147 @@
+"""
+テキストのハッシュをキーにした抽出済みキーワードのキャッシュ
+
+メモリ上のLRUと、コンテナの再起動後も残るSQLiteファイルの2段構成。
+extractor/keyword_cache.py と indexer/keyword_cache.py は同じ内容に保つこと。
+変更した場合は python elasticsearch/check_shared_modules.py でコピーが一致しているか確認する。
+"""
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+# キーの作り方を変えた場合に、保存済みのSQLiteファイルの古いエントリを使わないよう上げる
+KEY_VERSION = 2
+
+
+class KeywordCache:
+    """テキストと抽出設定のハッシュをキーにキーワードを保存する
+
+    抽出は元のテキストに対して行うため、キーも正規化せずに元のテキストそのものから作る
+    （正規化した表記でキーをまとめると、全角・半角など文書に無い表記のキーワードが返ることがある）。
+    namespaceには抽出結果に影響する設定（モデル名、抽出件数、n-gram範囲など）を渡す。
+    設定が変われば別のキーになるため、古い結果が返ることはない。
+    """
+
+    def __init__(self, namespace, max_entries=100000, path=None, flush_size=256):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.path = path
+        self.flush_size = flush_size
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._unsaved = {}
+        self.hits = 0
+        self.misses = 0
+
+        self._db = None
+        self._open()
+        # SQLiteの接続はforkした子プロセスで使えないため、子プロセスでは開き直す
+        os.register_at_fork(after_in_child=self._reopen)
+
+    def _open(self):
+        if not self.path:
+            return
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS keywords (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.commit()
+
+    def _reopen(self):
+        # 親プロセスから引き継いだ接続は使わず、閉じずに参照だけ残しておく
+        self._inherited_db = self._db
+        self._lock = threading.Lock()
+        self._unsaved = {}
+        self._db = None
+        self._open()
+
+    def key(self, text, params=''):
+        """paramsには呼び出しごとに変わる設定（抽出件数など）を渡す"""
+        payload = f"{KEY_VERSION}\0{self.namespace}\0{params}\0{text}"
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, texts, params=''):
+        """テキストごとのキーワードを返す（キャッシュに無いものはNone）"""
+        keys = [self.key(text, params) for text in texts]
+        results = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                value = self._memory.get(key)
+                if value is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = value
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            if missing and self._db is not None:
+                found = {}
+                missing_keys = list(missing)
+                # SQLiteのパラメータ数の上限を超えないよう分割して検索する
+                for start in range(0, len(missing_keys), 500):
+                    chunk = missing_keys[start:start + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    for key, value in self._db.execute(
+                            f"SELECT key, value FROM keywords WHERE key IN ({placeholders})", chunk):
+                        found[key] = json.loads(value)
+                for key, value in found.items():
+                    self._remember(key, value)
+                    for i in missing.pop(key):
+                        results[i] = value
+
+            missed = sum(len(positions) for positions in missing.values())
+            self.misses += missed
+            self.hits += len(texts) - missed
+        return results
+
+    def get(self, text, params=''):
+        return self.get_many([text], params)[0]
+
+    def put_many(self, texts, values, params=''):
+        with self._lock:
+            for text, value in zip(texts, values):
+                key = self.key(text, params)
+                self._remember(key, value)
+                if self._db is not None:
+                    self._unsaved[key] = value
+            if len(self._unsaved) >= self.flush_size:
+                self._flush_locked()
+
+    def put(self, text, value, params=''):
+        self.put_many([text], [value], params)
+
+    def _flush_locked(self):
+        if self._db is None or not self._unsaved:
+            return
+        self._db.executemany(
+            "INSERT OR REPLACE INTO keywords (key, value) VALUES (?, ?)",
+            [(key, json.dumps(value, ensure_ascii=False)) for key, value in self._unsaved.items()]
+        )
+        self._db.commit()
+        self._unsaved.clear()
+
+    def flush(self):
+        """未保存のエントリをSQLiteに書き込む"""
+        with self._lock:
+            self._flush_locked()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._memory),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+                'persistent': self._db is not None
+            }
@@ -0,0 +1,139 @@
+"""
+複数のリクエストのレコードをまとめて1回の推論で処理するマイクロバッチ処理
+"""
+import os
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+
+class _Request:
+    __slots__ = ('texts', 'future', 'enqueued')
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+        self.enqueued = time.monotonic()
+
+
+class MicroBatcher:
+    """同時に届いたリクエストのテキストを集めて、まとめてprocess_fnに渡す
+
+    最初のリクエストが届いてからmax_wait_msが経過するか、テキスト数がmax_batch_sizeに
+    達した時点で1回の推論を実行し、結果を各リクエストに振り分ける。
+    推論は専用のスレッド1つで順番に実行する。
+    キャンセルされたリクエスト（タイムアウトした呼び出し元など）は推論せずに捨てる。
+    """
+
+    def __init__(self, process_fn, max_batch_size=64, max_wait_ms=5, window=1000):
+        self.process_fn = process_fn
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_wait = max_wait_ms / 1000.0
+        self.window = window
+        self._start()
+        # gunicorn --preload でforkされた子プロセスにはスレッドが引き継がれないため、起動し直す
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self._queue = queue.Queue()
+
+        # メトリクス
+        self._lock = threading.Lock()
+        self._pending_texts = 0
+        self._batches = 0
+        self._texts = 0
+        self._max_batch = 0
+        self._batch_sizes = deque(maxlen=self.window)
+        self._wait_times = deque(maxlen=self.window)
+        self._inference_times = deque(maxlen=self.window)
+
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts):
+        """テキストのリストを投入し、同じ順序のキーワードのリストを返すFutureを受け取る"""
+        request = _Request(list(texts))
+        with self._lock:
+            self._pending_texts += len(request.texts)
+        self._queue.put(request)
+        return request.future
+
+    def _collect(self):
+        """最初のリクエストを待ち、待ち時間か件数の上限までリクエストを集める"""
+        batch = [self._queue.get()]
+        count = len(batch[0].texts)
+        deadline = batch[0].enqueued + self.max_wait
+        while count < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            count += len(request.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            collected = self._collect()
+            started = time.monotonic()
+            with self._lock:
+                self._pending_texts -= sum(len(request.texts) for request in collected)
+                for request in collected:
+                    self._wait_times.append(started - request.enqueued)
+
+            # 待っている間にキャンセルされたリクエストを除く
+            batch = [request for request in collected if request.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            texts = [text for request in batch for text in request.texts]
+
+            try:
+                results = self.process_fn(texts)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            with self._lock:
+                self._batches += 1
+                self._texts += len(texts)
+                self._max_batch = max(self._max_batch, len(texts))
+                self._batch_sizes.append(len(texts))
+                self._inference_times.append(time.monotonic() - started)
+
+            # 結果を各リクエストに振り分ける
+            offset = 0
+            for request in batch:
+                request.future.set_result(results[offset:offset + len(request.texts)])
+                offset += len(request.texts)
+
+    @staticmethod
+    def _summary(values, scale=1.0):
+        if not values:
+            return {'avg': 0.0, 'p95': 0.0, 'max': 0.0}
+        ordered = sorted(values)
+        return {
+            'avg': round(sum(ordered) / len(ordered) * scale, 3),
+            'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * scale, 3),
+            'max': round(ordered[-1] * scale, 3)
+        }
+
+    def metrics(self):
+        """キューの深さ、バッチサイズ、待ち時間の統計を返す"""
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'pending_texts': self._pending_texts,
+                'batches': self._batches,
+                'texts': self._texts,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'batch_size': dict(self._summary(self._batch_sizes), max=self._max_batch),
+                'wait_ms': self._summary(self._wait_times, 1000),
+                'inference_ms': self._summary(self._inference_times, 1000)
+            }
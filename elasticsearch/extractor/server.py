@@ -0,0 +1,117 @@
+"""
+本番用のASGIサーバー
+
+    gunicorn --preload -k uvicorn.workers.UvicornWorker server:app
+
+--preloadを付けると親プロセスでモデルを1回だけ読み込み、forkしたワーカープロセスで共有する。
+推論はマイクロバッチのスレッドで行い、イベントループはリクエストの受け付けだけを行う。
+処理中のテキスト数が上限を超えた場合は、待たせずにすぐ429を返す。
+"""
+import asyncio
+import contextlib
+import logging
+import os
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+import extraction
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 1ワーカープロセスで同時に処理するテキスト数の上限（超えたリクエストには429を返す）
+MAX_INFLIGHT_TEXTS = int(os.environ.get('EXTRACTOR_MAX_INFLIGHT_TEXTS', '512'))
+# 1リクエストの推論を待つ最大秒数（超えた場合は503を返す）
+REQUEST_TIMEOUT = float(os.environ.get('EXTRACTOR_REQUEST_TIMEOUT', '30'))
+# 429/503のレスポンスで再試行までの秒数として返す値
+RETRY_AFTER_SECONDS = os.environ.get('EXTRACTOR_RETRY_AFTER', '1')
+
+# ワーカープロセスごとの状態（イベントループのスレッドからのみ更新する）
+_inflight_texts = 0
+_rejected = 0
+_timed_out = 0
+_warmed_up = False
+
+if extraction.PRELOAD_MODEL:
+    # forkする前に読み込み、重みのメモリをワーカー間で共有する
+    # 親プロセスでは推論しない（推論用のスレッドプールはforkで引き継がれないため、ウォームアップは各ワーカーで行う）
+    try:
+        extraction.get_extractor(warmup=False)
+    except Exception:
+        # エラーは/readyで返し、ワーカーの起動時に再度読み込みを試みる
+        pass
+
+def _busy(status, message):
+    return JSONResponse({'error': message}, status_code=status, headers={'Retry-After': RETRY_AFTER_SECONDS})
+
+async def _warmup():
+    """ワーカーごとにモデルを読み込み（読み込み済みなら共有）、初回推論を済ませる"""
+    global _warmed_up
+    try:
+        extractor = await asyncio.to_thread(extraction.get_extractor, False)
+        await asyncio.to_thread(extractor.warmup)
+        _warmed_up = True
+        logger.info("Worker %d is ready.", os.getpid())
+    except Exception as e:
+        logger.error("Worker %d failed to warm up: %s", os.getpid(), e)
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # 起動をブロックせずにウォームアップし、完了までは/readyが503を返す
+    warmup = asyncio.create_task(_warmup())
+    yield
+    warmup.cancel()
+
+async def ready(request):
+    status, code = extraction.ready_status()
+    if code == 200 and not _warmed_up:
+        status, code = dict(status, status='warming_up'), 503
+    return JSONResponse(status, status_code=code)
+
+async def metrics(request):
+    metrics = extraction.metrics()
+    metrics.update({
+        'pid': os.getpid(),
+        'inflight_texts': _inflight_texts,
+        'max_inflight_texts': MAX_INFLIGHT_TEXTS,
+        'rejected': _rejected,
+        'timed_out': _timed_out
+    })
+    return JSONResponse(metrics)
+
+async def extract(request):
+    global _inflight_texts, _rejected, _timed_out
+    data = await request.json()
+    texts = extraction.request_texts(data)
+
+    if not _warmed_up:
+        _rejected += 1
+        return _busy(503, 'model is not ready')
+    # 処理中のテキストが上限に達している場合はキューに積まずに断る
+    # （上限より大きいリクエストでも、他に処理中のものが無ければ受け付ける）
+    if _inflight_texts and _inflight_texts + len(texts) > MAX_INFLIGHT_TEXTS:
+        _rejected += 1
+        return _busy(429, 'too many requests in flight')
+
+    _inflight_texts += len(texts)
+    try:
+        # 他のリクエストのレコードとまとめてバッチ推論でキーワードを抽出
+        future = extraction.batcher.submit(texts)
+        keywords_list = await asyncio.wait_for(asyncio.wrap_future(future), REQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        # まだ推論が始まっていなければキャンセルされ、バッチから除かれる
+        _timed_out += 1
+        return _busy(503, 'keyword extraction timed out')
+    finally:
+        _inflight_texts -= len(texts)
+
+    return JSONResponse(extraction.build_response(data, texts, keywords_list))
+
+app = Starlette(
+    routes=[
+        Route('/ready', ready, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+        Route('/extract', extract, methods=['POST'])
+    ],
+    lifespan=lifespan
+)
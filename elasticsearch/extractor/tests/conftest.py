@@ -0,0 +1,6 @@
+"""キーワード抽出サービスのテストの共通設定"""
+import os
+import sys
+
+# テスト対象のモジュール（testsの親ディレクトリ）を読み込めるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
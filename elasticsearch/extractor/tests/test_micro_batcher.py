@@ -0,0 +1,110 @@
+"""マイクロバッチ処理のテスト"""
+import threading
+
+import pytest
+
+from micro_batcher import MicroBatcher
+
+TIMEOUT = 5
+
+
+class Recorder:
+    """受け取ったバッチを記録し、各テキストを大文字にして返すprocess_fn"""
+
+    def __init__(self, block_first=False):
+        self.batches = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not block_first:
+            self.release.set()
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        self.started.set()
+        self.release.wait(TIMEOUT)
+        return [text.upper() for text in texts]
+
+
+def test_results_are_split_per_request_in_order():
+    recorder = Recorder(block_first=True)
+    batcher = MicroBatcher(recorder, max_batch_size=64, max_wait_ms=100)
+    first = batcher.submit(['a'])
+    assert recorder.started.wait(TIMEOUT)
+    # 推論中に届いたリクエストは次のバッチにまとめる
+    futures = [batcher.submit(texts) for texts in (['b', 'c'], [], ['d'], ['e', 'f', 'g'])]
+    recorder.release.set()
+
+    assert first.result(TIMEOUT) == ['A']
+    assert [future.result(TIMEOUT) for future in futures] == [['B', 'C'], [], ['D'], ['E', 'F', 'G']]
+    assert recorder.batches == [['a'], ['b', 'c', 'd', 'e', 'f', 'g']]
+
+
+def test_batches_are_limited_by_max_batch_size():
+    recorder = Recorder()
+    batcher = MicroBatcher(recorder, max_batch_size=4, max_wait_ms=1000)
+    futures = [batcher.submit([str(i)]) for i in range(10)]
+
+    assert [future.result(TIMEOUT) for future in futures] == [[str(i)] for i in range(10)]
+    assert [len(batch) for batch in recorder.batches] == [4, 4, 2]
+    assert [text for batch in recorder.batches for text in batch] == [str(i) for i in range(10)]
+
+
+def test_exception_is_set_on_every_request_of_the_batch():
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail(texts):
+        if texts == ['block']:
+            started.set()
+            release.wait(TIMEOUT)
+            return ['BLOCK']
+        raise RuntimeError('model failed')
+
+    batcher = MicroBatcher(fail, max_wait_ms=0)
+    blocking = batcher.submit(['block'])
+    assert started.wait(TIMEOUT)
+    futures = [batcher.submit(['x']), batcher.submit(['y', 'z'])]
+    release.set()
+
+    assert blocking.result(TIMEOUT) == ['BLOCK']
+    for future in futures:
+        with pytest.raises(RuntimeError, match='model failed'):
+            future.result(TIMEOUT)
+    # 失敗した後も次のリクエストは処理する
+    assert batcher.submit(['block']).result(TIMEOUT) == ['BLOCK']
+
+
+def test_cancelled_requests_are_not_processed():
+    recorder = Recorder(block_first=True)
+    batcher = MicroBatcher(recorder, max_wait_ms=0)
+    first = batcher.submit(['a'])
+    assert recorder.started.wait(TIMEOUT)
+    cancelled = batcher.submit(['b'])
+    assert cancelled.cancel()
+    recorder.release.set()
+
+    assert first.result(TIMEOUT) == ['A']
+    assert batcher.submit(['c']).result(TIMEOUT) == ['C']
+    assert recorder.batches == [['a'], ['c']]
+
+
+def test_metrics_count_batches_and_texts():
+    recorder = Recorder(block_first=True)
+    batcher = MicroBatcher(recorder, max_batch_size=8, max_wait_ms=0)
+    first = batcher.submit(['a'])
+    assert recorder.started.wait(TIMEOUT)
+    second = batcher.submit(['b', 'c', 'd'])
+    # 推論中に投入されたテキストは処理待ちとして数える
+    assert batcher.metrics()['pending_texts'] == 3
+    recorder.release.set()
+    first.result(TIMEOUT)
+    second.result(TIMEOUT)
+
+    metrics = batcher.metrics()
+    assert metrics['batches'] == 2
+    assert metrics['texts'] == 4
+    assert metrics['pending_texts'] == 0
+    assert metrics['queue_depth'] == 0
+    assert metrics['max_batch_size'] == 8
+    assert metrics['batch_size']['max'] == 3
+    assert metrics['batch_size']['avg'] == 2.0
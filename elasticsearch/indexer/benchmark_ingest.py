@@ -0,0 +1,421 @@
+"""
+インデクサーの取り込み処理（SQL読み込みから_bulk送信まで）のベンチマーク
+
+    python benchmark_ingest.py --rows 20000                          # 合成データで計測
+    python benchmark_ingest.py --rows 20000 --output result.json     # 結果をJSONで保存
+    python benchmark_ingest.py --rows 20000 --baseline result.json   # 前回の結果と比較
+
+本番のAzure SQLとElasticsearchの代わりに、次のローカルの代替を使う。
+- Mspr.PostCommentViewと同じカラムの合成データ（日本語の本文、ハッシュタグ、CommentsのJSON）を入れたSQLite
+- _bulkのNDJSONを受け取って件数を数えるだけのHTTPサーバー（別プロセスで起動）
+
+index_data.pyの関数をそのまま使い、段階（SQL読み込み、キーワード抽出、ハッシュタグ抽出、JSON処理、
+シリアライズ、バルク送信）ごとの時間を計測する。段階の時間はスレッドごとの合計で、入れ子の呼び出しは
+内側の段階だけに数える。--workersが2以上の場合、ワーカープロセス内の段階は計測しない。
+"""
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import elasticsearch
+import index_data
+from bulk_writer import BulkWriter
+
+# 合成データの語彙
+NOUNS = [
+    "東京", "大阪", "京都", "天気", "ラーメン", "カフェ", "映画", "音楽", "仕事", "会議", "週末", "旅行",
+    "写真", "猫", "犬", "散歩", "電車", "新幹線", "桜", "紅葉", "温泉", "料理", "カレー", "寿司",
+    "ゲーム", "アニメ", "ドラマ", "読書", "本屋", "図書館", "公園", "海", "山", "雨", "雪", "朝ごはん",
+    "ランチ", "ケーキ", "コーヒー", "紅茶", "駅前", "新作", "ライブ", "コンサート", "プログラミング", "Python",
+]
+VERBS = ["行きました", "食べました", "見ました", "買いました", "始めました", "楽しみました", "撮りました", "歩きました"]
+ADJECTIVES = ["美味しい", "楽しい", "新しい", "懐かしい", "かわいい", "綺麗な", "静かな", "賑やかな"]
+PARTICLES = ["で", "に", "と", "の", "へ"]
+HASHTAGS = ["今日の一枚", "グルメ", "旅行好き", "猫のいる暮らし", "カフェ巡り", "週末", "東京カフェ", "読書記録", "写真好き"]
+
+# ベンチマーク用のインデックス名（ローカルのバルクサーバーでは保存しない）
+BENCHMARK_INDEX = 'benchmark-index'
+
+
+def synthetic_sentence(rng):
+    """「東京でラーメンを食べました」のような文を作る"""
+    parts = [rng.choice(NOUNS), rng.choice(PARTICLES)]
+    if rng.random() < 0.5:
+        parts += [rng.choice(ADJECTIVES), rng.choice(NOUNS), "を"]
+    parts.append(rng.choice(VERBS))
+    return "".join(parts) + rng.choice(["。", "！", "。", "…"])
+
+
+def synthetic_text(rng, sentences):
+    text = "".join(synthetic_sentence(rng) for _ in range(sentences))
+    tags = rng.sample(HASHTAGS, rng.randint(0, 3))
+    if tags:
+        text += " " + " ".join(f"#{tag}" for tag in tags)
+    return text
+
+
+def synthetic_rows(rows, seed=1, comments=3, sentences=4):
+    """Mspr.PostCommentViewと同じカラムの行を返すジェネレータ"""
+    rng = random.Random(seed)
+    base = datetime(2024, 1, 1)
+    for i in range(rows):
+        created = base + timedelta(minutes=i)
+        post_comments = []
+        for j in range(rng.randint(0, comments * 2)):
+            commented = created + timedelta(minutes=j + 1)
+            post_comments.append({
+                "CommentNumber": j + 1,
+                "CreatedAt": commented.isoformat(),
+                "CommentId": f"c{i:08d}-{j:03d}",
+                "CommentedUser": f"user{rng.randint(1, 5000)}",
+                "Text": synthetic_text(rng, rng.randint(1, 2)),
+                "CommentedAt": commented.isoformat(),
+                "DeletedAt": commented.isoformat() if rng.random() < 0.02 else None
+            })
+        yield (
+            i + 1,
+            f"p{i:08d}",
+            created,
+            created,
+            f"user{rng.randint(1, 5000)}",
+            synthetic_text(rng, rng.randint(1, sentences * 2)),
+            created + timedelta(days=1) if rng.random() < 0.01 else None,
+            1,
+            None,
+            None,
+            json.dumps(post_comments, ensure_ascii=False),
+            created + timedelta(minutes=len(post_comments)) if post_comments else None
+        )
+
+
+def create_corpus(path, rows, seed=1, comments=3, sentences=4):
+    """合成データをSQLiteのファイルに書き込む"""
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(
+            "CREATE TABLE PostCommentView (PostedNumber INTEGER, PostId TEXT PRIMARY KEY, CreatedAt TIMESTAMP, "
+            "PostedAt TIMESTAMP, PostedUser TEXT, Text TEXT, DeletedAt TIMESTAMP, PostStatus INTEGER, "
+            "HashTags TEXT, Keywords TEXT, Comments TEXT, CommentedAt TIMESTAMP)"
+        )
+        generated = synthetic_rows(rows, seed, comments, sentences)
+        while True:
+            chunk = [row for _, row in zip(range(5000), generated)]
+            if not chunk:
+                break
+            conn.executemany("INSERT INTO PostCommentView VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", chunk)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def connect_corpus(path):
+    """SQLiteのファイルをMsprスキーマとして開き、SOURCE_VIEWと同じ名前で参照できるようにする"""
+    # 先読みスレッドからカーソルを使うため、スレッドのチェックを無効にする
+    conn = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+    conn.execute("ATTACH DATABASE ? AS Mspr", (path,))
+    return conn
+
+
+class StageTimer:
+    """関数の呼び出しにかかった時間を段階ごとに集計する（入れ子の呼び出しは内側の段階だけに数える）"""
+
+    def __init__(self):
+        self.seconds = Counter()
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def wrap(self, stage, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            stack = self._local.__dict__.setdefault('stack', [])
+            start = time.perf_counter()
+            if stack:
+                # 外側の段階の計測を止める
+                stack[-1][1] += start - stack[-1][2]
+            entry = [stage, 0.0, start]
+            stack.append(entry)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                stack.pop()
+                if stack:
+                    stack[-1][2] = end
+                with self._lock:
+                    self.seconds[stage] += entry[1] + end - entry[2]
+                    self.calls[stage] += 1
+        return timed
+
+    def report(self):
+        return {
+            stage: {'seconds': round(self.seconds[stage], 4), 'calls': self.calls[stage]}
+            for stage in self.seconds
+        }
+
+
+class TimedCursor:
+    """SQLの実行と取得の時間を計測し、読み込んだ行数を数えるカーソル"""
+
+    def __init__(self, cursor, timer):
+        self._cursor = cursor
+        self.rows = 0
+        self.execute = timer.wrap('fetch', cursor.execute)
+        self._fetchmany = timer.wrap('fetch', cursor.fetchmany)
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def fetchmany(self, size):
+        rows = self._fetchmany(size)
+        self.rows += len(rows)
+        return rows
+
+    def close(self):
+        self._cursor.close()
+
+
+def install_timers(timer, workers):
+    """index_dataとBulkWriterの関数を計測用に置き換える"""
+    if workers <= 1:
+        # ワーカープロセスを使う場合、これらはワーカー側で実行されるため計測できない
+        index_data.extract_keywords_batch = timer.wrap('keywords', index_data.extract_keywords_batch)
+        index_data.extract_hashtags = timer.wrap('hashtags', index_data.extract_hashtags)
+        index_data.transform_row = timer.wrap('json', index_data.transform_row)
+        index_data.content_hash = timer.wrap('json', index_data.content_hash)
+    BulkWriter._serialize = timer.wrap('serialize', BulkWriter._serialize)
+    BulkWriter._send = timer.wrap('bulk_send', BulkWriter._send)
+
+
+class BulkHandler(BaseHTTPRequestHandler):
+    """_bulkのNDJSONを受け取り、保存せずに全て成功したレスポンスを返す"""
+    protocol_version = 'HTTP/1.1'
+    stats = Counter()
+    lock = threading.Lock()
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.path.split('?')[0].endswith('/_bulk'):
+            self._reply(404, {'error': f'unsupported path {self.path}'})
+            return
+        items = []
+        lines = iter(line for line in body.split(b'\n') if line.strip())
+        for line in lines:
+            (op, meta), = json.loads(line).items()
+            if op != 'delete':
+                # ドキュメント本体の行は読み飛ばす
+                next(lines, None)
+            items.append({op: {'_index': meta.get('_index'), '_id': meta.get('_id'), 'status': 201}})
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['actions'] += len(items)
+            self.stats['bytes'] += len(body)
+        self._reply(200, {'took': 0, 'errors': False, 'items': items})
+
+    def do_GET(self):
+        if self.path == '/_benchmark/stats':
+            with self.lock:
+                self._reply(200, dict(self.stats))
+        else:
+            self._reply(200, {'version': {'number': '7.10.0'}, 'tagline': 'benchmark bulk sink'})
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_bulk(ports):
+    """空いているポートでバルクサーバーを起動し、ポート番号をキューで返す"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), BulkHandler)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_bulk_server():
+    """計測への影響を避けるため、バルクサーバーを別プロセスで起動する"""
+    context = multiprocessing.get_context('spawn')
+    ports = context.Queue()
+    process = context.Process(target=serve_bulk, args=(ports,), name="bulk-sink", daemon=True)
+    process.start()
+    return process, f"http://127.0.0.1:{ports.get(timeout=60)}"
+
+
+def peak_rss_mb(who):
+    # Linuxのru_maxrssはKB単位（macOSはバイト単位）
+    rss = resource.getrusage(who).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args, corpus_path, bulk_url):
+    """合成データの全行を変換して送信し、計測結果を返す"""
+    index_data.BULK_THREADS = args.bulk_threads
+    index_data.BULK_CHUNK_SIZE = args.bulk_chunk_size
+    index_data.KEYWORD_CACHE_SIZE = args.keyword_cache_size
+    timer = StageTimer()
+    install_timers(timer, args.workers)
+    index_data.init_mecab()
+
+    es = elasticsearch.Elasticsearch([bulk_url], timeout=60)
+    conn = connect_corpus(corpus_path)
+    cursor = TimedCursor(conn.cursor(), timer)
+    try:
+        started = time.perf_counter()
+        cursor.execute(f"SELECT * FROM {index_data.SOURCE_VIEW}")
+        batches = index_data.fetch_batches(cursor, args.fetch_size)
+        actions = index_data.generate_actions(batches, BENCHMARK_INDEX, workers=args.workers)
+        success, failed, first_errors = index_data.bulk_import(es, actions)
+        elapsed = time.perf_counter() - started
+    finally:
+        cursor.close()
+        conn.close()
+
+    if first_errors:
+        print(f"First few errors: {first_errors}")
+    sink = es.transport.perform_request('GET', '/_benchmark/stats')
+    cache = index_data.keyword_cache.stats() if index_data.keyword_cache is not None else None
+    return {
+        'benchmark': 'ingest',
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'config': {
+            'rows': args.rows,
+            'seed': args.seed,
+            'comments': args.comments,
+            'fetch_size': args.fetch_size,
+            'workers': args.workers,
+            'bulk_threads': args.bulk_threads,
+            'bulk_chunk_size': args.bulk_chunk_size,
+            'keyword_cache_size': args.keyword_cache_size,
+            'keyword_scoring': index_data.KEYWORD_SCORING,
+            'mecab': index_data.mecab is not None
+        },
+        'rows': cursor.rows,
+        'documents': success,
+        'failed': failed,
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_sec': round(cursor.rows / elapsed, 1) if elapsed else None,
+        'docs_per_sec': round(success / elapsed, 1) if elapsed else None,
+        'peak_rss_mb': peak_rss_mb(resource.RUSAGE_SELF),
+        'stages': timer.report(),
+        'bulk_sink': sink,
+        'keyword_cache': cache
+    }
+
+
+def compare(result, baseline, max_regression):
+    """前回の結果と比較して差分を表示し、許容範囲を超えて悪化した項目を返す"""
+    regressions = []
+    changed = {key: (baseline.get('config', {}).get(key), value) for key, value in result['config'].items()
+               if baseline.get('config', {}).get(key) != value}
+    if changed:
+        print(f"Note: configuration differs from the baseline: {changed}")
+    for key, higher_is_better in (('rows_per_sec', True), ('peak_rss_mb', False)):
+        before, after = baseline.get(key), result.get(key)
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        print(f"{key}: {before} -> {after} ({change:+.1%})")
+        if (-change if higher_is_better else change) > max_regression:
+            regressions.append(key)
+    for stage, current in result['stages'].items():
+        before = baseline.get('stages', {}).get(stage, {}).get('seconds')
+        if before:
+            print(f"  {stage}: {before}s -> {current['seconds']}s ({(current['seconds'] - before) / before:+.1%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="合成データとローカルの代替でインデクサーの取り込み処理を計測する")
+    parser.add_argument('--rows', type=int, default=10000, help="合成する投稿数")
+    parser.add_argument('--comments', type=int, default=3, help="投稿あたりの平均コメント数")
+    parser.add_argument('--seed', type=int, default=1, help="合成データの乱数シード")
+    parser.add_argument('--corpus', help="合成データのSQLiteファイル（既定は一時ディレクトリ。同じ設定なら再利用する）")
+    parser.add_argument('--regenerate', action='store_true', help="合成データを作り直す")
+    parser.add_argument('--bulk-url', help="_bulkを送信する先（指定しない場合はローカルのバルクサーバーを起動）")
+    parser.add_argument('--workers', type=int, default=1, help="キーワード抽出のワーカープロセス数")
+    parser.add_argument('--fetch-size', type=int, default=index_data.SQL_FETCH_SIZE, help="fetchmanyの行数")
+    parser.add_argument('--bulk-threads', type=int, default=index_data.BULK_THREADS, help="バルク送信のスレッド数")
+    parser.add_argument('--bulk-chunk-size', type=int, default=index_data.BULK_CHUNK_SIZE, help="バルクのチャンクあたりのドキュメント数")
+    parser.add_argument('--keyword-cache-size', type=int, default=0,
+                        help="抽出済みキーワードのキャッシュ件数（既定は0で、毎回形態素解析する）")
+    parser.add_argument('--output', help="結果を保存するJSONファイル")
+    parser.add_argument('--baseline', help="比較する前回の結果のJSONファイル")
+    parser.add_argument('--max-regression', type=float, default=0.1,
+                        help="--baselineより悪化した場合に終了コード1にする割合（rows_per_secとpeak_rss_mb）")
+    args = parser.parse_args(argv)
+
+    corpus_path = args.corpus or os.path.join(
+        tempfile.gettempdir(), f"msprdb_benchmark_{args.rows}_{args.comments}_{args.seed}.sqlite"
+    )
+    if args.regenerate or not os.path.exists(corpus_path):
+        print(f"Generating {args.rows} synthetic posts into {corpus_path}...")
+        create_corpus(corpus_path, args.rows, args.seed, args.comments)
+
+    server = None
+    bulk_url = args.bulk_url
+    if not bulk_url:
+        server, bulk_url = start_bulk_server()
+        print(f"Local bulk sink listening on {bulk_url}")
+    try:
+        result = run_benchmark(args, corpus_path, bulk_url)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join()
+    result['children_peak_rss_mb'] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Saved result to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.max_regression)
+        if regressions:
+            print(f"Regressed beyond {args.max_regression:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
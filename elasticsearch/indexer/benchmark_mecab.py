@@ -0,0 +1,76 @@
+"""
+MeCabの形態素解析結果の読み取り方法を比較するベンチマーク
+
+    python benchmark_mecab.py --limit 5000          # SQLから投稿の本文を取得
+    python benchmark_mecab.py --file posts.txt      # 1行1投稿のテキストファイル
+
+ノードを直接たどる方法（mecab_words）と、ChaSen形式の文字列を分割する方法
+（mecab_words_chasen）で同じ本文を処理し、結果が一致することと処理速度を確認する。
+速度比は本文の長さや語彙、マシンによって変わるため、引用する場合は表示される投稿数・文字数と合わせて記載する。
+"""
+import argparse
+import time
+import index_data
+
+
+def load_texts_from_sql(limit):
+    conn = index_data.connect_sql()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT TOP {int(limit)} Text FROM {index_data.SOURCE_VIEW} WHERE Text IS NOT NULL")
+        return [row[0] for row in cursor.fetchall() if row[0]]
+    finally:
+        conn.close()
+
+
+def load_texts_from_file(path):
+    with open(path, encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+
+def measure(tokenize, texts, repeat):
+    """全テキストを処理する時間の最小値と、抽出した語数を返す"""
+    best = None
+    words = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        words = sum(len(tokenize(text)) for text in texts)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, words
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MeCabの解析結果の読み取り方法を比較する")
+    parser.add_argument('--file', help="1行1投稿のテキストファイル（指定しない場合はSQLから取得）")
+    parser.add_argument('--limit', type=int, default=5000, help="SQLから取得する投稿数")
+    parser.add_argument('--repeat', type=int, default=3, help="計測の繰り返し回数（最小値を採用）")
+    args = parser.parse_args(argv)
+
+    texts = load_texts_from_file(args.file) if args.file else load_texts_from_sql(args.limit)
+    total_chars = sum(len(text) for text in texts)
+    print(f"Loaded {len(texts)} posts ({total_chars} characters).")
+
+    index_data.init_mecab()
+    if index_data.mecab is None:
+        print("MeCab is not available.")
+        return
+
+    # 両方の方法で抽出結果が一致することを確認
+    mismatches = [text for text in texts if index_data.mecab_words(text) != index_data.mecab_words_chasen(text)]
+    print(f"Mismatched posts: {len(mismatches)}")
+    for text in mismatches[:3]:
+        print(f"  {text[:50]!r}")
+
+    results = {}
+    for name, tokenize in (('chasen', index_data.mecab_words_chasen), ('node', index_data.mecab_words)):
+        elapsed, words = measure(tokenize, texts, args.repeat)
+        results[name] = elapsed
+        print(f"{name:>6}: {elapsed:.3f}s, {len(texts) / elapsed:.0f} posts/sec, "
+              f"{total_chars / elapsed / 1000:.0f}k chars/sec, {words} words")
+
+    print(f"Speedup (chasen / node): {results['chasen'] / results['node']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -137,6 +137,7 @@ def main():
         print("index_data.pyを実行します...")
         # オリジナルのスクリプトをインポート
         import index_data
+        index_data.main()
         print("index_data.pyの実行が完了しました")
     except Exception as e:
         print("エラーが発生しました:")
@@ -0,0 +1,187 @@
+"""
+Elasticsearchへの_bulkリクエストを複数スレッドで並列に送信するライター
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from elasticsearch import TransportError
+from elasticsearch.helpers import expand_action
+
+# バルクスレッドプールが溢れた場合のステータス
+REJECTED_STATUS = 429
+REJECTED_ERROR_TYPE = 'es_rejected_execution_exception'
+
+
+def _is_rejected(status, error):
+    """キューが溢れて拒否されたレスポンスか判定する"""
+    if status == REJECTED_STATUS:
+        return True
+    return isinstance(error, dict) and error.get('type') == REJECTED_ERROR_TYPE
+
+
+class BulkWriter:
+    """_bulkリクエストを並列に送信し、拒否された場合は自動でバックオフする
+
+    チャンクはドキュメント数とバイト数の両方で区切る。
+    429/es_rejected_execution_exception を受けた場合はチャンクのドキュメント数を半分にし、
+    成功が続くと設定値まで少しずつ戻す。
+    metricsを指定した場合は、リクエストのレイテンシ・バイト数・送信中のチャンク数・送信待ちの時間を記録する。
+    """
+
+    def __init__(self, es, threads=4, chunk_size=500, min_chunk_size=50,
+                 max_chunk_bytes=5 * 1024 * 1024, max_retries=5,
+                 initial_backoff=1, max_backoff=60, log_interval=10, metrics=None):
+        self.es = es
+        self.threads = max(threads, 1)
+        self.chunk_size = chunk_size
+        self.min_chunk_size = min(min_chunk_size, chunk_size)
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.log_interval = log_interval
+        self.metrics = metrics
+
+        self._lock = threading.Lock()
+        self.current_chunk_size = chunk_size
+        self.chunks = 0
+        self.docs = 0
+        self.bytes = 0
+        self.rejections = 0
+        self.latencies = []
+        self.started = None
+
+    def _serialize(self, action):
+        """アクションを_bulkのNDJSON行に変換する"""
+        serializer = self.es.transport.serializer
+        meta, data = expand_action(action)
+        line = serializer.dumps(meta) + "\n"
+        if data is not None:
+            line += serializer.dumps(data) + "\n"
+        return line
+
+    def _chunks(self, actions):
+        """ドキュメント数とバイト数の上限でアクションをチャンクに分割する"""
+        chunk = []
+        size = 0
+        for action in actions:
+            line = self._serialize(action)
+            line_size = len(line.encode('utf-8'))
+            if chunk and (len(chunk) >= self.current_chunk_size or size + line_size > self.max_chunk_bytes):
+                yield chunk, size
+                chunk, size = [], 0
+            chunk.append(line)
+            size += line_size
+        if chunk:
+            yield chunk, size
+
+    def _backoff(self, attempt):
+        time.sleep(min(self.max_backoff, self.initial_backoff * (2 ** attempt)))
+
+    def _record(self, docs, size, latency, rejected):
+        """チャンクの結果を記録し、次のチャンクサイズを調整する"""
+        if self.metrics is not None:
+            self.metrics.inc('indexer_bulk_requests_total')
+            self.metrics.inc('indexer_bulk_bytes_sent_total', size)
+            self.metrics.observe('indexer_bulk_request_seconds', latency)
+            if rejected:
+                self.metrics.inc('indexer_bulk_rejections_total')
+        with self._lock:
+            if rejected:
+                self.rejections += 1
+                self.current_chunk_size = max(self.min_chunk_size, self.current_chunk_size // 2)
+            elif self.current_chunk_size < self.chunk_size:
+                step = max(1, self.chunk_size // 10)
+                self.current_chunk_size = min(self.chunk_size, self.current_chunk_size + step)
+
+            self.chunks += 1
+            self.docs += docs
+            self.bytes += size
+            self.latencies.append(latency)
+
+            if self.chunks % self.log_interval == 0:
+                elapsed = time.time() - self.started
+                print(f"Bulk chunk #{self.chunks}: {docs} docs in {latency:.3f}s, "
+                      f"total {self.docs} docs ({self.docs / elapsed:.0f} docs/sec), "
+                      f"chunk size {self.current_chunk_size}")
+
+    def _send(self, lines, size):
+        """1チャンクを送信し、(成功したか, レスポンス項目) のリストを返す"""
+        results = []
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                resp = self.es.bulk(body="".join(lines))
+            except TransportError as e:
+                if e.status_code == REJECTED_STATUS and attempt < self.max_retries:
+                    self._record(0, 0, time.time() - start, rejected=True)
+                    self._backoff(attempt)
+                    attempt += 1
+                    continue
+                raise
+            latency = time.time() - start
+
+            retry = []
+            for line, item in zip(lines, resp['items']):
+                info = next(iter(item.values()))
+                status = info.get('status', 500)
+                if _is_rejected(status, info.get('error')) and attempt < self.max_retries:
+                    retry.append(line)
+                    continue
+                results.append((200 <= status < 300, item))
+
+            self._record(len(lines) - len(retry), size, latency, rejected=bool(retry))
+            if not retry:
+                return results
+
+            # 拒否されたアクションだけを待ってから再送する
+            lines = retry
+            size = sum(len(line.encode('utf-8')) for line in retry)
+            self._backoff(attempt)
+            attempt += 1
+
+    def run(self, actions):
+        """アクションを並列に送信し、streaming_bulkと同じ (ok, item) を1件ずつ返すジェネレータ"""
+        self.started = time.time()
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            in_flight = set()
+            for lines, size in self._chunks(actions):
+                in_flight.add(executor.submit(self._send, lines, size))
+                self._set_in_flight(len(in_flight))
+                # 送信待ちのチャンク数を制限してメモリ使用量を抑える
+                if len(in_flight) >= self.threads * 2:
+                    waited = time.time()
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    self._add_wait(time.time() - waited)
+                    self._set_in_flight(len(in_flight))
+                    for future in done:
+                        yield from future.result()
+            waited = time.time()
+            wait(in_flight)
+            self._add_wait(time.time() - waited)
+            self._set_in_flight(0)
+            for future in in_flight:
+                yield from future.result()
+
+    def _set_in_flight(self, count):
+        if self.metrics is not None:
+            self.metrics.set('indexer_queue_depth', count, queue='bulk_in_flight')
+
+    def _add_wait(self, seconds):
+        if self.metrics is not None:
+            self.metrics.inc('indexer_wait_seconds_total', seconds, stage='bulk')
+
+    def report(self):
+        """チャンクのレイテンシとスループットの集計を表示する"""
+        if not self.latencies:
+            print("Bulk writer: no chunks were sent.")
+            return
+        elapsed = time.time() - self.started
+        latencies = sorted(self.latencies)
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"Bulk writer: {self.docs} docs, {self.bytes / 1024 / 1024:.1f} MiB in {self.chunks} chunks, "
+              f"{elapsed:.1f}s ({self.docs / elapsed if elapsed else 0:.0f} docs/sec), {self.threads} threads")
+        print(f"Bulk chunk latency: p50 {p50:.3f}s, p95 {p95:.3f}s, max {latencies[-1]:.3f}s, "
+              f"rejections {self.rejections}, final chunk size {self.current_chunk_size}")
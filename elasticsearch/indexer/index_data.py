@@ -6,73 +6,138 @@ import urllib3
 import warnings
 import re
 import json
+import queue
+import threading
+import hashlib
+import time
+import argparse
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
 from collections import Counter
+import numpy as np
 import MeCab  # 日本語形態素解析用
+from bulk_writer import BulkWriter
+from keyword_cache import KeywordCache
+from pipeline_metrics import PipelineMetrics, ProgressReporter
+from source_snapshot import Snapshot, write_snapshot, check_columns
+from kana_normalize import fold_kana, is_katakana, suggest_keys
 
 # 自己署名証明書の警告を無効化（本番環境では注意）
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 warnings.filterwarnings("ignore", category=UserWarning)
 
-# SQL Server 接続設定
-conn_str = 'DRIVER={ODBC Driver 17 for SQL Server};SERVER=' + os.environ['SQL_SERVER'] + ';DATABASE=' + os.environ['SQL_DATABASE'] + ';UID=' + os.environ['SQL_USER'] + ';PWD=' + os.environ['SQL_PASSWORD']
-
-# デバッグ情報: SQL接続開始
-print("Connecting to SQL Server...")
-
-try:
-    conn = pyodbc.connect(conn_str)
-    print("Successfully connected to SQL Server.")
-except Exception as e:
-    print(f"Failed to connect to SQL Server: {e}")
-    raise
-
-# ElasticSearch設定
-# 環境変数からホスト名を取得し、ポート443を指定
-es_host = os.environ['ELASTICSEARCH_HOST']
-print(f"Original Elasticsearch host: {es_host}")
-
-# URLからスキームとホスト名を抽出
-url_match = re.match(r'(https?://)([^:/]+)(:[0-9]+)?(/.*)?', es_host)
-if url_match:
-    scheme = url_match.group(1)
-    hostname = url_match.group(2)
-    # ポート443を明示的に使用
-    es_conn_url = f"{scheme}{hostname}:443"
-    print(f"Using Elasticsearch at: {es_conn_url}")
-else:
-    es_conn_url = es_host
-    print(f"Could not parse URL, using as is: {es_conn_url}")
-
-try:
-    # ポート443への接続を試みる
-    es = elasticsearch.Elasticsearch(
-        [es_conn_url], 
-        timeout=30, 
-        max_retries=5, 
-        retry_on_timeout=True,
-        verify_certs=False,  # 自己署名証明書の検証をスキップ
-        # ポート番号のバリデーションを回避するためのカスタム設定
-        port=443
-    )
-    
-    # 接続テスト
-    print("Testing Elasticsearch connection...")
-    if es.ping():
-        print("Successfully connected to Elasticsearch.")
-    else:
-        print("Could ping Elasticsearch, but no valid response received.")
-except Exception as e:
-    print(f"Failed to connect to Elasticsearch: {e}")
-    raise
+# インデックス名（検索クライアントが参照するエイリアス名）
+index_name = 'msprdb-index'
+# 残しておく過去世代の物理インデックス数（現在の世代を含む）
+INDEX_RETENTION = int(os.environ.get('INDEX_RETENTION', '2'))
+
+# SQLから1回のfetchmanyで取得する行数
+SQL_FETCH_SIZE = int(os.environ.get('SQL_FETCH_SIZE', '500'))
+# 先読みしておくfetchmanyバッチ数（SQL読み込みとES書き込みを重ねるためのキュー長）
+SQL_PREFETCH_BATCHES = int(os.environ.get('SQL_PREFETCH_BATCHES', '4'))
+# 全件再構築でビューを並列に読むコネクション数（1なら1つのカーソルで読む）
+SQL_READERS = int(os.environ.get('SQL_READERS', '1'))
+# 並列に読む場合にキーを分ける範囲の数（コネクション数より多くして、範囲ごとの読み込み時間の偏りを吸収する）
+SQL_PARTITIONS = int(os.environ.get('SQL_PARTITIONS', str(SQL_READERS * 4)))
+# 並列に読む場合に1回のクエリで読む行数（キーセットページングのページサイズ）
+SQL_PAGE_SIZE = int(os.environ.get('SQL_PAGE_SIZE', '10000'))
+# SQLの方言（mssql: TOPで件数を制限 / sqlite: LIMITで件数を制限。ベンチマークなどでSQLiteを読む場合に指定）
+SQL_DIALECT = os.environ.get('SQL_DIALECT', 'mssql')
+# キーワード抽出を並列に行うワーカープロセス数（1以下ならメインプロセスで処理）
+EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', str(os.cpu_count() or 1)))
+# バルクインポートのチャンクあたりの最大ドキュメント数（拒否された場合は最小値まで自動で縮小）
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', '500'))
+BULK_MIN_CHUNK_SIZE = int(os.environ.get('BULK_MIN_CHUNK_SIZE', '50'))
+# バルクインポートのチャンクあたりの最大バイト数
+BULK_MAX_CHUNK_BYTES = int(os.environ.get('BULK_MAX_CHUNK_BYTES', str(5 * 1024 * 1024)))
+# 並列にバルクリクエストを送信するスレッド数
+BULK_THREADS = int(os.environ.get('BULK_THREADS', '4'))
+# 初回投入中にtranslogを非同期書き込みにするか
+BULK_LOAD_TRANSLOG_ASYNC = os.environ.get('BULK_LOAD_TRANSLOG_ASYNC', '0') == '1'
+# 投入後にforce mergeするセグメント数（0ならforce mergeしない）
+FORCE_MERGE_SEGMENTS = int(os.environ.get('FORCE_MERGE_SEGMENTS', '0'))
+# 進捗（件数・スループット・残り時間・キューの長さ）を表示する間隔（秒。0なら終了時だけ表示）
+PROGRESS_SECONDS = int(os.environ.get('PROGRESS_SECONDS', '10'))
+# 残り時間を出すために、投入前に対象の行数をCOUNT(*)で数えるか
+PROGRESS_COUNT_ROWS = os.environ.get('PROGRESS_COUNT_ROWS', '1') == '1'
+# 段階ごとのメトリクスをPrometheusのテキスト形式で公開するポート（0なら公開しない）
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '0'))
+# 終了時にメトリクスを書き出すファイル（.jsonならJSON、それ以外はPrometheusのテキスト形式。空なら書き出さない）
+METRICS_FILE = os.environ.get('METRICS_FILE', '')
+# キーワードの順位付け方法（frequency: 投稿内の出現回数 / tfidf: 全投稿とコメントの文書頻度で重み付けしたTF-IDF）
+KEYWORD_SCORING = os.environ.get('KEYWORD_SCORING', 'frequency')
+# TF-IDFの語彙とIDFを保存するファイル（全件再構築で作り直し、差分インデックスでは再利用する）
+KEYWORD_IDF_PATH = os.environ.get(
+    'KEYWORD_IDF_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'keyword_idf.json')
+)
+# コメント1件から抽出するキーワード数
+COMMENT_MAX_KEYWORDS = int(os.environ.get('COMMENT_MAX_KEYWORDS', '5'))
+# コメントのキーワードのうち、多くのコメントに出現したものから投稿のKeywordsに追加する数
+COMMENT_KEYWORDS_TO_POST = int(os.environ.get('COMMENT_KEYWORDS_TO_POST', '10'))
+# IDFを保存する語の最小文書頻度（これ未満の語や未知語は文書頻度1として扱う）
+KEYWORD_IDF_MIN_DF = int(os.environ.get('KEYWORD_IDF_MIN_DF', '2'))
+# 抽出済みキーワードをメモリに保持する件数（0ならキャッシュしない）
+KEYWORD_CACHE_SIZE = int(os.environ.get('KEYWORD_CACHE_SIZE', '100000'))
+# 抽出済みキーワードを保存するSQLiteファイル（空ならメモリのみ。再構築をまたいで再利用する場合に指定）
+KEYWORD_CACHE_PATH = os.environ.get('KEYWORD_CACHE_PATH', '')
+
+# ドキュメントIDに使うカラム
+ID_COLUMN = os.environ.get('INDEX_ID_COLUMN', 'PostId')
+# バルクの操作種別（index: ドキュメント全体を置き換え / update: 部分更新、存在しなければ作成）
+INDEX_OP_TYPE = os.environ.get('INDEX_OP_TYPE', 'index')
+# 内容のハッシュが既存ドキュメントと同じ場合は送信しない（差分インデックス時のみ有効）
+SKIP_UNCHANGED = os.environ.get('SKIP_UNCHANGED', '0') == '1'
+# 差分インデックスの基準にする日時カラム（ビューに存在するものだけ使用）
+WATERMARK_COLUMNS = ['CreatedAt', 'CommentedAt', 'DeletedAt']
+# 差分取得時に遡る秒数（取得中にコミットされた行の取りこぼし対策）
+WATERMARK_OVERLAP_SECONDS = int(os.environ.get('WATERMARK_OVERLAP_SECONDS', '60'))
+# 論理削除された投稿（DeletedAtあり）をインデックスから除外するか
+EXCLUDE_DELETED = os.environ.get('EXCLUDE_DELETED', '1') == '1'
+# SQLではインデックスするカラムだけを取得し、全件再構築では論理削除された行をSQL側で除外するか（0ならSELECT *で全行を読む）
+SQL_PUSHDOWN = os.environ.get('SQL_PUSHDOWN', '1') == '1'
+# 差分インデックスの状態（ハイウォーターマーク）を保存するファイル
+INDEX_STATE_PATH = os.environ.get(
+    'INDEX_STATE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index_state.json')
+)
+
+# 全件再構築の途中経過（書き込みが確認できた行のキー）を保存し、失敗した場合は--resumeで続きから再開できるようにするか
+FULL_CHECKPOINT = os.environ.get('FULL_CHECKPOINT', '1') == '1'
+# 途中経過を保存する間隔（秒）
+CHECKPOINT_INTERVAL_SECONDS = int(os.environ.get('CHECKPOINT_INTERVAL_SECONDS', '30'))
 
-# インデックス設定 - keywordsフィールドも適切に設定
+# ソースとなるビュー
+SOURCE_VIEW = 'Mspr.PostCommentView'
+# ビューを書き出したスナップショット（--mode exportで作成し、--source snapshotでSQLの代わりに読み込む）
+SNAPSHOT_PATH = os.environ.get(
+    'SNAPSHOT_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'msprdb_snapshot.ndjson.gz')
+)
+
+# サジェスト用のcompletionサブフィールド
+suggest_field = {
+    "type": "completion",
+    "analyzer": "ja_analyzer"
+}
+
+# インデックス設定 - アナライザーとサジェスト用フィールドを作成時に定義し、データは1回だけ書き込む
 index_settings = {
     "settings": {
         "analysis": {
             "analyzer": {
                 "ja_analyzer": {
                     "type": "custom",
-                    "tokenizer": "kuromoji_tokenizer"
+                    "tokenizer": "kuromoji_tokenizer",
+                    "filter": ["kuromoji_baseform", "kuromoji_part_of_speech", "ja_stop", "kuromoji_stemmer"]
+                }
+            },
+            "filter": {
+                "ja_stop": {
+                    "type": "stop",
+                    "stopwords": "_japanese_"
                 }
             }
         }
@@ -84,29 +149,39 @@ index_settings = {
             "PostId": {"type": "keyword"},
             "PostedAt": {"type": "date"},
             "PostedUser": {"type": "keyword"},
-            "Text": {"type": "text", "analyzer": "ja_analyzer"},
+            "Text": {
+                "type": "text",
+                "analyzer": "ja_analyzer",
+                "fields": {
+                    "suggest": suggest_field
+                }
+            },
             "DeletedAt": {"type": "date"},
             "PostStatus": {"type": "integer"},
+            # 変更検出用のハッシュ（検索対象にはしない）
+            "ContentHash": {"type": "keyword", "index": False},
             # HashTagsフィールドとして明示的に定義
             "HashTags": {
-                "type": "text", 
+                "type": "text",
                 "analyzer": "ja_analyzer",
                 "fields": {
                     "keyword": {
                         "type": "keyword",
                         "ignore_above": 256
-                    }
+                    },
+                    "suggest": suggest_field
                 }
             },
             # Keywordsフィールドとして明示的に定義
             "Keywords": {
-                "type": "text", 
+                "type": "text",
                 "analyzer": "ja_analyzer",
                 "fields": {
                     "keyword": {
                         "type": "keyword",
                         "ignore_above": 256
-                    }
+                    },
+                    "suggest": suggest_field
                 }
             },
             "Comments": {
@@ -116,103 +191,850 @@ index_settings = {
                     "CreatedAt": {"type": "date"},
                     "CommentId": {"type": "keyword"},
                     "CommentedUser": {"type": "keyword"},
-                    "Text": {"type": "text", "analyzer": "ja_analyzer"},
+                    "Text": {
+                        "type": "text",
+                        "analyzer": "ja_analyzer",
+                        "fields": {
+                            "suggest": suggest_field
+                        }
+                    },
                     "CommentedAt": {"type": "date"},
-                    "DeletedAt": {"type": "date"}
+                    "DeletedAt": {"type": "date"},
+                    "Keywords": {
+                        "type": "text",
+                        "analyzer": "ja_analyzer",
+                        "fields": {
+                            "keyword": {
+                                "type": "keyword",
+                                "ignore_above": 256
+                            }
+                        }
+                    },
+                    "HashTags": {
+                        "type": "text",
+                        "analyzer": "ja_analyzer",
+                        "fields": {
+                            "keyword": {
+                                "type": "keyword",
+                                "ignore_above": 256
+                            }
+                        }
+                    }
                 }
             }
+            # ベクトル検索フィールドを追加する場合（モデルが必要）:
+            # "text_vector": {"type": "dense_vector", "dims": 768},
+            # "comments_vector": {"type": "dense_vector", "dims": 768}
         }
     }
 }
 
-# インデックスが存在するか確認と削除
-index_name = 'msprdb-index'
-if es.indices.exists(index=index_name):
-    print(f"Index {index_name} already exists. Deleting index...")
-    es.indices.delete(index=index_name)
-    print(f"Index {index_name} deleted.")
-
-# 新しいインデックスを作成
-print(f"Creating index: {index_name}")
-es.indices.create(index=index_name, body=index_settings)
-print(f"Index {index_name} created.")
-
-# MeCabの初期化  
-print("Initializing MeCab for keyword extraction...")  
-try:  
-    # `dicdir` を `mecabrc` に設定済みのため、`-d` オプションを削除  
-    mecab = MeCab.Tagger("-Ochasen")  
-      
-    # バグ回避のために一度パースを実行  
-    mecab.parse("")  
-    print("Successfully initialized MeCab.")  
-except Exception as e:  
-    print(f"Failed to initialize MeCab: {e}")  
-    print("Falling back to simple keyword extraction method")  
-    mecab = None  
+# サジェスト専用インデックス（キーワード・ハッシュタグごとに1ドキュメント。エイリアス名）
+suggest_index_name = 'msprdb-suggest'
+# 全件再構築・差分インデックスの後にサジェスト専用インデックスを作り直すか
+SUGGEST_INDEX_ENABLED = os.environ.get('SUGGEST_INDEX_ENABLED', '1') == '1'
+# 差分インデックスでサジェスト専用インデックスを作り直す間隔（時間）
+# 全語彙の集計と読みの解析で語彙の量に比例した時間がかかるため、毎回は作り直さない（0なら差分インデックスでは作り直さない）
+SUGGEST_REBUILD_HOURS = float(os.environ.get('SUGGEST_REBUILD_HOURS', '24'))
+# サジェスト候補の重み（frequency: 出現した投稿数 / recency: 投稿数を最後に使われた日時からの経過日数で減衰）
+SUGGEST_WEIGHT = os.environ.get('SUGGEST_WEIGHT', 'frequency')
+# recencyの場合に重みが半分になる日数
+SUGGEST_HALF_LIFE_DAYS = float(os.environ.get('SUGGEST_HALF_LIFE_DAYS', '30'))
+# サジェスト候補にする最小の投稿数
+SUGGEST_MIN_DOC_COUNT = int(os.environ.get('SUGGEST_MIN_DOC_COUNT', '1'))
+# 語の集計（composite aggregation）の1ページあたりのバケット数
+SUGGEST_AGG_PAGE_SIZE = 1000
+# MeCabの素性のうち読み（カタカナ）の位置（IPA辞書は7。読みが無い形態素は表層形を使う）
+MECAB_READING_FIELD = int(os.environ.get('MECAB_READING_FIELD', '7'))
+
+# サジェスト専用インデックスの設定（候補の種類をcontextにして、キーワードとハッシュタグを分けて取得できるようにする）
+# completionの入力には表記に加えて読み（ひらがな・ローマ字）を入れるため、形態素解析せずに幅と大文字小文字だけをそろえる
+suggest_index_settings = {
+    "settings": {
+        "number_of_shards": 1,
+        "analysis": {
+            "analyzer": dict(
+                index_settings["settings"]["analysis"]["analyzer"],
+                suggest_analyzer={
+                    "type": "custom",
+                    "tokenizer": "keyword",
+                    "filter": ["cjk_width", "lowercase"]
+                }
+            ),
+            "filter": index_settings["settings"]["analysis"]["filter"]
+        }
+    },
+    "mappings": {
+        "properties": {
+            "Term": {"type": "keyword"},
+            "Reading": {"type": "keyword"},
+            "Type": {"type": "keyword"},
+            "DocCount": {"type": "integer"},
+            "LastUsedAt": {"type": "date"},
+            "suggest": {
+                "type": "completion",
+                "analyzer": "suggest_analyzer",
+                "contexts": [
+                    {"name": "type", "type": "category", "path": "Type"}
+                ]
+            }
+        }
+    }
+}
+
+# re-suggestで並列に処理するスクロールのスライス数
+RESUGGEST_SLICES = int(os.environ.get('RESUGGEST_SLICES', '4'))
+
+# MeCabのTagger（init_mecabで初期化）
+mecab = None
+# キーワードとして抽出する品詞（一般的なキーワードは名詞が多い）
+KEYWORD_POS = ('名詞', '動詞', '形容詞')
+# 品詞IDごとに抽出対象かどうか（辞書によってIDが異なるため、初めて出現した時に素性から判定して記録する）
+keyword_posids = {}
+# 抽出済みキーワードのキャッシュ（init_mecabで初期化）
+keyword_cache = None
+# TF-IDF用の語彙とIDF（load_keyword_idfで読み込む）
+keyword_idf = None
+# パイプラインの段階ごとのメトリクス
+metrics = PipelineMetrics()
+
+
+def connect_sql():
+    """SQL Serverへ接続する"""
+    # SQL Server 接続設定
+    conn_str = 'DRIVER={ODBC Driver 17 for SQL Server};SERVER=' + os.environ['SQL_SERVER'] + ';DATABASE=' + os.environ['SQL_DATABASE'] + ';UID=' + os.environ['SQL_USER'] + ';PWD=' + os.environ['SQL_PASSWORD']
+
+    # デバッグ情報: SQL接続開始
+    print("Connecting to SQL Server...")
+
+    try:
+        conn = pyodbc.connect(conn_str)
+        print("Successfully connected to SQL Server.")
+    except Exception as e:
+        print(f"Failed to connect to SQL Server: {e}")
+        raise
+    return conn
+
+
+def connect_snapshot():
+    """SQL Serverの代わりに読み込むスナップショットを開く"""
+    print(f"Opening snapshot {SNAPSHOT_PATH}...")
+    snapshot = Snapshot(SNAPSHOT_PATH)
+    if snapshot.header['view'] != SOURCE_VIEW:
+        raise RuntimeError(f"Snapshot {SNAPSHOT_PATH} was exported from {snapshot.header['view']}, not {SOURCE_VIEW}.")
+    print(f"Snapshot has {snapshot.rows} rows exported at {snapshot.header['exported_at']}.")
+    return snapshot
+
+
+def connect_elasticsearch():
+    """Elasticsearchへ接続する"""
+    # 環境変数からホスト名を取得し、ポート443を指定
+    es_host = os.environ['ELASTICSEARCH_HOST']
+    print(f"Original Elasticsearch host: {es_host}")
+
+    # URLからスキームとホスト名を抽出
+    url_match = re.match(r'(https?://)([^:/]+)(:[0-9]+)?(/.*)?', es_host)
+    if url_match:
+        scheme = url_match.group(1)
+        hostname = url_match.group(2)
+        # ポート443を明示的に使用
+        es_conn_url = f"{scheme}{hostname}:443"
+        print(f"Using Elasticsearch at: {es_conn_url}")
+    else:
+        es_conn_url = es_host
+        print(f"Could not parse URL, using as is: {es_conn_url}")
+
+    try:
+        # ポート443への接続を試みる
+        es = elasticsearch.Elasticsearch(
+            [es_conn_url],
+            timeout=30,
+            max_retries=5,
+            retry_on_timeout=True,
+            verify_certs=False,  # 自己署名証明書の検証をスキップ
+            # ポート番号のバリデーションを回避するためのカスタム設定
+            port=443
+        )
+
+        # 接続テスト
+        print("Testing Elasticsearch connection...")
+        if es.ping():
+            print("Successfully connected to Elasticsearch.")
+        else:
+            print("Could ping Elasticsearch, but no valid response received.")
+    except Exception as e:
+        print(f"Failed to connect to Elasticsearch: {e}")
+        raise
+    return es
+
+
+def create_index_generation(es, alias=index_name, body=None):
+    """タイムスタンプ付きの新しい物理インデックスを作成する
+
+    エイリアスが指す現在のインデックスには触れないため、再構築中も検索を継続できる。
+    """
+    physical_index = f"{alias}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    print(f"Creating index: {physical_index}")
+    es.indices.create(index=physical_index, body=body or index_settings)
+    print(f"Index {physical_index} created.")
+    return physical_index
+
+
+# 投入中だけ変更するインデックス設定
+BULK_LOAD_SETTING_KEYS = ("index.refresh_interval", "index.number_of_replicas", "index.translog.durability")
+
+
+def read_index_settings(es, physical_index):
+    """投入中だけ変更する項目の現在の設定を返す（明示的に設定されていない項目はNoneで、復元するとデフォルト値に戻る）"""
+    current = es.indices.get_settings(index=physical_index, name=",".join(BULK_LOAD_SETTING_KEYS), flat_settings=True)
+    current = current.get(physical_index, {}).get('settings', {})
+    return {key: current.get(key) for key in BULK_LOAD_SETTING_KEYS}
+
+
+def apply_bulk_load_settings(es, physical_index):
+    """投入用の設定（リフレッシュ停止・レプリカ0）に切り替える
+
+    戻す設定は切り替える前にread_index_settingsで読んでおく（中断した世代から読むと投入用の設定が返るため）。
+    """
+    profile = {
+        "index.refresh_interval": "-1",
+        "index.number_of_replicas": 0
+    }
+    if BULK_LOAD_TRANSLOG_ASYNC:
+        profile["index.translog.durability"] = "async"
+
+    print(f"Applying bulk-load settings to {physical_index}: {profile}")
+    es.indices.put_settings(body=profile, index=physical_index)
+
+
+def restore_index_settings(es, physical_index, previous):
+    """投入用の設定を元の本番用の設定に戻し、戻せたかを返す（失敗した場合は記録するだけで例外は投げない）"""
+    print(f"Restoring index settings of {physical_index}: {previous}")
+    try:
+        es.indices.put_settings(body=previous, index=physical_index)
+    except Exception as e:
+        print(f"Failed to restore index settings of {physical_index}: {e}")
+        return False
+    return True
+
+
+def finish_bulk_load(es, physical_index):
+    """投入後に1回だけリフレッシュし、必要に応じてforce mergeする"""
+    print(f"Refreshing index {physical_index}...")
+    es.indices.refresh(index=physical_index)
+    if FORCE_MERGE_SEGMENTS > 0:
+        print(f"Force merging {physical_index} to {FORCE_MERGE_SEGMENTS} segments...")
+        es.indices.forcemerge(index=physical_index, max_num_segments=FORCE_MERGE_SEGMENTS, request_timeout=3600)
+
+
+def verify_index(es, physical_index, expected_count):
+    """投入件数とインデックスのドキュメント数が一致するか確認する"""
+    count = es.count(index=physical_index)['count']
+    print(f"Index {physical_index} contains {count} documents (expected {expected_count}).")
+    return count == expected_count
+
+
+def swap_alias(es, physical_index, alias=index_name):
+    """1回の_aliases呼び出しでエイリアスを新しいインデックスへ切り替える"""
+    actions = []
+    if es.indices.exists_alias(name=alias):
+        for old_index in es.indices.get_alias(name=alias):
+            actions.append({"remove": {"index": old_index, "alias": alias}})
+    elif es.indices.exists(index=alias):
+        # 旧方式で作成されたエイリアスと同名の実インデックスは、切り替えと同時に削除する
+        print(f"Index {alias} is a concrete index; it will be replaced by alias.")
+        actions.append({"remove_index": {"index": alias}})
+    actions.append({"add": {"index": physical_index, "alias": alias}})
+
+    es.indices.update_aliases(body={"actions": actions})
+    print(f"Alias {alias} now points to {physical_index}.")
+
+
+def prune_index_generations(es, alias=index_name):
+    """保持数を超えた古い世代の物理インデックスを削除する"""
+    pattern = re.compile(rf"^{re.escape(alias)}-\d{{14}}$")
+    generations = sorted((i for i in es.indices.get(index=f"{alias}-*") if pattern.match(i)), reverse=True)
+    aliased = set(es.indices.get_alias(name=alias)) if es.indices.exists_alias(name=alias) else set()
+    for old_index in generations[max(INDEX_RETENTION, 1):]:
+        if old_index in aliased:
+            continue
+        print(f"Deleting old index generation {old_index}...")
+        es.indices.delete(index=old_index)
+
+
+def load_state():
+    """保存済みのインデックス状態を読み込む"""
+    if not os.path.exists(INDEX_STATE_PATH):
+        return {}
+    try:
+        with open(INDEX_STATE_PATH, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Warning: Could not read index state {INDEX_STATE_PATH}: {e}")
+        return {}
+
+
+def save_state(state):
+    """インデックス状態を保存する（書き込み途中で壊れないよう置き換えで保存）"""
+    tmp_path = INDEX_STATE_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, INDEX_STATE_PATH)
+    print(f"Index state saved to {INDEX_STATE_PATH}: {state}")
+
+
+def get_view_columns(cursor):
+    """ビューのカラム名一覧を取得する"""
+    cursor.execute(f"SELECT * FROM {SOURCE_VIEW} WHERE 1 = 0")
+    return [column[0] for column in cursor.description]
+
+
+def source_select_list(columns):
+    """ビューのカラムのうち、インデックスするもの（マッピングのフィールド、ドキュメントID、日時カラム）だけのSELECTリストを返す"""
+    if not SQL_PUSHDOWN:
+        return "*"
+    needed = set(index_settings['mappings']['properties']) | {ID_COLUMN} | set(WATERMARK_COLUMNS)
+    select = []
+    for column in columns:
+        if column not in needed:
+            continue
+        if column == 'Keywords' and 'Text' in columns:
+            # 本文がある行のKeywordsは抽出したキーワードで上書きするため、本文が空の行の分だけ取得する
+            select.append("CASE WHEN Text IS NULL OR Text LIKE '' THEN Keywords END AS Keywords")
+        else:
+            select.append(column)
+    return ", ".join(select)
+
+
+def source_filter(columns):
+    """全件再構築でSQL側で除外する行の条件を返す（論理削除された行はインデックスしないため読まない）"""
+    if SQL_PUSHDOWN and EXCLUDE_DELETED and 'DeletedAt' in columns:
+        return "DeletedAt IS NULL"
+    return "1 = 1"
+
+
+def build_incremental_query(columns, watermark):
+    """ハイウォーターマーク以降に作成・コメント・削除された行を取得するクエリを組み立てる
+
+    削除された行もインデックスから削除するために読むため、論理削除の条件は付けない。
+    """
+    watermark_columns = [c for c in WATERMARK_COLUMNS if c in columns]
+    if not watermark_columns:
+        raise ValueError(f"None of the watermark columns {WATERMARK_COLUMNS} exist in {SOURCE_VIEW}")
+
+    since = watermark - timedelta(seconds=WATERMARK_OVERLAP_SECONDS)
+    where = " OR ".join(f"{c} > ?" for c in watermark_columns)
+    return f"SELECT {source_select_list(columns)} FROM {SOURCE_VIEW} WHERE {where}", [since] * len(watermark_columns)
+
+
+class Watermark:
+    """処理した行の日時カラムの最大値を記録する"""
+
+    def __init__(self, value=None):
+        self.value = value
+
+    def track(self, batches):
+        """バッチをそのまま流しつつ最大値を更新するジェネレータ"""
+        for batch in batches:
+            for row_dict in batch:
+                for column in WATERMARK_COLUMNS:
+                    value = row_dict.get(column)
+                    if isinstance(value, datetime) and (self.value is None or value > self.value):
+                        self.value = value
+            yield batch
+
+
+def read_source_watermark(conn):
+    """全件再構築の読み込みを始める前に、ソースの日時カラムの最大値を返す（値が無い場合はNone）
+
+    行はキーの順に時間をかけて読むため、読んだ行の最大値をハイウォーターマークにすると、
+    読み込み中に読み終えた位置より前のキーで追加・更新された行が次の差分インデックスでも拾われない。
+    読み込み前の最大値にすれば、それらの行は次の差分インデックスで読み直される。
+    """
+    if isinstance(conn, Snapshot):
+        # 書き出す前に取得した値を使う（記録していない以前のスナップショットは全行の最大値）
+        if conn.watermark is not None:
+            return conn.watermark
+        columns = [column for column in WATERMARK_COLUMNS if column in conn.columns]
+        if not columns:
+            return None
+        watermark = Watermark()
+        cursor = conn.cursor(columns=columns)
+        try:
+            for _ in watermark.track(fetch_batches(cursor)):
+                pass
+        finally:
+            cursor.close()
+        return watermark.value
+
+    cursor = conn.cursor()
+    try:
+        columns = [column for column in WATERMARK_COLUMNS if column in get_view_columns(cursor)]
+        if not columns:
+            return None
+        cursor.execute(f"SELECT {', '.join(f'MAX({column})' for column in columns)} FROM {SOURCE_VIEW}")
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    # SQLiteではMAXの結果が文字列になるため日時に戻す
+    values = [datetime.fromisoformat(value) if isinstance(value, str) else value for value in row if value is not None]
+    return max(values) if values else None
+
+
+class Checkpoint:
+    """全件再構築で、Elasticsearchへの書き込みが確認できた行のキーを記録して保存する
+
+    行はキー（ID_COLUMN）の順に読み、SQLのバッチ内の全ドキュメントの成功が確認でき、
+    それより前のバッチも全て完了した時点で、そのバッチの最後の行のキーを再開位置にする。
+    書き込みに失敗したドキュメントがあるバッチより先には再開位置を進めない。
+    キーの範囲ごとに並列に読む場合（ranges）は、範囲ごとに再開位置（範囲の開始キー）を進める。
+    """
+
+    def __init__(self, state, physical_index, last_key=None, indexed=0, watermark=None, ranges=None,
+                 index_settings=None):
+        self.state = state
+        self.physical_index = physical_index
+        self.last_key = last_key
+        self.indexed = indexed
+        # 最初の実行で読み込む前に取得したハイウォーターマーク（再開しても読んだ行で更新しない）
+        self.watermark = watermark
+        # キーの範囲（[このキーより後, このキーまで]）のリスト。1つのカーソルで読む場合はNone
+        self.ranges = ranges
+        # 世代を作成した時点の本番用の設定（投入後に戻す）
+        self.index_settings = index_settings
+        # 完了待ちのバッチ（[最後の行のキー, 未確認のドキュメント数, ドキュメント数, 範囲の番号]）を範囲ごとに読んだ順に保持する
+        self._pending = {}
+        # ドキュメントIDごとの、そのIDを送信したバッチ（ビューが同じIDの行を複数返す場合もあるため、送信した順に全て保持する）
+        self._batch_of = {}
+        self._saved_at = time.time()
+
+    def position(self):
+        """再開位置の説明を返す"""
+        if self.ranges is not None:
+            return f"{len(self.ranges)} key ranges of {ID_COLUMN}"
+        if self.last_key is None:
+            return "the first row"
+        return f"{ID_COLUMN} > {self.last_key!r}"
+
+    def add_batch(self, last_key, ids, range_id=None):
+        """送信する前に、バッチの最後の行のキーとドキュメントIDを登録する"""
+        entry = [last_key, len(ids), len(ids), range_id]
+        self._pending.setdefault(range_id, deque()).append(entry)
+        for doc_id in ids:
+            self._batch_of.setdefault(doc_id, deque()).append(entry)
+        self._advance(range_id)
+
+    def done(self, ok, item):
+        """バルクの結果1件を反映する（失敗したドキュメントのバッチは完了しない）"""
+        info = next(iter(item.values()))
+        entries = self._batch_of.get(info.get('_id'))
+        if not entries:
+            return
+        # 同じIDの結果は1件ごとに1つのバッチに反映する（どのバッチの結果かは区別できないため、送信した順に割り当てる）
+        entry = entries.popleft()
+        if not entries:
+            del self._batch_of[info.get('_id')]
+        if ok:
+            entry[1] -= 1
+            self._advance(entry[3])
+
+    def _advance(self, range_id):
+        pending = self._pending.get(range_id)
+        while pending and pending[0][1] == 0:
+            last_key, _, count, _ = pending.popleft()
+            if range_id is None:
+                self.last_key = last_key
+            else:
+                self.ranges[range_id][0] = last_key
+            self.indexed += count
+        if time.time() - self._saved_at >= CHECKPOINT_INTERVAL_SECONDS:
+            self.save()
+
+    def save(self):
+        """再開位置をインデックス状態のファイルに保存する"""
+        self.state['checkpoint'] = {
+            "index": self.physical_index,
+            "key_column": ID_COLUMN,
+            "last_key": self.last_key,
+            "ranges": self.ranges,
+            "index_settings": self.index_settings,
+            "indexed": self.indexed,
+            "source_watermark": self.watermark.isoformat() if self.watermark else None,
+            "updated_at": datetime.now().isoformat()
+        }
+        save_state(self.state)
+        self._saved_at = time.time()
+
+
+def load_checkpoint(es, state):
+    """中断した全件再構築の途中経過を読み込む"""
+    saved = state.get('checkpoint')
+    if not saved:
+        raise RuntimeError("No checkpoint to resume from. Run a full rebuild without --resume.")
+    if saved.get('key_column') != ID_COLUMN:
+        raise RuntimeError(f"Checkpoint was recorded by {saved.get('key_column')}, not {ID_COLUMN}.")
+    if not es.indices.exists(index=saved['index']):
+        raise RuntimeError(f"Index {saved['index']} of the checkpoint no longer exists.")
+    if 'source_watermark' in saved:
+        watermark = datetime.fromisoformat(saved['source_watermark']) if saved['source_watermark'] else None
+    else:
+        # 読んだ行の最大値を記録していた以前のチェックポイントは、中断した再構築の前のハイウォーターマークから読み直す
+        watermark = datetime.fromisoformat(state['watermark']) if state.get('watermark') else None
+        print(f"Checkpoint has no watermark taken before reading; using the previous watermark {state.get('watermark')}")
+    checkpoint = Checkpoint(state, saved['index'], saved['last_key'], saved['indexed'], watermark, saved.get('ranges'),
+                            saved.get('index_settings'))
+    print(f"Resuming rebuild of {saved['index']} from {checkpoint.position()} "
+          f"({saved['indexed']} documents already indexed)")
+    return checkpoint
+
+
+def discard_checkpoint(es, state):
+    """再開しなかった全件再構築の途中経過と、その未完成の世代を削除する"""
+    saved = state.pop('checkpoint', None)
+    if not saved:
+        return
+    aliased = set(es.indices.get_alias(name=index_name)) if es.indices.exists_alias(name=index_name) else set()
+    if saved['index'] not in aliased:
+        print(f"Discarding checkpoint of an interrupted rebuild. Deleting {saved['index']}...")
+        es.indices.delete(index=saved['index'], ignore=[404])
+    save_state(state)
+
+
+def init_mecab():
+    """MeCabを初期化する（失敗した場合は簡易抽出にフォールバック）"""
+    global mecab, keyword_cache, keyword_posids
+    print("Initializing MeCab for keyword extraction...")
+    try:
+        # `dicdir` を `mecabrc` に設定済みのため、`-d` オプションを削除
+        mecab = MeCab.Tagger("-Ochasen")
+
+        # バグ回避のために一度パースを実行
+        mecab.parse("")
+
+        # 品詞IDが定義されていない辞書（全て同じID）では、IDごとの判定を使わない
+        keyword_posids = {}
+        posids = set()
+        node = mecab.parseToNode("東京で新しい店を見つけた")
+        while node:
+            if node.stat in (MeCab.MECAB_NOR_NODE, MeCab.MECAB_UNK_NODE):
+                posids.add(node.posid)
+            node = node.next
+        if len(posids) <= 1:
+            keyword_posids = None
+        print("Successfully initialized MeCab.")
+    except Exception as e:
+        print(f"Failed to initialize MeCab: {e}")
+        print("Falling back to simple keyword extraction method")
+        mecab = None
+
+    if KEYWORD_CACHE_SIZE > 0 and keyword_cache is None:
+        # 抽出方法や辞書が変わった場合に古い結果を使わないよう、namespaceに含める
+        if mecab:
+            namespace = f"mecab:{mecab.dictionary_info().filename}"
+        else:
+            namespace = "simple"
+        keyword_cache = KeywordCache(namespace, max_entries=KEYWORD_CACHE_SIZE, path=KEYWORD_CACHE_PATH or None)
+
+
+def mecab_words(text):
+    """形態素を1つずつたどり、抽出対象の品詞の2文字以上の表層形を返す
+
+    ChaSen形式の文字列を組み立てて分割する代わりに、ノードの表層形と品詞IDを直接読む。
+    """
+    words = []
+    node = mecab.parseToNode(text)
+    while node:
+        # 文頭・文末のノードは除く
+        if node.stat == MeCab.MECAB_NOR_NODE or node.stat == MeCab.MECAB_UNK_NODE:
+            if keyword_posids is None:
+                allowed = node.feature.split(',', 1)[0] in KEYWORD_POS
+            else:
+                allowed = keyword_posids.get(node.posid)
+                if allowed is None:
+                    allowed = keyword_posids[node.posid] = node.feature.split(',', 1)[0] in KEYWORD_POS
+            if allowed:
+                word = node.surface
+                if len(word) > 1:
+                    words.append(word)
+        node = node.next
+    return words
+
+
+def mecab_words_chasen(text):
+    """mecab_wordsと同じ抽出を、ChaSen形式の出力を分割して行う（比較用）"""
+    # 形態素解析を実行
+    parsed = mecab.parse(text)
+    words = []
+
+    for line in parsed.split('\n'):
+        if line == 'EOS' or line == '':
+            continue
+
+        parts = line.split('\t')
+        if len(parts) >= 4:
+            word = parts[0]
+            pos = parts[3].split('-')[0]  # 品詞
+
+            if pos in KEYWORD_POS and len(word) > 1:
+                words.append(word)
+    return words
+
+
+def simple_words(text):
+    """MeCabが使えない場合に、正規表現で区切った語を返す"""
+    # 日本語と英語の混在テキストに対応
+    words = []
+
+    # 英数字を含む「単語」を抽出（正規表現で単語の区切りを検出）
+    english_words = re.findall(r'[a-zA-Z0-9_]+', text)
+    words.extend([w for w in english_words if len(w) > 1])
+
+    # 日本語文字の塊を抽出
+    japanese_chars = re.sub(r'[a-zA-Z0-9_\s.,!?()[\]{}:;"\'<>\/\\|@#$%^&*~`+=_-]', ' ', text)
+
+    # 空白で分割して短すぎる単語を除外
+    japanese_words = [w for w in japanese_chars.split() if len(w) > 1]
+    words.extend(japanese_words)
+    return words
+
+
+def keyword_candidates(text):
+    """キーワード候補となる語を本文中の出現順に返す"""
+    # MeCabを使った形態素解析による高度なキーワード抽出
+    if mecab:
+        # 形態素解析を実行し、名詞、動詞、形容詞を抽出
+        return mecab_words(text)
+    return simple_words(text)
+
+
+def keyword_reading(term):
+    """語の読み（カタカナ）をMeCabの素性から組み立てて返す（MeCabが使えない場合はNone）"""
+    if not mecab:
+        return None
+    parts = []
+    node = mecab.parseToNode(term)
+    while node:
+        if node.stat == MeCab.MECAB_NOR_NODE or node.stat == MeCab.MECAB_UNK_NODE:
+            features = node.feature.split(',')
+            reading = features[MECAB_READING_FIELD] if len(features) > MECAB_READING_FIELD else ''
+            # 未知語や英数字など読みが無い形態素は表層形のまま使う
+            parts.append(reading if is_katakana(reading) else node.surface)
+        node = node.next
+    return ''.join(parts) or None
+
 
 # テキストからキーワードを抽出する関数
 def extract_keywords(text, max_keywords=10):
     if not text:
         return []
-    
+
+    # 同じ本文は形態素解析せずにキャッシュの結果を使う
+    if keyword_cache is not None:
+        cached = keyword_cache.get(text, max_keywords)
+        if cached is not None:
+            return cached
+
     try:
-        # MeCabを使った形態素解析による高度なキーワード抽出
-        if mecab:
-            # 形態素解析を実行
-            parsed = mecab.parse(text)
-            words = []
-            
-            # 名詞、動詞の基本形を抽出
-            for line in parsed.split('\n'):
-                if line == 'EOS' or line == '':
-                    continue
-                    
-                parts = line.split('\t')
-                if len(parts) >= 4:
-                    word = parts[0]
-                    pos = parts[3].split('-')[0]  # 品詞
-                    
-                    # 名詞、動詞、形容詞を抽出（一般的なキーワードは名詞が多い）
-                    if pos in ['名詞', '動詞', '形容詞'] and len(word) > 1:
-                        words.append(word)
-            
-            # 頻度でカウント
-            word_counts = Counter(words)
-            
-            # 最も頻度の高いキーワードを返す
-            return [word for word, count in word_counts.most_common(max_keywords)]
-        else:
-            # MeCabが使えない場合のフォールバック: 単純な分割と頻度カウント
-            # 日本語と英語の混在テキストに対応
-            words = []
-            
-            # 英数字を含む「単語」を抽出（正規表現で単語の区切りを検出）
-            english_words = re.findall(r'[a-zA-Z0-9_]+', text)
-            words.extend([w for w in english_words if len(w) > 1])
-            
-            # 日本語文字の塊を抽出
-            japanese_chars = re.sub(r'[a-zA-Z0-9_\s.,!?()[\]{}:;"\'<>\/\\|@#$%^&*~`+=_-]', ' ', text)
-            
-            # 空白で分割して短すぎる単語を除外
-            japanese_words = [w for w in japanese_chars.split() if len(w) > 1]
-            words.extend(japanese_words)
-            
-            # 頻度でカウント
-            word_counts = Counter(words)
-            
-            # 最も頻度の高いキーワードを返す
-            return [word for word, count in word_counts.most_common(max_keywords)]
-            
+        # 頻度でカウント
+        word_counts = Counter(keyword_candidates(text))
+
+        # 最も頻度の高いキーワードを返す
+        keywords = [word for word, count in word_counts.most_common(max_keywords)]
+
     except Exception as e:
         print(f"Error in keyword extraction: {e}")
         return []
 
+    if keyword_cache is not None:
+        keyword_cache.put(text, keywords, max_keywords)
+    return keywords
+
+
+def extract_keywords_batch(texts, max_keywords=10):
+    """複数の本文からキーワードを抽出し、入力と同じ順序で返す
+
+    キャッシュの参照と保存は全件まとめて行う。TF-IDFの場合はスコアもまとめて計算する。
+    """
+    if keyword_idf is not None:
+        return extract_keywords_tfidf(texts, max_keywords)
+    if keyword_cache is None:
+        return [extract_keywords(text, max_keywords) for text in texts]
+
+    results = keyword_cache.get_many([text or '' for text in texts], max_keywords)
+    extracted_texts = []
+    extracted = []
+    for i, keywords in enumerate(results):
+        if keywords is not None:
+            continue
+        results[i] = []
+        if not texts[i]:
+            continue
+        try:
+            word_counts = Counter(keyword_candidates(texts[i]))
+        except Exception as e:
+            print(f"Error in keyword extraction: {e}")
+            continue
+        results[i] = [word for word, count in word_counts.most_common(max_keywords)]
+        extracted_texts.append(texts[i])
+        extracted.append(results[i])
+    keyword_cache.put_many(extracted_texts, extracted, max_keywords)
+    return results
+
+
+def comment_texts(comments):
+    """Commentsの値（JSON文字列またはオブジェクト）から、削除されていないコメントの本文を返す"""
+    if isinstance(comments, str):
+        try:
+            comments = json.loads(comments)
+        except json.JSONDecodeError:
+            return []
+    if isinstance(comments, dict):
+        comments = [comments]
+    if not isinstance(comments, list):
+        return []
+    return [
+        comment['Text'] for comment in comments
+        if isinstance(comment, dict) and comment.get('Text') and comment.get('DeletedAt') is None
+    ]
+
+
+def document_terms(rows):
+    """投稿の本文とコメントごとのキーワード候補の語（重複なし）を返す（IDFの集計用。ワーカープロセスで実行される）
+
+    TF-IDFは投稿の本文とコメントの両方に使うため、コメントも1件ずつ文書として数える。
+    """
+    texts = []
+    for row in rows:
+        if row.get('Text'):
+            texts.append(row['Text'])
+        texts.extend(comment_texts(row.get('Comments')))
+    return [list(dict.fromkeys(keyword_candidates(text))) for text in texts]
+
+
+def build_keyword_idf(conn, workers=EXTRACT_WORKERS):
+    """全投稿の本文とコメントを形態素解析して文書頻度を数え、TF-IDF用の語彙とIDFをファイルに保存する"""
+    print("Counting document frequencies for TF-IDF...")
+    if isinstance(conn, Snapshot):
+        columns = [column for column in ('Text', 'Comments') if column in conn.columns]
+        selected = [conn.columns.index(column) for column in columns]
+        # DeletedAtカラムが無いスナップショットでは論理削除の条件を付けない
+        deleted = conn.columns.index('DeletedAt') if EXCLUDE_DELETED and 'DeletedAt' in conn.columns else None
+        cursor = conn.cursor(
+            columns=columns,
+            where=lambda row: any(row[i] is not None for i in selected) and (deleted is None or row[deleted] is None)
+        )
+    else:
+        query = f"SELECT Text, Comments FROM {SOURCE_VIEW} WHERE (Text IS NOT NULL OR Comments IS NOT NULL)"
+        if EXCLUDE_DELETED:
+            query += " AND DeletedAt IS NULL"
+        cursor = conn.cursor()
+        cursor.execute(query)
+    document_frequency = Counter()
+    documents = 0
+    try:
+        for terms_list in transform_batches(fetch_batches(cursor), workers, document_terms):
+            for terms in terms_list:
+                document_frequency.update(terms)
+            documents += len(terms_list)
+    finally:
+        cursor.close()
+
+    # スムージングしたIDF（scikit-learnのTfidfVectorizerと同じ式）
+    # 文書頻度がKEYWORD_IDF_MIN_DF未満の語は保存せず、未知語と同じく文書頻度1として扱う
+    default_idf = float(np.log((1 + documents) / 2) + 1)
+    idf = {
+        term: round(float(np.log((1 + documents) / (1 + df)) + 1), 6)
+        for term, df in document_frequency.items()
+        if df >= KEYWORD_IDF_MIN_DF
+    }
+    table = {
+        "version": datetime.now().strftime('%Y%m%d%H%M%S'),
+        "documents": documents,
+        "default_idf": round(default_idf, 6),
+        "idf": idf
+    }
+    tmp_path = KEYWORD_IDF_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(table, f, ensure_ascii=False)
+    os.replace(tmp_path, KEYWORD_IDF_PATH)
+    print(f"Saved IDF of {len(idf)} terms ({len(document_frequency)} seen in {documents} posts and comments) to {KEYWORD_IDF_PATH}")
+
+
+def load_keyword_idf():
+    """保存済みの語彙とIDFを読み込む（ファイルが無い場合はNone）"""
+    global keyword_idf
+    if not os.path.exists(KEYWORD_IDF_PATH):
+        keyword_idf = None
+        return None
+    with open(KEYWORD_IDF_PATH, encoding='utf-8') as f:
+        keyword_idf = json.load(f)
+    return keyword_idf
+
+
+def extract_keywords_tfidf(texts, max_keywords=10):
+    """複数の本文からTF-IDFの上位の語をまとめて抽出し、入力と同じ順序で返す
+
+    バッチ内の語に列番号を振って (行, 列, 出現回数) の疎行列を作り、
+    スコアの計算と文書ごとの上位の選択をNumPyでまとめて行う。
+    """
+    results = [[] for _ in texts]
+    params = f"tfidf:{keyword_idf['version']}:{max_keywords}"
+    if keyword_cache is not None:
+        cached = keyword_cache.get_many([text or '' for text in texts], params)
+    else:
+        cached = [None] * len(texts)
+
+    vocabulary = {}
+    rows, cols, counts = [], [], []
+    for i, text in enumerate(texts):
+        if not text:
+            continue
+        if cached[i] is not None:
+            results[i] = cached[i]
+            continue
+        try:
+            # Counterは出現順を保つため、行内の並びは本文中で最初に出現した順になる
+            word_counts = Counter(keyword_candidates(text))
+        except Exception as e:
+            print(f"Error in keyword extraction: {e}")
+            continue
+        for word, count in word_counts.items():
+            rows.append(i)
+            cols.append(vocabulary.setdefault(word, len(vocabulary)))
+            counts.append(count)
+    if not rows:
+        return results
+
+    terms = list(vocabulary)
+    idf_table = keyword_idf['idf']
+    default_idf = keyword_idf['default_idf']
+    idf = np.array([idf_table.get(term, default_idf) for term in terms])
+    rows = np.array(rows)
+    cols = np.array(cols)
+    scores = np.array(counts) * idf[cols]
+
+    # 文書ごとにスコアの降順に並べ（同点は本文中で先に出現した語を優先）、上位max_keywords件だけを残す
+    order = np.lexsort((np.arange(len(rows)), -scores, rows))
+    sorted_rows = rows[order]
+    ranks = np.arange(len(order)) - np.searchsorted(sorted_rows, sorted_rows)
+    selected = order[ranks < max_keywords]
+
+    computed = {}
+    for row, col in zip(rows[selected], cols[selected]):
+        computed.setdefault(row, []).append(terms[col])
+    for row, keywords in computed.items():
+        results[row] = keywords
+    if keyword_cache is not None:
+        missed = sorted(set(rows.tolist()))
+        keyword_cache.put_many([texts[i] for i in missed], [results[i] for i in missed], params)
+    return results
+
+
 # 文字列からハッシュタグを抽出する関数
 def extract_hashtags(text):
     if not text:
         return []
-    
+
     try:
         # #で始まる単語をハッシュタグとして抽出
         hashtags = re.findall(r'#(\w+)', text)
@@ -221,39 +1043,31 @@ def extract_hashtags(text):
         print(f"Error in hashtag extraction: {e}")
         return []
 
-# データ取得およびインポート
-cursor = conn.cursor()
-print("Executing SQL query...")
-# 必要に応じて、KeywordsカラムがSQL側で正しく取得できるか確認するためのクエリを修正
-cursor.execute("SELECT * FROM Mspr.PostCommentView")
-columns = [column[0] for column in cursor.description]
-rows = cursor.fetchall()
-
-print("Building actions for bulk import...")
-actions = []
-for row in rows:
-    # 行データを辞書に変換
-    row_dict = dict(zip(columns, row))
-    
-    # データの前処理を行う
-    
+
+def transform_row(row_dict, keywords=None):
+    """SQLの1行をインデックス用のドキュメントに変換する
+
+    keywordsを指定した場合は、本文から抽出する代わりにそのキーワードを使う。
+    """
+    extracted_hashtags = []
+
     # *** テキストからキーワードとハッシュタグを抽出 ***
     if 'Text' in row_dict and row_dict['Text']:
         text = row_dict['Text']
-        
+
         # キーワードの抽出
-        extracted_keywords = extract_keywords(text)
-        
+        extracted_keywords = keywords if keywords is not None else extract_keywords(text)
+
         # 既存のKeywordsフィールドがなければ作成、あれば上書き
         row_dict['Keywords'] = extracted_keywords
-        
+
         # ハッシュタグの抽出
         extracted_hashtags = extract_hashtags(text)
-        
+
         # 既存のHashTagsフィールドがなければ作成、あれば上書き
         if extracted_hashtags:
             row_dict['HashTags'] = extracted_hashtags
-    
+
     # 既存のKeywordsフィールドが文字列であれば、適切に処理
     elif 'Keywords' in row_dict and row_dict['Keywords'] is not None:
         try:
@@ -267,7 +1081,7 @@ for row in rows:
         except json.JSONDecodeError:
             print(f"Warning: Could not parse Keywords for PostId: {row_dict.get('PostId')}")
             # 問題がある場合でも、テキストとして保持
-    
+
     # 既存のHashTagsフィールドが文字列であれば、適切に処理
     if 'HashTags' in row_dict and row_dict['HashTags'] is not None and not extracted_hashtags:
         try:
@@ -281,7 +1095,7 @@ for row in rows:
         except json.JSONDecodeError:
             print(f"Warning: Could not parse HashTags for PostId: {row_dict.get('PostId')}")
             # 問題がある場合でも、テキストとして保持
-    
+
     # Commentsフィールドが文字列であれば、JSONオブジェクトに変換
     if 'Comments' in row_dict and row_dict['Comments'] is not None:
         try:
@@ -294,259 +1108,1033 @@ for row in rows:
             print(f"Warning: Could not parse Comments JSON for PostId: {row_dict.get('PostId')}")
             # パースできない場合は空のリストに設定
             row_dict['Comments'] = []
-    
-    # デバッグ出力: Keywordsフィールドの値をサンプルログ
-    if 'PostId' in row_dict and 'Keywords' in row_dict:
-        # 1つめのデータだけログ出力
-        if len(actions) == 0:
-            print(f"Sample Keywords for PostId {row_dict['PostId']}: {row_dict.get('Keywords')}")
-    
-    actions.append({
-        "_index": index_name,
-        "_source": row_dict
-    })
 
-# デバッグ情報: インポートデータの数を表示
-print(f"Built {len(actions)} actions for bulk import.")
+    return row_dict
+
 
-if len(actions) > 0:
-    # バルクインポートを実行
-    print("Starting bulk import...")
+def fetch_batches(cursor, batch_size=SQL_FETCH_SIZE, prefetch=SQL_PREFETCH_BATCHES):
+    """fetchmanyで取得した行をバッチ単位で返すジェネレータ
+
+    別スレッドで先読みし、ESへの書き込み中も次のバッチをSQLから読み込む。
+    キューの長さで先読み量を制限するため、メモリ使用量はテーブルサイズに依存しない。
+    """
+    columns = [column[0] for column in cursor.description]
+    batches = queue.Queue(maxsize=max(prefetch, 1))
+    done = object()
+    stop = threading.Event()
+
+    def reader():
+        try:
+            while not stop.is_set():
+                started = time.time()
+                rows = cursor.fetchmany(batch_size)
+                metrics.observe('indexer_sql_fetch_seconds', time.time() - started)
+                if not rows:
+                    break
+                metrics.inc('indexer_rows_fetched_total', len(rows))
+                batches.put([dict(zip(columns, row)) for row in rows])
+                metrics.set('indexer_queue_depth', batches.qsize(), queue='sql_prefetch')
+        except Exception as e:
+            batches.put(e)
+            return
+        batches.put(done)
+
+    thread = threading.Thread(target=reader, name="sql-reader", daemon=True)
+    thread.start()
     try:
-        # チャンクサイズを小さくして処理
-        success, failed = helpers.bulk(es, actions, chunk_size=100, max_retries=5, raise_on_error=False)
-        print(f"Data import completed. Success: {success}, Failed: {len(failed) if failed else 0}")
-        
-        if failed:
-            print(f"First few errors: {failed[:3]}")
+        while True:
+            waited = time.time()
+            batch = batches.get()
+            metrics.inc('indexer_wait_seconds_total', time.time() - waited, stage='sql')
+            metrics.set('indexer_queue_depth', batches.qsize(), queue='sql_prefetch')
+            if batch is done:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+    finally:
+        # 途中で中断された場合でもリーダースレッドを止める
+        stop.set()
+        while thread.is_alive():
+            try:
+                batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+class KeyRangeBatch(list):
+    """読み込んだキーの範囲の番号を持つ行バッチ"""
+
+    def __init__(self, range_id, rows):
+        super().__init__(rows)
+        self.range_id = range_id
+
+
+def key_range_condition(after, through):
+    """キーの範囲（afterより後、throughまで。Noneは制限なし）のWHERE条件とパラメータを返す"""
+    conditions = []
+    params = []
+    if after is not None:
+        conditions.append(f"{ID_COLUMN} > ?")
+        params.append(after)
+    if through is not None:
+        conditions.append(f"{ID_COLUMN} <= ?")
+        params.append(through)
+    return " AND ".join(conditions) or "1 = 1", params
+
+
+def keyset_page_query(after, through, page_size, select="*", condition="1 = 1"):
+    """キーの範囲の先頭から、conditionを満たすpage_size行をキーの順に読むクエリを返す"""
+    where, params = key_range_condition(after, through)
+    where = f"{condition} AND {where}"
+    if SQL_DIALECT == 'sqlite':
+        return f"SELECT {select} FROM {SOURCE_VIEW} WHERE {where} ORDER BY {ID_COLUMN} LIMIT {int(page_size)}", params
+    return f"SELECT TOP ({int(page_size)}) {select} FROM {SOURCE_VIEW} WHERE {where} ORDER BY {ID_COLUMN}", params
+
+
+def split_key_ranges(conn, partitions, after=None, condition="1 = 1"):
+    """afterより後のconditionを満たす行のキーを、行数がほぼ等しいpartitions個の範囲（[このキーより後, このキーまで]）に分ける
+
+    最後の範囲は上限を付けず、読み込み中に追加された行も含める。
+    """
+    where, params = key_range_condition(after, None)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"SELECT MAX({ID_COLUMN}) FROM ("
+            f"SELECT {ID_COLUMN}, NTILE({int(partitions)}) OVER (ORDER BY {ID_COLUMN}) AS part "
+            f"FROM {SOURCE_VIEW} WHERE {condition} AND {where}"
+            f") AS key_parts GROUP BY part ORDER BY part",
+            params
+        )
+        bounds = [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+    ranges = []
+    for through in bounds[:-1]:
+        ranges.append([after, through])
+        after = through
+    ranges.append([after, None])
+    return ranges
+
+
+def fetch_key_ranges(ranges, readers=SQL_READERS, page_size=SQL_PAGE_SIZE, batch_size=SQL_FETCH_SIZE,
+                     prefetch=SQL_PREFETCH_BATCHES, select="*", condition="1 = 1"):
+    """キーの範囲ごとに別のコネクションで読み込み、共有のキューからバッチを返すジェネレータ
+
+    readers個のスレッドがそれぞれSQL Serverに接続し、未読の範囲を1つずつ取って
+    キーセットページング（前のページの最後のキーより後をキーの順に読む。OFFSETは使わない）で読み進める。
+    同じ範囲のバッチはキーの順に返るが、範囲をまたいだ順序は決まらない。
+    """
+    todo = queue.Queue()
+    for range_id in range(len(ranges)):
+        todo.put(range_id)
+    batches = queue.Queue(maxsize=max(prefetch, 1) * max(readers, 1))
+    done = object()
+    stop = threading.Event()
+
+    def read_range(cursor, range_id):
+        after, through = ranges[range_id]
+        while not stop.is_set():
+            query, params = keyset_page_query(after, through, page_size, select, condition)
+            cursor.execute(query, params)
+            columns = [column[0] for column in cursor.description]
+            read = 0
+            while not stop.is_set():
+                started = time.time()
+                rows = cursor.fetchmany(min(batch_size, page_size - read))
+                metrics.observe('indexer_sql_fetch_seconds', time.time() - started)
+                if not rows:
+                    break
+                read += len(rows)
+                metrics.inc('indexer_rows_fetched_total', len(rows))
+                batch = KeyRangeBatch(range_id, [dict(zip(columns, row)) for row in rows])
+                after = batch[-1][ID_COLUMN]
+                batches.put(batch)
+                metrics.set('indexer_queue_depth', batches.qsize(), queue='sql_prefetch')
+                if read >= page_size:
+                    break
+            if read < page_size:
+                return
+
+    def reader():
+        try:
+            conn = connect_sql()
+        except Exception as e:
+            batches.put(e)
+            return
+        try:
+            cursor = conn.cursor()
+            while not stop.is_set():
+                try:
+                    range_id = todo.get_nowait()
+                except queue.Empty:
+                    break
+                read_range(cursor, range_id)
+        except Exception as e:
+            batches.put(e)
+            return
+        finally:
+            conn.close()
+        batches.put(done)
+
+    threads = [
+        threading.Thread(target=reader, name=f"sql-reader-{i}", daemon=True)
+        for i in range(max(min(readers, len(ranges)), 1))
+    ]
+    for thread in threads:
+        thread.start()
+    finished = 0
+    try:
+        while finished < len(threads):
+            waited = time.time()
+            batch = batches.get()
+            metrics.inc('indexer_wait_seconds_total', time.time() - waited, stage='sql')
+            metrics.set('indexer_queue_depth', batches.qsize(), queue='sql_prefetch')
+            if batch is done:
+                finished += 1
+                continue
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+    finally:
+        # 途中で中断された場合でも全てのリーダースレッドを止める
+        stop.set()
+        while any(thread.is_alive() for thread in threads):
+            try:
+                batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def _init_extract_worker():
+    """ワーカープロセスごとにMeCabのTaggerを初期化し、TF-IDFの場合はIDFを読み込む"""
+    init_mecab()
+    if KEYWORD_SCORING == 'tfidf':
+        load_keyword_idf()
+
+
+def content_hash(doc):
+    """ドキュメントの内容からハッシュを計算する"""
+    payload = json.dumps(doc, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _as_list(value):
+    if value is None or value == '':
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def add_comment_keywords(docs):
+    """コメントごとにキーワードとハッシュタグを抽出し、多く出現したものを投稿にも追加する
+
+    バッチ内の全投稿のコメントを1つのリストにまとめて抽出する。
+    """
+    targets = []
+    for doc in docs:
+        comments = doc.get('Comments')
+        if isinstance(comments, dict):
+            comments = [comments]
+        if not isinstance(comments, list):
+            continue
+        for comment in comments:
+            # 削除されたコメントの語は投稿に反映しない
+            if isinstance(comment, dict) and comment.get('Text') and comment.get('DeletedAt') is None:
+                targets.append((doc, comment))
+    if not targets:
+        return
+
+    keywords_list = extract_keywords_batch([comment['Text'] for _, comment in targets], COMMENT_MAX_KEYWORDS)
+
+    # 投稿ごとに、キーワードを含むコメントの数とハッシュタグを集計する
+    keyword_counts = {}
+    hashtags = {}
+    for (doc, comment), keywords in zip(targets, keywords_list):
+        comment['Keywords'] = keywords
+        comment['HashTags'] = extract_hashtags(comment['Text'])
+        keyword_counts.setdefault(id(doc), Counter()).update(keywords)
+        hashtags.setdefault(id(doc), {}).update(dict.fromkeys(comment['HashTags']))
+
+    for doc in docs:
+        if id(doc) not in keyword_counts:
+            continue
+        post_keywords = _as_list(doc.get('Keywords'))
+        added = [word for word, count in keyword_counts[id(doc)].most_common()
+                 if word not in post_keywords][:COMMENT_KEYWORDS_TO_POST]
+        doc['Keywords'] = post_keywords + added
+        post_hashtags = _as_list(doc.get('HashTags'))
+        new_hashtags = [tag for tag in hashtags[id(doc)] if tag not in post_hashtags]
+        if new_hashtags:
+            doc['HashTags'] = post_hashtags + new_hashtags
+
+
+def transform_batch(rows):
+    """行のリストをドキュメントのリストに変換する（ワーカープロセスで実行される）"""
+    # 投稿の本文のキーワードはバッチ内でまとめて抽出する
+    keywords_list = extract_keywords_batch([row_dict.get('Text') for row_dict in rows])
+    docs = [transform_row(row_dict, keywords) for row_dict, keywords in zip(rows, keywords_list)]
+    add_comment_keywords(docs)
+    for doc in docs:
+        doc['ContentHash'] = content_hash(doc)
+    # 抽出したキーワードをバッチ単位でSQLiteに書き込む
+    if keyword_cache is not None:
+        keyword_cache.flush()
+    return docs
+
+
+def filter_unchanged(es, target_index, docs):
+    """既存ドキュメントとContentHashが同じものを除外する"""
+    ids = [str(doc[ID_COLUMN]) for doc in docs if doc.get(ID_COLUMN) is not None]
+    if not ids:
+        return docs
+    response = es.mget(body={"ids": ids}, index=target_index, _source_includes="ContentHash")
+    existing = {
+        found['_id']: found['_source'].get('ContentHash')
+        for found in response['docs'] if found.get('found')
+    }
+    return [
+        doc for doc in docs
+        if doc.get(ID_COLUMN) is None or existing.get(str(doc[ID_COLUMN])) != doc['ContentHash']
+    ]
+
+
+def transform_batches(batches, workers=EXTRACT_WORKERS, transform=transform_batch):
+    """行バッチを変換し、入力と同じ順序でドキュメントのリストを返すジェネレータ
+
+    workersが2以上の場合はプロセスプールで並列に変換する。
+    処理中のバッチ数をワーカー数の2倍までに抑え、メモリ使用量を一定に保つ。
+    """
+    if workers <= 1:
+        for rows in batches:
+            started = time.time()
+            docs = transform(rows)
+            metrics.observe('indexer_extract_batch_seconds', time.time() - started)
+            metrics.inc('indexer_documents_transformed_total', len(docs))
+            yield docs
+        return
+
+    # SQL読み込みスレッドが動いている状態でforkしないよう、spawnでワーカーを起動する
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_extract_worker) as executor:
+        pending = deque()
+
+        def result():
+            # ワーカーの変換を待った時間は、抽出（CPU）が追いついていないことを示す
+            waited = time.time()
+            docs = pending.popleft().result()
+            metrics.inc('indexer_wait_seconds_total', time.time() - waited, stage='extract')
+            metrics.inc('indexer_documents_transformed_total', len(docs))
+            metrics.set('indexer_queue_depth', len(pending), queue='extract_pending')
+            return docs
+
+        for rows in batches:
+            future = executor.submit(transform, rows)
+            future.add_done_callback(
+                lambda _, submitted=time.time(): metrics.observe('indexer_extract_batch_seconds', time.time() - submitted)
+            )
+            pending.append(future)
+            metrics.set('indexer_queue_depth', len(pending), queue='extract_pending')
+            if len(pending) >= workers * 2:
+                yield result()
+        while pending:
+            yield result()
+
+
+def generate_actions(batches, target_index, incremental=False, workers=EXTRACT_WORKERS, es=None, skip_unchanged=False,
+                     checkpoint=None):
+    """行バッチを変換してバルク用のアクションを1件ずつ返すジェネレータ
+
+    論理削除された行は、全件再構築ではスキップし、差分インデックスでは削除アクションにする。
+    skip_unchangedを指定した場合は、既存ドキュメントと内容が同じものを送信しない。
+    checkpointを指定した場合は、バッチごとに送信するドキュメントIDを登録する。
+    """
+    # バッチごとの削除対象IDと最後の行のキー（変換結果と同じ順序で取り出す）
+    deleted_batches = deque()
+    last_keys = deque()
+
+    def rows_to_index():
+        for batch in batches:
+            rows = []
+            deleted_ids = []
+            for row_dict in batch:
+                if EXCLUDE_DELETED and row_dict.get('DeletedAt') is not None:
+                    if incremental and row_dict.get(ID_COLUMN) is not None:
+                        deleted_ids.append(str(row_dict[ID_COLUMN]))
+                    continue
+                rows.append(row_dict)
+            deleted_batches.append(deleted_ids)
+            last_keys.append((getattr(batch, 'range_id', None), batch[-1].get(ID_COLUMN)))
+            yield rows
+
+    built = 0
+    skipped = 0
+    for docs in transform_batches(rows_to_index(), workers):
+        if skip_unchanged and docs:
+            changed = filter_unchanged(es, target_index, docs)
+            skipped += len(docs) - len(changed)
+            docs = changed
+        range_id, last_key = last_keys.popleft()
+        if checkpoint is not None:
+            ids = [str(doc[ID_COLUMN]) for doc in docs if doc.get(ID_COLUMN) is not None]
+            checkpoint.add_batch(last_key, ids, range_id)
+        for doc_id in deleted_batches.popleft():
+            yield {
+                "_op_type": "delete",
+                "_index": target_index,
+                "_id": doc_id
+            }
+        for doc in docs:
+            # デバッグ出力: Keywordsフィールドの値をサンプルログ（1つめのデータだけ）
+            if built == 0 and 'PostId' in doc and 'Keywords' in doc:
+                print(f"Sample Keywords for PostId {doc['PostId']}: {doc.get('Keywords')}")
+
+            built += 1
+            doc_id = doc.get(ID_COLUMN)
+            if INDEX_OP_TYPE == 'update' and doc_id is not None:
+                # 部分更新（存在しなければそのまま作成）
+                action = {
+                    "_op_type": "update",
+                    "_index": target_index,
+                    "doc": doc,
+                    "doc_as_upsert": True
+                }
+            else:
+                action = {
+                    "_op_type": "index",
+                    "_index": target_index,
+                    "_source": doc
+                }
+            # IDを固定して再実行・差分実行時に同じドキュメントを上書きする
+            if doc_id is not None:
+                action["_id"] = str(doc_id)
+            yield action
+
+    if skip_unchanged:
+        print(f"Skipped {skipped} unchanged documents.")
+
+
+def bulk_import(es, actions, checkpoint=None):
+    """BulkWriterでアクションを並列に送信し、成功数と失敗数を返す"""
+    success = 0
+    failed = 0
+    first_errors = []
+    writer = BulkWriter(
+        es,
+        threads=BULK_THREADS,
+        chunk_size=BULK_CHUNK_SIZE,
+        min_chunk_size=BULK_MIN_CHUNK_SIZE,
+        max_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+        max_retries=5,
+        metrics=metrics
+    )
+    for ok, item in writer.run(actions):
+        # 既に存在しないドキュメントの削除は成功として扱う
+        if not ok and item.get('delete', {}).get('status') == 404:
+            ok = True
+        if checkpoint is not None:
+            checkpoint.done(ok, item)
+        metrics.inc('indexer_bulk_items_total')
+        if ok:
+            success += 1
+        else:
+            failed += 1
+            metrics.inc('indexer_bulk_items_failed_total')
+            # エラーはサンプルとして先頭の数件だけ保持する
+            if len(first_errors) < 3:
+                first_errors.append(item)
+    writer.report()
+    return success, failed, first_errors
+
+
+def open_import_cursor(conn, since=None, checkpoint=None):
+    """投入する行を読むカーソルと、数えた場合はその行数を返す"""
+    if isinstance(conn, Snapshot):
+        if since is not None:
+            raise ValueError("Incremental indexing reads changed rows from SQL; a snapshot cannot be used.")
+        if checkpoint is not None and checkpoint.ranges is not None:
+            raise RuntimeError("Checkpoint was recorded by parallel SQL readers; resume it with --source sql.")
+        # SQLから読む場合と同じく論理削除された行は読まず、行数も投入する行だけを数える
+        live = None
+        if EXCLUDE_DELETED and 'DeletedAt' in conn.columns:
+            deleted = conn.columns.index('DeletedAt')
+            live = lambda row: row[deleted] is None
+        if checkpoint is not None and checkpoint.last_key is not None:
+            if conn.key_column != ID_COLUMN:
+                raise RuntimeError(f"Snapshot is ordered by {conn.key_column}, not {ID_COLUMN}; cannot resume from it.")
+            print(f"Reading snapshot rows after {ID_COLUMN} = {checkpoint.last_key!r}")
+            return conn.cursor(where=live, start_after=checkpoint.last_key), None
+        total_rows = conn.count(live) if live is None or PROGRESS_COUNT_ROWS else None
+        return conn.cursor(where=live), total_rows
+
+    cursor = conn.cursor()
+    columns = get_view_columns(cursor)
+    order_by = ""
+    if since is not None:
+        query, params = build_incremental_query(columns, since)
+        print(f"Selecting rows changed since {since.isoformat()}")
+    else:
+        # 必要に応じて、KeywordsカラムがSQL側で正しく取得できるか確認するためのクエリを修正
+        query, params = f"SELECT {source_select_list(columns)} FROM {SOURCE_VIEW} WHERE {source_filter(columns)}", []
+        if checkpoint is not None:
+            order_by = f" ORDER BY {ID_COLUMN}"
+            if checkpoint.last_key is not None:
+                print(f"Selecting rows after {ID_COLUMN} = {checkpoint.last_key!r}")
+                query += f" AND {ID_COLUMN} > ?"
+                params = [checkpoint.last_key]
+
+    total_rows = None
+    if PROGRESS_COUNT_ROWS:
+        cursor.execute(f"SELECT COUNT(*) FROM ({query}) AS source_rows", params)
+        total_rows = cursor.fetchone()[0]
+
+    print("Executing SQL query...")
+    cursor.execute(query + order_by, params)
+    return cursor, total_rows
+
+
+def open_key_range_batches(conn, checkpoint=None):
+    """キーの範囲ごとに並列に読むバッチのジェネレータと、数えた場合はその行数を返す
+
+    複数の範囲を同時に読むため、読んだ行の日時の最大値は読み終えた範囲と対応しない。
+    ハイウォーターマークにはrun_fullが読み込み前に取得した値を使い、ここで読んだ行からは更新しない。
+    """
+    cursor = conn.cursor()
+    try:
+        columns = get_view_columns(cursor)
+    finally:
+        cursor.close()
+    select = source_select_list(columns)
+    condition = source_filter(columns)
+    if checkpoint is not None and checkpoint.ranges is not None:
+        # 中断した再構築と同じ範囲を、範囲ごとの再開位置から読む
+        ranges = checkpoint.ranges
+    else:
+        after = checkpoint.last_key if checkpoint is not None else None
+        ranges = split_key_ranges(conn, SQL_PARTITIONS, after, condition)
+        if checkpoint is not None:
+            checkpoint.ranges = ranges
+    print(f"Reading {len(ranges)} key ranges of {ID_COLUMN} with {min(SQL_READERS, len(ranges))} connections")
+
+    total_rows = None
+    if PROGRESS_COUNT_ROWS:
+        conditions = [key_range_condition(after, through) for after, through in ranges]
+        where = " OR ".join(f"({condition})" for condition, _ in conditions)
+        cursor = conn.cursor()
+        try:
+            params = [param for _, condition_params in conditions for param in condition_params]
+            cursor.execute(f"SELECT COUNT(*) FROM {SOURCE_VIEW} WHERE {condition} AND ({where})", params)
+            total_rows = cursor.fetchone()[0]
+        finally:
+            cursor.close()
+    # 範囲の再開位置はチェックポイントが進めるため、読み込みにはコピーを渡す
+    key_ranges = [list(key_range) for key_range in ranges]
+    return fetch_key_ranges(key_ranges, max(SQL_READERS, 1), select=select, condition=condition), total_rows
+
+
+def export_snapshot(conn):
+    """ビューの全行をキーの順にスナップショットへ書き出す"""
+    cursor = conn.cursor()
+    try:
+        total_rows = None
+        if PROGRESS_COUNT_ROWS:
+            cursor.execute(f"SELECT COUNT(*) FROM {SOURCE_VIEW}")
+            total_rows = cursor.fetchone()[0]
+            metrics.set('indexer_rows_expected', total_rows)
+        # 書き出し中に変更された行を差分インデックスで拾えるよう、読み込む前の最大値を記録する
+        watermark = read_source_watermark(conn)
+        print(f"Exporting {SOURCE_VIEW} to {SNAPSHOT_PATH}...")
+        # --resumeで再開位置を探せるよう、チェックポイントと同じキーの順に書き出す
+        cursor.execute(f"SELECT * FROM {SOURCE_VIEW} ORDER BY {ID_COLUMN}")
+        columns = [column[0] for column in cursor.description]
+        check_columns(cursor.description)
+        with ProgressReporter(metrics, total_rows, PROGRESS_SECONDS):
+            rows = write_snapshot(SNAPSHOT_PATH, columns, fetch_batches(cursor), SOURCE_VIEW, ID_COLUMN,
+                                  watermark=watermark)
+    finally:
+        cursor.close()
+    print(f"Exported {rows} rows ({os.path.getsize(SNAPSHOT_PATH) / 1024 / 1024:.1f} MB) to {SNAPSHOT_PATH}")
+
+
+def import_data(conn, es, target_index, watermark, since=None, checkpoint=None):
+    """SQLの行をストリーミングでElasticsearchへ投入する
+
+    sinceを指定した場合は、その日時以降に変更された行だけを差分として投入し、読んだ行の日時の最大値をwatermarkに記録する。
+    全件再構築のwatermarkは読み込み前に取得したもので、ここでは更新しない。
+    checkpointを指定した場合は、行をキーの順に読み、保存済みの再開位置より後の行だけを投入する。
+    SQL_READERSが2以上の全件再構築では、キーの範囲ごとに複数のコネクションで並列に読む。
+    (全件成功したか, 成功件数) を返す。
+    """
+    incremental = since is not None
+    cursor = None
+    try:
+        parallel = SQL_READERS > 1 or (checkpoint is not None and checkpoint.ranges is not None)
+        if not incremental and parallel and not isinstance(conn, Snapshot):
+            batches, total_rows = open_key_range_batches(conn, checkpoint)
+        else:
+            cursor, total_rows = open_import_cursor(conn, since, checkpoint)
+            batches = fetch_batches(cursor)
+        if total_rows is not None:
+            metrics.set('indexer_rows_expected', total_rows)
+            print(f"{total_rows} rows to import.")
+
+        print("Starting streaming bulk import...")
+        with ProgressReporter(metrics, total_rows, PROGRESS_SECONDS):
+            if incremental:
+                batches = watermark.track(batches)
+            actions = generate_actions(batches, target_index, incremental, es=es,
+                                       skip_unchanged=SKIP_UNCHANGED and incremental, checkpoint=checkpoint)
+            success, failed, first_errors = bulk_import(es, actions, checkpoint)
+        if success + failed > 0:
+            print(f"Data import completed. Success: {success}, Failed: {failed}")
+            if first_errors:
+                print(f"First few errors: {first_errors}")
+        else:
+            print("No data to import.")
+        return failed == 0, success
     except Exception as e:
         print(f"Error during bulk import: {e}")
-else:
-    print("No data to import.")
+        return False, 0
+    finally:
+        # 中断した場合も、書き込みが確認できた位置までを保存する
+        if checkpoint is not None:
+            checkpoint.save()
+        if cursor is not None:
+            cursor.close()
 
-# 接続のクローズ
-conn.close()
-print("SQL connection closed.")
 
-# インデックス更新のために一時的に閉じる
-print(f"Closing index {index_name} for updates...")
-es.indices.close(index=index_name)
+def resuggest_slice(es, target_index, slice_id, slices, batch_size=100):
+    """スライス1つ分のドキュメントをスクロールし、サジェスト用フィールドを再送信する"""
+    body = {"query": {"match_all": {}}}
+    if slices > 1:
+        body["slice"] = {"id": slice_id, "max": slices}
 
-try:
-    # テキスト解析用の日本語設定を更新
-    print("Updating analysis settings...")
-    analysis_settings = {
-        "analysis": {
-            "analyzer": {
-                "ja_analyzer": {
-                    "type": "custom",
-                    "tokenizer": "kuromoji_tokenizer",
-                    "filter": ["kuromoji_baseform", "kuromoji_part_of_speech", "ja_stop", "kuromoji_stemmer"]
+    # スクロールを使用してドキュメントを取得
+    scroll_response = es.search(index=target_index, scroll='2m', size=batch_size, body=body)
+    # 初期スクロールID
+    scroll_id = scroll_response['_scroll_id']
+    documents_processed = 0
+
+    try:
+        while True:
+            # 結果を処理
+            batch = []
+            hits = scroll_response.get('hits', {}).get('hits', [])
+
+            if not hits:
+                break
+
+            for hit in hits:
+                doc = hit['_source']
+
+                # ドキュメントの更新操作を作成（内容が同じでも再インデックスさせる）
+                action = {
+                    "_op_type": "update",
+                    "_index": hit['_index'],
+                    "_id": hit['_id'],
+                    "detect_noop": False,
+                    "doc": {}
                 }
-            },
-            "filter": {
-                "ja_stop": {
-                    "type": "stop",
-                    "stopwords": "_japanese_"
+
+                # サジェストデータを追加（必要なフィールドがある場合）
+                for field in ('Text', 'Keywords', 'HashTags', 'Comments'):
+                    if doc.get(field):
+                        action['doc'][field] = doc[field]
+
+                batch.append(action)
+
+            # バッチ更新を実行（リフレッシュは全スライス完了後に1回だけ行う）
+            success, errors = helpers.bulk(es, batch, raise_on_error=False)
+            documents_processed += success
+            print(f"[slice {slice_id}] Processed {documents_processed} documents...")
+
+            if errors:
+                print(f"[slice {slice_id}] Errors during bulk update: {errors[:3]}")
+
+            # 次のバッチを取得
+            scroll_response = es.scroll(scroll_id=scroll_id, scroll='2m')
+            scroll_id = scroll_response['_scroll_id']
+
+    finally:
+        # スクロールを解放
+        es.clear_scroll(scroll_id=scroll_id)
+
+    return documents_processed
+
+
+def resuggest(es, target_index=index_name, slices=RESUGGEST_SLICES):
+    """既存ドキュメントのサジェスト用フィールドを作り直すメンテナンス処理
+
+    通常の構築ではインデックス作成時にサジェスト用マッピングを定義しているため不要。
+    マッピングを変更した場合などに、スライススクロールで並列に全ドキュメントを再送信する。
+    """
+    # サジェスト用サブフィールドが無い古いインデックスにも追加する
+    print(f"Updating suggestion mappings of {target_index}...")
+    es.indices.put_mapping(body=index_settings['mappings'], index=target_index)
+
+    print(f"Updating documents with suggestion data using {slices} slices...")
+    slices = max(slices, 1)
+    with ThreadPoolExecutor(max_workers=slices) as executor:
+        futures = [executor.submit(resuggest_slice, es, target_index, i, slices) for i in range(slices)]
+        documents_processed = sum(f.result() for f in futures)
+
+    # インデックスのリフレッシュ
+    print("Refreshing index...")
+    es.indices.refresh(index=target_index)
+    print(f"Completed updating {documents_processed} documents.")
+
+
+def check_keywords(es):
+    """Keywordsフィールドが正しく格納されているか確認する"""
+    # 実際にKeywordsフィールドが正しく格納されているか確認するためのクエリを実行
+    print("Checking if Keywords field is properly indexed...")
+    try:
+        # サンプルクエリを実行
+        sample_query = {
+            "size": 5,
+            "_source": ["PostId", "Keywords"],
+            "query": {
+                "exists": {
+                    "field": "Keywords"
                 }
             }
         }
-    }
-    
-    es.indices.put_settings(body={"settings": analysis_settings}, index=index_name)
-    print("Analysis settings updated.")
-    
-    # サジェスト機能のためのマッピング追加 - Keywordsフィールドも対象に
-    print("Adding suggestion fields to mapping...")
-    suggest_mapping = {
-        "properties": {
-            "Text": {
-                "type": "text",
-                "analyzer": "ja_analyzer",
-                "fields": {
-                    "suggest": {
-                        "type": "completion",
-                        "analyzer": "ja_analyzer"
-                    }
-                }
-            },
-            "Keywords": {
-                "type": "text",
-                "analyzer": "ja_analyzer",
-                "fields": {
-                    "suggest": {
-                        "type": "completion",
-                        "analyzer": "ja_analyzer"
-                    }
+
+        result = es.search(index=index_name, body=sample_query)
+        hit_count = result['hits']['total']['value'] if 'hits' in result and 'total' in result['hits'] else 0
+
+        print(f"Found {hit_count} documents with Keywords field")
+
+        # サンプルのドキュメントを表示
+        if hit_count > 0:
+            print("Sample documents with Keywords:")
+            for hit in result['hits']['hits']:
+                print(f"PostId: {hit['_source'].get('PostId')}, Keywords: {hit['_source'].get('Keywords')}")
+    except Exception as e:
+        print(f"Error checking Keywords field: {e}")
+
+
+def suggest_buckets(es, source_index, field):
+    """フィールドの値ごとの投稿数と最終使用日時をcomposite aggregationでページングして返す"""
+    after_key = None
+    while True:
+        composite = {
+            "size": SUGGEST_AGG_PAGE_SIZE,
+            "sources": [{"term": {"terms": {"field": field}}}]
+        }
+        if after_key:
+            composite["after"] = after_key
+        body = {
+            "size": 0,
+            "aggs": {
+                "terms": {
+                    "composite": composite,
+                    "aggs": {"last_used": {"max": {"field": "CreatedAt"}}}
                 }
-            },
-            "HashTags": {
-                "type": "text",
-                "analyzer": "ja_analyzer",
-                "fields": {
+            }
+        }
+        result = es.search(index=source_index, body=body)['aggregations']['terms']
+        yield from result['buckets']
+        after_key = result.get('after_key')
+        if not result['buckets'] or not after_key:
+            break
+
+
+def suggest_weight(doc_count, last_used, now):
+    """サジェスト候補の重みを計算する（completionの重みは整数）"""
+    if SUGGEST_WEIGHT == 'recency' and last_used is not None:
+        age_days = max(0.0, (now - last_used / 1000) / 86400)
+        # 少ない投稿数でも差が付くよう100倍してから丸める
+        return max(1, round(doc_count * 100 * 0.5 ** (age_days / SUGGEST_HALF_LIFE_DAYS)))
+    return doc_count
+
+
+def generate_suggest_actions(es, source_index, target_index):
+    """全投稿のキーワードとハッシュタグを集計し、語ごとのサジェスト用ドキュメントを返すジェネレータ"""
+    now = datetime.now().timestamp()
+    for field, term_type in (("Keywords.keyword", "keyword"), ("HashTags.keyword", "hashtag")):
+        for bucket in suggest_buckets(es, source_index, field):
+            term = bucket['key']['term']
+            if bucket['doc_count'] < SUGGEST_MIN_DOC_COUNT or not term.strip():
+                continue
+            last_used = bucket['last_used']['value']
+            # ひらがなやローマ字で入力しても漢字・カタカナの語に前方一致するよう、正規化した読みも入力にする
+            reading = keyword_reading(term)
+            inputs = [term] + [key for key in suggest_keys(term, reading) if key != term]
+            # 語は最大256文字（UTF-8で768バイト）になり_idの上限512バイトを超えるため、固定長のハッシュをIDにする
+            term_id = hashlib.sha1(f"{term_type}\0{term}".encode('utf-8')).hexdigest()
+            yield {
+                "_op_type": "index",
+                "_index": target_index,
+                "_id": term_id,
+                "_source": {
+                    "Term": term,
+                    "Reading": fold_kana(reading) if reading else None,
+                    "Type": term_type,
+                    "DocCount": bucket['doc_count'],
+                    "LastUsedAt": bucket['last_used'].get('value_as_string') if last_used is not None else None,
                     "suggest": {
-                        "type": "completion",
-                        "analyzer": "ja_analyzer"
-                    }
-                }
-            },
-            "Comments": {
-                "type": "nested",
-                "properties": {
-                    "Text": {
-                        "type": "text",
-                        "analyzer": "ja_analyzer",
-                        "fields": {
-                            "suggest": {
-                                "type": "completion",
-                                "analyzer": "ja_analyzer"
-                            }
-                        }
+                        "input": inputs,
+                        "weight": suggest_weight(bucket['doc_count'], last_used, now)
                     }
                 }
             }
-        }
-    }
-    
-    es.indices.put_mapping(body=suggest_mapping, index=index_name)
-    print("Suggestion mappings added.")
-    
-    # ベクトル検索フィールドの追加（オプション：モデルが必要な場合）
-    # Dense Vectorフィールドを追加する場合はコメントを解除
+
+
+def build_suggest_index(es, source_index=index_name):
+    """投稿インデックスの語を集計してサジェスト専用インデックスの新しい世代を作り、エイリアスを切り替える"""
+    physical_index = create_index_generation(es, suggest_index_name, suggest_index_settings)
+    try:
+        print(f"Building suggestions from {source_index} (weight: {SUGGEST_WEIGHT})...")
+        success, failed, first_errors = bulk_import(es, generate_suggest_actions(es, source_index, physical_index))
+        if failed:
+            raise RuntimeError(f"Failed to index {failed} suggestions: {first_errors}")
+        es.indices.refresh(index=physical_index)
+    except Exception:
+        print(f"Suggestion build failed. Deleting incomplete index {physical_index}...")
+        es.indices.delete(index=physical_index, ignore=[404])
+        raise
+
+    swap_alias(es, physical_index, suggest_index_name)
+    prune_index_generations(es, suggest_index_name)
+    print(f"Indexed {success} suggestions into {physical_index}.")
+
+
+def refresh_suggest_index(es, state):
+    """サジェスト専用インデックスを作り直し、作成日時を保存する
+
+    投稿インデックスから作る派生インデックスのため、失敗しても記録するだけにして投稿インデックスの処理は失敗にしない。
     """
-    vector_mapping = {
-        "properties": {
-            "text_vector": {
-                "type": "dense_vector",
-                "dims": 768
-            },
-            "comments_vector": {
-                "type": "dense_vector",
-                "dims": 768
-            }
-        }
-    }
-    
-    es.indices.put_mapping(body=vector_mapping, index=index_name)
-    print("Vector fields added.")
+    try:
+        build_suggest_index(es)
+    except Exception as e:
+        print(f"Warning: Failed to build the suggestion index: {e}. Run with --mode suggest to retry.")
+        return
+    state["suggest_built_at"] = datetime.now().isoformat()
+    save_state(state)
+
+
+def suggest_rebuild_due(state):
+    """差分インデックスでサジェスト専用インデックスを作り直す時期か"""
+    if SUGGEST_REBUILD_HOURS <= 0:
+        return False
+    built_at = state.get("suggest_built_at")
+    if not built_at:
+        return True
+    return datetime.now() - datetime.fromisoformat(built_at) >= timedelta(hours=SUGGEST_REBUILD_HOURS)
+
+
+def save_watermark(state, watermark, mode):
+    """インポートが成功した場合にハイウォーターマークを保存する"""
+    if watermark.value is None:
+        print("No watermark value found in the source rows; index state not updated.")
+        return
+    state.update({
+        "watermark": watermark.value.isoformat(),
+        "mode": mode,
+        "updated_at": datetime.now().isoformat()
+    })
+    save_state(state)
+
+
+def prepare_keyword_scoring(conn, rebuild):
+    """TF-IDFの場合に語彙とIDFを用意する（全件再構築では作り直し、差分インデックスでは保存済みのものを使う）"""
+    if KEYWORD_SCORING != 'tfidf':
+        return
+    if rebuild or not os.path.exists(KEYWORD_IDF_PATH):
+        build_keyword_idf(conn)
+    table = load_keyword_idf()
+    print(f"Using IDF version {table['version']} ({table['documents']} posts, {len(table['idf'])} terms)")
+
+
+def run_full(conn, es, state, resume=False):
+    """新しい世代のインデックスに全件を構築し、検証後にエイリアスを切り替える
+
+    resumeを指定した場合は、中断した再構築の世代に保存済みの再開位置から続けて投入する。
     """
-    
-    # インデックスを再オープン
-    print(f"Reopening index {index_name}...")
-    es.indices.open(index=index_name)
-    
-    # インデックスのリフレッシュ
-    print("Refreshing index...")
+    init_mecab()
+    checkpoint = None
+    if resume:
+        checkpoint = load_checkpoint(es, state)
+        physical_index = checkpoint.physical_index
+        # 中断した世代の現在の設定は投入用の設定のままの場合があるため、作成時に保存した設定に戻す
+        production_settings = checkpoint.index_settings
+        if production_settings is None:
+            production_settings = {key: None for key in BULK_LOAD_SETTING_KEYS}
+            print(f"Checkpoint has no saved index settings; restoring defaults after the import: {production_settings}")
+        # 中断前に作ったIDFをそのまま使い、投入済みの範囲と同じ基準でキーワードを抽出する
+        prepare_keyword_scoring(conn, rebuild=False)
+    else:
+        discard_checkpoint(es, state)
+        prepare_keyword_scoring(conn, rebuild=True)
+        # 読み込み中に変更された行を次の差分インデックスで拾えるよう、読み込む前の最大値をハイウォーターマークにする
+        watermark = Watermark(read_source_watermark(conn))
+        print(f"Watermark before reading the source: {watermark.value.isoformat() if watermark.value else None}")
+        physical_index = create_index_generation(es)
+        production_settings = read_index_settings(es, physical_index)
+        if FULL_CHECKPOINT:
+            checkpoint = Checkpoint(state, physical_index, watermark=watermark.value, index_settings=production_settings)
+            checkpoint.save()
+    if checkpoint is not None:
+        watermark = Watermark(checkpoint.watermark)
+    resumed = checkpoint.indexed if checkpoint is not None else 0
+    # 投入中の失敗は再開できるよう世代を残す（検証で不一致になった場合は再開しても直らないため削除する）
+    resumable = checkpoint is not None
+
+    try:
+        apply_bulk_load_settings(es, physical_index)
+        try:
+            # データ取得およびインポート
+            succeeded, indexed = import_data(conn, es, physical_index, watermark, checkpoint=checkpoint)
+            if not succeeded:
+                raise RuntimeError("Import had failures; keeping the current index generation.")
+
+            # レプリカ0のうちにリフレッシュとforce mergeを済ませる
+            finish_bulk_load(es, physical_index)
+        except Exception:
+            # エラーが発生した場合も本番用の設定に戻す（戻せなくても元の例外を優先する）
+            restore_index_settings(es, physical_index, production_settings)
+            raise
+        # 投入用の設定のままエイリアスを切り替えないよう、戻せなかった場合は失敗にする
+        if not restore_index_settings(es, physical_index, production_settings):
+            raise RuntimeError(f"Could not restore the settings of {physical_index}; keeping the current index generation.")
+
+        resumable = False
+        if not verify_index(es, physical_index, resumed + indexed):
+            raise RuntimeError(f"Verification of {physical_index} failed; keeping the current index generation.")
+    except Exception:
+        if resumable:
+            print(f"Rebuild failed. Keeping incomplete index {physical_index}; "
+                  f"run with --resume to continue from {checkpoint.position()}.")
+        else:
+            # 切り替え前に失敗した世代は削除し、エイリアスは旧世代のまま残す
+            print(f"Rebuild failed. Deleting incomplete index {physical_index}...")
+            es.indices.delete(index=physical_index, ignore=[404])
+            if state.pop('checkpoint', None):
+                save_state(state)
+        raise
+
+    swap_alias(es, physical_index)
+    # エイリアスを切り替えた時点で状態を保存し、以降の後処理が失敗しても次の差分インデックスが新しい世代から続くようにする
+    state.pop('checkpoint', None)
+    state["index"] = physical_index
+    save_state(state)
+    save_watermark(state, watermark, "full")
+
+    prune_index_generations(es)
+    check_keywords(es)
+    if SUGGEST_INDEX_ENABLED:
+        refresh_suggest_index(es, state)
+
+
+def run_incremental(conn, es, state):
+    """前回のハイウォーターマーク以降に変更された行だけをインデックスに反映する"""
+    init_mecab()
+    prepare_keyword_scoring(conn, rebuild=False)
+
+    since = datetime.fromisoformat(state['watermark'])
+    watermark = Watermark(since)
+    # エイリアス経由で現在の世代に書き込む
+    succeeded, _ = import_data(conn, es, index_name, watermark, since=since)
+
     es.indices.refresh(index=index_name)
-    
-    print("Index update completed successfully!")
-    
-except Exception as e:
-    # エラーが発生した場合、インデックスを再オープンして終了
-    print(f"Error during index update: {e}")
+
+    if succeeded:
+        save_watermark(state, watermark, "incremental")
+        if SUGGEST_INDEX_ENABLED and suggest_rebuild_due(state):
+            refresh_suggest_index(es, state)
+    else:
+        print("Import had failures; index state not updated. The next run will retry the same range.")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mspr.PostCommentViewからElasticsearchのインデックスを作成する")
+    parser.add_argument(
+        '--mode',
+        choices=['full', 'incremental', 'resuggest', 'suggest', 'export'],
+        default=os.environ.get('INDEX_MODE', 'full'),
+        help="full: インデックスを全件再構築する / incremental: 前回以降に変更された行だけを反映する / "
+             "resuggest: 既存ドキュメントのサジェスト用フィールドを作り直す / "
+             "suggest: サジェスト専用インデックスだけを作り直す / "
+             "export: ビューの全行をスナップショットに書き出す"
+    )
+    parser.add_argument(
+        '--source',
+        choices=['sql', 'snapshot'],
+        default=os.environ.get('INDEX_SOURCE', 'sql'),
+        help="sql: SQL Serverのビューから読み込む / snapshot: --mode exportで書き出したスナップショットから読み込む（fullのみ）"
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help="full: 失敗した全件再構築を、保存済みの途中経過から続ける"
+    )
+    args = parser.parse_args(argv)
+    if args.resume and args.mode != 'full':
+        parser.error("--resume can only be used with --mode full")
+    if args.source == 'snapshot' and args.mode != 'full':
+        parser.error("--source snapshot can only be used with --mode full")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
     try:
-        es.indices.open(index=index_name)
-        print(f"Index {index_name} reopened after error.")
-    except Exception as reopen_error:
-        print(f"Failed to reopen index: {reopen_error}")
-    raise
-
-# サジェストデータの準備
-print("Updating documents with suggestion data...")
-
-# バッチサイズ
-BATCH_SIZE = 100
-
-# スクロールを使用して全ドキュメントを取得
-scroll_response = es.search(
-    index=index_name,
-    scroll='2m',
-    size=BATCH_SIZE,
-    body={"query": {"match_all": {}}}
-)
+        run_mode(args)
+    finally:
+        if METRICS_FILE:
+            metrics.write(METRICS_FILE)
 
-# 初期スクロールID
-scroll_id = scroll_response['_scroll_id']
-documents_processed = 0
 
-try:
-    while True:
-        # 結果を処理
-        batch = []
-        hits = scroll_response.get('hits', {}).get('hits', [])
-        
-        if not hits:
-            break
-            
-        for hit in hits:
-            doc = hit['_source']
-            doc_id = hit['_id']
-            
-            # ドキュメントの更新操作を作成
-            action = {
-                "_op_type": "update",
-                "_index": index_name,
-                "_id": doc_id,
-                "doc": {}
-            }
-            
-            # サジェストデータを追加（必要なフィールドがある場合）
-            if 'Text' in doc and doc['Text']:
-                action['doc']['Text'] = doc['Text']
-            
-            # Keywordsフィールドの処理を追加
-            if 'Keywords' in doc and doc['Keywords']:
-                action['doc']['Keywords'] = doc['Keywords']
-                
-            # HashTagsフィールドの処理を追加
-            if 'HashTags' in doc and doc['HashTags']:
-                action['doc']['HashTags'] = doc['HashTags']
-            
-            batch.append(action)
-        
-        # バッチ更新を実行
-        if batch:
-            success, errors = helpers.bulk(es, batch, refresh=True)
-            documents_processed += success
-            print(f"Processed {documents_processed} documents...")
-            
-            if errors:
-                print(f"Errors during bulk update: {errors}")
-        
-        # 次のバッチを取得
-        scroll_response = es.scroll(scroll_id=scroll_id, scroll='2m')
-        scroll_id = scroll_response['_scroll_id']
-        
-finally:
-    # スクロールを解放
-    es.clear_scroll(scroll_id=scroll_id)
-
-print(f"Completed updating {documents_processed} documents.")
-print("Done! Elasticsearch index is now ready for suggestions and vector search.")
-
-# 実際にKeywordsフィールドが正しく格納されているか確認するためのクエリを実行
-print("Checking if Keywords field is properly indexed...")
-try:
-    # サンプルクエリを実行
-    sample_query = {
-        "size": 5,
-        "_source": ["PostId", "Keywords"],
-        "query": {
-            "exists": {
-                "field": "Keywords"
-            }
-        }
-    }
-    
-    result = es.search(index=index_name, body=sample_query)
-    hit_count = result['hits']['total']['value'] if 'hits' in result and 'total' in result['hits'] else 0
-    
-    print(f"Found {hit_count} documents with Keywords field")
-    
-    # サンプルのドキュメントを表示
-    if hit_count > 0:
-        print("Sample documents with Keywords:")
-        for hit in result['hits']['hits']:
-            print(f"PostId: {hit['_source'].get('PostId')}, Keywords: {hit['_source'].get('Keywords')}")
-except Exception as e:
-    print(f"Error checking Keywords field: {e}")
\ No newline at end of file
+def run_mode(args):
+    """指定されたモードで実行する"""
+    if args.mode == 'resuggest':
+        # SQLは使わずにElasticsearch上のドキュメントだけを更新する
+        resuggest(connect_elasticsearch())
+        return
+    if args.mode == 'suggest':
+        # 語の読みをMeCabで求める
+        init_mecab()
+        build_suggest_index(connect_elasticsearch())
+        state = load_state()
+        state["suggest_built_at"] = datetime.now().isoformat()
+        save_state(state)
+        return
+
+    if args.mode == 'export':
+        conn = connect_sql()
+        try:
+            export_snapshot(conn)
+        finally:
+            conn.close()
+            print("SQL connection closed.")
+        return
+
+    if args.source == 'snapshot':
+        # スナップショットを作ったときの行で再構築する（保存するハイウォーターマークもその時点になる）
+        conn = connect_snapshot()
+    else:
+        conn = connect_sql()
+    es = connect_elasticsearch()
+    state = load_state()
+
+    try:
+        if args.mode == 'incremental':
+            if not es.indices.exists(index=index_name) or not state.get('watermark'):
+                print("No existing index or watermark found. Falling back to full rebuild.")
+                run_full(conn, es, state)
+            else:
+                run_incremental(conn, es, state)
+        else:
+            run_full(conn, es, state, resume=args.resume)
+    finally:
+        # 接続のクローズ
+        conn.close()
+        if args.source == 'sql':
+            print("SQL connection closed.")
+
+
+if __name__ == "__main__":
+    main()
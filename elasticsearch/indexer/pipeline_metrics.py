@@ -0,0 +1,221 @@
+"""
+インデクサーのパイプライン（SQL読み込み→キーワード抽出→バルク送信）の段階ごとのメトリクス
+
+件数・バイト数のカウンター、バッチやリクエストごとのレイテンシのヒストグラム、段階間のキューの長さを記録し、
+Prometheusのテキスト形式（HTTPまたはファイル）で出力する。
+メインスレッドが前の段階を待った時間（wait_seconds）を比べると、遅い原因がSQL・抽出（CPU）・ESのどれかが分かる。
+"""
+import json
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# レイテンシのヒストグラムのバケット（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# メトリクスの種類と説明
+METRICS = {
+    'indexer_rows_fetched_total': ('counter', 'SQLから読み込んだ行数'),
+    'indexer_rows_expected': ('gauge', '読み込む予定の行数（数えていない場合は0）'),
+    'indexer_documents_transformed_total': ('counter', 'キーワード抽出を含めて変換したドキュメント数'),
+    'indexer_bulk_items_total': ('counter', 'バルクで送信したアクションの結果数'),
+    'indexer_bulk_items_failed_total': ('counter', 'バルクで失敗したアクション数'),
+    'indexer_bulk_requests_total': ('counter', '送信した_bulkリクエスト数'),
+    'indexer_bulk_rejections_total': ('counter', '429で拒否された_bulkリクエスト数'),
+    'indexer_bulk_bytes_sent_total': ('counter', '送信した_bulkの本文のバイト数'),
+    'indexer_wait_seconds_total': ('counter', 'メインスレッドが前の段階（sql / extract / bulk）を待った秒数'),
+    'indexer_queue_depth': ('gauge', '段階間のキューの長さ（sql_prefetch / extract_pending / bulk_in_flight）'),
+    'indexer_sql_fetch_seconds': ('histogram', 'fetchmany 1回の秒数'),
+    'indexer_extract_batch_seconds': ('histogram', '1バッチの変換（キーワード抽出）を投入してから終わるまでの秒数'),
+    'indexer_bulk_request_seconds': ('histogram', '_bulkリクエスト1回の秒数'),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+
+class PipelineMetrics:
+    """スレッドセーフなカウンター・ゲージ・ヒストグラム"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._histograms = {}
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, _label_key(labels))] = value
+
+    def get(self, name, **labels):
+        with self._lock:
+            return self._values.get((name, _label_key(labels)), 0)
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    def quantile(self, name, q, **labels):
+        """ヒストグラムのバケットから分位点の上限を返す（観測が無ければNone）"""
+        with self._lock:
+            histogram = self._histograms.get((name, _label_key(labels)))
+            if not histogram or not histogram['count']:
+                return None
+            target = q * histogram['count']
+            for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+                if count >= target:
+                    return bound
+            return float('inf')
+
+    def render_prometheus(self):
+        """Prometheusのテキスト形式で返す"""
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: dict(value, buckets=list(value['buckets'])) for key, value in self._histograms.items()}
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            samples = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+            series = sorted((labels, value) for (metric, labels), value in histograms.items() if metric == name)
+            if not samples and not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            for labels, histogram in series:
+                for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        """JSONで保存するための辞書を返す（ヒストグラムは件数・合計・p50/p99）"""
+        with self._lock:
+            values = dict(self._values)
+            histogram_keys = list(self._histograms)
+        result = {}
+        for (name, labels), value in sorted(values.items()):
+            result[name + _format_labels(labels)] = value
+        for name, labels in sorted(histogram_keys):
+            label_dict = dict(labels)
+            with self._lock:
+                histogram = self._histograms[(name, labels)]
+                count, total = histogram['count'], histogram['sum']
+            result[name + _format_labels(labels)] = {
+                'count': count,
+                'sum': round(total, 6),
+                'p50': self.quantile(name, 0.5, **label_dict),
+                'p99': self.quantile(name, 0.99, **label_dict)
+            }
+        return result
+
+    def write(self, path):
+        """メトリクスをファイルに保存する（.jsonならJSON、それ以外はPrometheusのテキスト形式）"""
+        with open(path, 'w') as f:
+            if path.endswith('.json'):
+                json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+            else:
+                f.write(self.render_prometheus())
+        print(f"Metrics written to {path}")
+
+    def serve(self, port):
+        """/metricsをPrometheusのテキスト形式で返すHTTPサーバーをバックグラウンドで起動する"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                payload = metrics.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"Serving metrics on :{port}/metrics")
+        return server
+
+
+class ProgressReporter:
+    """一定間隔で進捗・スループット・残り時間・キューの長さ・待ち時間を1行で表示する"""
+
+    def __init__(self, metrics, total_rows=None, interval=10):
+        self.metrics = metrics
+        self.total_rows = total_rows
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.time()
+        self._base_rows = self.metrics.get('indexer_rows_fetched_total')
+        self._base_items = self.metrics.get('indexer_bulk_items_total')
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.report()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def report(self):
+        m = self.metrics
+        elapsed = max(time.time() - self._started, 1e-9)
+        rows = m.get('indexer_rows_fetched_total') - self._base_rows
+        items = m.get('indexer_bulk_items_total') - self._base_items
+        rate = rows / elapsed
+        if self.total_rows:
+            remaining = max(self.total_rows - rows, 0)
+            eta = str(timedelta(seconds=round(remaining / rate))) if rate > 0 else '?'
+            progress = f"{rows}/{self.total_rows} rows ({rows / self.total_rows:.1%}), ETA {eta}"
+        else:
+            progress = f"{rows} rows"
+        print(
+            f"Progress: {progress}, {rate:.0f} rows/s, {items} bulk items "
+            f"({m.get('indexer_bulk_items_failed_total')} failed) | "
+            f"queues sql={m.get('indexer_queue_depth', queue='sql_prefetch')} "
+            f"extract={m.get('indexer_queue_depth', queue='extract_pending')} "
+            f"bulk={m.get('indexer_queue_depth', queue='bulk_in_flight')} | "
+            f"waited sql={m.get('indexer_wait_seconds_total', stage='sql'):.1f}s "
+            f"extract={m.get('indexer_wait_seconds_total', stage='extract'):.1f}s "
+            f"bulk={m.get('indexer_wait_seconds_total', stage='bulk'):.1f}s"
+        )
@@ -0,0 +1,218 @@
+"""
+ソースのビューをローカルに保存したスナップショット
+
+SQLから読み込んだ行を、gzip圧縮した1行1レコードのJSON（カラム順の配列）としてファイルに書き出し、
+マッピングや抽出設定を試す再構築ではSQL Serverの代わりにこのファイルから読み込む。
+読み込みはfetchmany単位で展開するため、メモリ使用量はファイルサイズに依存しない。
+
+ファイルは2つのgzipメンバーを連結したもので、1行目がヘッダー（カラム名・型・行数など）、以降が行。
+型はJSONで表せない値（日時など）のカラムだけを記録し、読み込み時に元の型に戻す。
+"""
+import os
+import gzip
+import json
+import base64
+import shutil
+from datetime import datetime, date, time
+from decimal import Decimal
+from itertools import islice
+from uuid import UUID
+
+SNAPSHOT_FORMAT = 'msprdb-snapshot'
+SNAPSHOT_VERSION = 1
+
+# JSONで表せない値の書き出し方と戻し方（pyodbcが返す日時・時刻・decimal・uniqueidentifier・バイナリ）
+_ENCODERS = {
+    datetime: ('datetime', datetime.isoformat),
+    date: ('date', date.isoformat),
+    time: ('time', time.isoformat),
+    Decimal: ('decimal', str),
+    UUID: ('uuid', str),
+    bytes: ('bytes', lambda value: base64.b64encode(value).decode('ascii')),
+    bytearray: ('bytes', lambda value: base64.b64encode(value).decode('ascii')),
+}
+_DECODERS = {
+    'datetime': datetime.fromisoformat,
+    'date': date.fromisoformat,
+    'time': time.fromisoformat,
+    'decimal': Decimal,
+    'uuid': UUID,
+    'bytes': base64.b64decode,
+}
+# JSONでそのまま表せる型
+_JSON_TYPES = (str, int, float, bool, type(None))
+
+
+def _find_encoder(column, value):
+    """型が完全に一致しない値（サブクラス）の書き出し方を返す（書き出せない型ならエラー）"""
+    for cls in type(value).__mro__:
+        if cls in _ENCODERS:
+            return _ENCODERS[cls]
+    if isinstance(value, _JSON_TYPES):
+        return None
+    raise TypeError(f"Column {column} has a {type(value).__name__} value that cannot be written to a snapshot")
+
+
+def check_columns(description):
+    """カーソルのdescriptionの型を確認し、書き出せない型のカラムがあれば書き出す前にエラーにする
+
+    値がNULLの行が多いカラムでも、何時間も書き出した後に失敗しないよう最初に確認する。
+    型が分からないカラム（SQLiteなど）は確認しない。
+    """
+    unsupported = [
+        f"{column[0]} ({column[1].__name__})" for column in description
+        if isinstance(column[1], type) and not issubclass(column[1], _JSON_TYPES)
+        and not any(issubclass(column[1], cls) for cls in _ENCODERS)
+    ]
+    if unsupported:
+        raise ValueError(f"Columns of these types cannot be written to a snapshot: {', '.join(unsupported)}")
+
+
+def write_snapshot(path, columns, batches, view, key_column=None, compresslevel=6, watermark=None):
+    """行のバッチ（カラム名をキーにした辞書のリスト）をスナップショットに書き出し、行数を返す
+
+    書き込み途中で失敗しても既存のスナップショットを壊さないよう、一時ファイルに書いてから置き換える。
+    key_columnには行を並べたカラムを渡す（--resumeで再開位置を探すのに使う）。
+    watermarkには読み込み前に取得したハイウォーターマークを渡す（スナップショットからの再構築で保存する）。
+    """
+    rows_path = path + '.rows.tmp'
+    tmp_path = path + '.tmp'
+    types = {}
+    rows = 0
+    try:
+        with gzip.open(rows_path, 'wt', encoding='utf-8', compresslevel=compresslevel) as f:
+            for batch in batches:
+                lines = []
+                for row_dict in batch:
+                    values = [row_dict[column] for column in columns]
+                    for i, value in enumerate(values):
+                        encoder = _ENCODERS.get(type(value))
+                        if encoder is None and type(value) not in _JSON_TYPES:
+                            encoder = _find_encoder(columns[i], value)
+                        if encoder is not None:
+                            types[columns[i]], encode = encoder
+                            values[i] = encode(value)
+                    lines.append(json.dumps(values, ensure_ascii=False, separators=(',', ':')))
+                if lines:
+                    f.write('\n'.join(lines) + '\n')
+                rows += len(lines)
+
+        # 型と行数は全行を読み終えるまで分からないため、ヘッダーのメンバーの後ろに行のメンバーをそのままつなげる
+        header = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "view": view,
+            "columns": list(columns),
+            "types": types,
+            "key_column": key_column,
+            "rows": rows,
+            "watermark": watermark.isoformat() if watermark else None,
+            "exported_at": datetime.now().isoformat()
+        }
+        with open(tmp_path, 'wb') as out:
+            out.write(gzip.compress((json.dumps(header, ensure_ascii=False) + '\n').encode('utf-8')))
+            with open(rows_path, 'rb') as f:
+                shutil.copyfileobj(f, out, 1024 * 1024)
+        os.replace(tmp_path, path)
+    finally:
+        for leftover in (rows_path, tmp_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return rows
+
+
+class Snapshot:
+    """スナップショットのヘッダーを読み込み、行を読むカーソルを作る"""
+
+    def __init__(self, path):
+        self.path = path
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+        if header.get('format') != SNAPSHOT_FORMAT or header.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} {SNAPSHOT_FORMAT} file")
+        self.header = header
+        self.columns = header['columns']
+        self.rows = header['rows']
+        self.key_column = header.get('key_column')
+        # 書き出す前に取得したハイウォーターマーク（記録していないスナップショットはNone）
+        self.watermark = datetime.fromisoformat(header['watermark']) if header.get('watermark') else None
+
+    def cursor(self, columns=None, where=None, start_after=None):
+        """行を読むカーソルを返す
+
+        columns: 返すカラム（Noneなら全カラム）
+        where: 全カラムの値のリストを受け取り、返す行ならTrueを返す関数
+        start_after: key_columnがこの値の行より後から読む（並び順はエクスポート時のSQLのまま）
+        """
+        return SnapshotCursor(self, columns, where, start_after)
+
+    def count(self, where=None):
+        """whereを満たす行数を返す（Noneならヘッダーの行数。条件がある場合は全行を読んで数える）"""
+        if where is None:
+            return self.rows
+        cursor = self.cursor(columns=self.columns[:1], where=where)
+        count = 0
+        try:
+            while True:
+                rows = cursor.fetchmany(10000)
+                if not rows:
+                    return count
+                count += len(rows)
+        finally:
+            cursor.close()
+
+    def close(self):
+        pass
+
+
+class SnapshotCursor:
+    """pyodbcのカーソルと同じようにdescriptionとfetchmanyで行を返す"""
+
+    def __init__(self, snapshot, columns=None, where=None, start_after=None):
+        self.snapshot = snapshot
+        names = snapshot.columns
+        self._select = [names.index(column) for column in columns] if columns else None
+        self.description = [(column,) for column in (columns or names)]
+        self._where = where
+        self._decoders = [(names.index(column), _DECODERS[kind]) for column, kind in snapshot.header['types'].items()]
+        self._skip_to = None
+        if start_after is not None:
+            if not snapshot.key_column:
+                raise ValueError(f"{snapshot.path} was not exported in key order; cannot start after a key")
+            self._skip_to = (names.index(snapshot.key_column), start_after)
+        self._file = gzip.open(snapshot.path, 'rt', encoding='utf-8')
+        self._file.readline()
+
+    def _decode(self, line):
+        values = json.loads(line)
+        for i, decode in self._decoders:
+            if values[i] is not None:
+                values[i] = decode(values[i])
+        return values
+
+    def _skip(self):
+        # 再開位置の行まで読み飛ばす（SQLの照合順序とPythonの比較順が異なっても位置がずれないよう、値の一致で探す）
+        index, key = self._skip_to
+        self._skip_to = None
+        for line in self._file:
+            if self._decode(line)[index] == key:
+                return
+        raise ValueError(f"Key {key!r} was not found in {self.snapshot.path}")
+
+    def fetchmany(self, size):
+        if self._skip_to is not None:
+            self._skip()
+        rows = []
+        while len(rows) < size:
+            lines = list(islice(self._file, size - len(rows)))
+            if not lines:
+                break
+            for line in lines:
+                values = self._decode(line)
+                if self._where is not None and not self._where(values):
+                    continue
+                rows.append([values[i] for i in self._select] if self._select else values)
+        return rows
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,172 @@
+"""全件再構築のチェックポイントとハイウォーターマークのテスト"""
+import json
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import index_data
+from index_data import Checkpoint, load_checkpoint, read_source_watermark
+
+
+class IndicesStub:
+    def __init__(self, existing):
+        self.existing = set(existing)
+
+    def exists(self, index, **kwargs):
+        return index in self.existing
+
+
+class ElasticsearchStub:
+    def __init__(self, existing=()):
+        self.indices = IndicesStub(existing)
+
+
+@pytest.fixture(autouse=True)
+def state_path(tmp_path, monkeypatch):
+    path = tmp_path / 'index_state.json'
+    monkeypatch.setattr(index_data, 'INDEX_STATE_PATH', str(path))
+    monkeypatch.setattr(index_data, 'CHECKPOINT_INTERVAL_SECONDS', 3600)
+    return path
+
+
+def result(doc_id, status=201):
+    return {'index': {'_id': doc_id, 'status': status}}
+
+
+def test_advances_when_batches_complete_in_any_order():
+    checkpoint = Checkpoint({}, 'index-1')
+    checkpoint.add_batch('p002', ['p001', 'p002'])
+    checkpoint.add_batch('p004', ['p003', 'p004'])
+    # 後のバッチが先に完了しても、前のバッチが完了するまで再開位置は進めない
+    for doc_id in ('p003', 'p004', 'p001'):
+        checkpoint.done(True, result(doc_id))
+    assert checkpoint.last_key is None
+    checkpoint.done(True, result('p002'))
+    assert checkpoint.last_key == 'p004'
+    assert checkpoint.indexed == 4
+
+
+def test_duplicate_ids_do_not_stall_the_checkpoint():
+    checkpoint = Checkpoint({}, 'index-1')
+    # 同じIDがバッチ内と、後のバッチにも出現する
+    checkpoint.add_batch('p002', ['p001', 'p001', 'p002'])
+    checkpoint.add_batch('p003', ['p001', 'p003'])
+    for doc_id in ('p003', 'p001', 'p002', 'p001', 'p001'):
+        checkpoint.done(True, result(doc_id))
+    assert checkpoint.last_key == 'p003'
+    assert checkpoint.indexed == 5
+    assert checkpoint._batch_of == {}
+
+
+def test_failed_document_blocks_its_batch_and_later_ones():
+    checkpoint = Checkpoint({}, 'index-1')
+    checkpoint.add_batch('p001', ['p001'])
+    checkpoint.add_batch('p002', ['p002'])
+    checkpoint.add_batch('p003', ['p003'])
+    checkpoint.done(True, result('p001'))
+    checkpoint.done(False, result('p002', status=400))
+    checkpoint.done(True, result('p003'))
+    assert checkpoint.last_key == 'p001'
+    assert checkpoint.indexed == 1
+
+
+def test_empty_batch_advances_immediately():
+    checkpoint = Checkpoint({}, 'index-1')
+    checkpoint.add_batch('p005', [])
+    assert checkpoint.last_key == 'p005'
+
+
+def test_key_ranges_advance_independently():
+    checkpoint = Checkpoint({}, 'index-1', ranges=[[None, 'p100'], ['p100', None]])
+    checkpoint.add_batch('p050', ['p010', 'p050'], range_id=0)
+    checkpoint.add_batch('p150', ['p150'], range_id=1)
+    checkpoint.done(True, result('p150'))
+    assert checkpoint.ranges == [[None, 'p100'], ['p150', None]]
+    checkpoint.done(True, result('p010'))
+    checkpoint.done(True, result('p050'))
+    assert checkpoint.ranges == [['p050', 'p100'], ['p150', None]]
+    assert checkpoint.indexed == 3
+
+
+def test_save_and_resume_keep_the_watermark_taken_before_reading(state_path):
+    watermark = datetime(2025, 1, 6, 12, 30)
+    settings = {'index.refresh_interval': None, 'index.number_of_replicas': '1'}
+    state = {'watermark': '2025-01-01T00:00:00'}
+    checkpoint = Checkpoint(state, 'index-1', watermark=watermark, index_settings=settings,
+                            ranges=[[None, 'p100'], ['p100', None]])
+    checkpoint.add_batch('p050', ['p050'], range_id=0)
+    checkpoint.done(True, result('p050'))
+    checkpoint.save()
+
+    saved = json.loads(state_path.read_text())
+    assert saved['checkpoint']['source_watermark'] == watermark.isoformat()
+
+    resumed = load_checkpoint(ElasticsearchStub(['index-1']), saved)
+    assert resumed.watermark == watermark
+    assert resumed.physical_index == 'index-1'
+    assert resumed.ranges == [['p050', 'p100'], ['p100', None]]
+    assert resumed.indexed == 1
+    assert resumed.index_settings == settings
+
+
+def test_resume_of_an_older_checkpoint_uses_the_previous_watermark():
+    state = {
+        'watermark': '2025-01-01T00:00:00',
+        'checkpoint': {
+            'index': 'index-1', 'key_column': index_data.ID_COLUMN, 'last_key': 'p010', 'indexed': 10,
+            # 読んだ行の最大値を記録していた以前の形式
+            'watermark': '2025-03-01T00:00:00',
+        },
+    }
+    resumed = load_checkpoint(ElasticsearchStub(['index-1']), state)
+    assert resumed.watermark == datetime(2025, 1, 1)
+    assert resumed.last_key == 'p010'
+
+
+def test_resume_fails_without_the_index():
+    state = {'checkpoint': {'index': 'index-1', 'key_column': index_data.ID_COLUMN, 'last_key': None, 'indexed': 0}}
+    with pytest.raises(RuntimeError, match='no longer exists'):
+        load_checkpoint(ElasticsearchStub(), state)
+
+
+def test_resume_fails_without_a_checkpoint():
+    with pytest.raises(RuntimeError, match='No checkpoint'):
+        load_checkpoint(ElasticsearchStub(), {})
+
+
+def make_view(monkeypatch, rows):
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE PostCommentView (PostId TEXT, CreatedAt TIMESTAMP, CommentedAt TIMESTAMP, "
+                 "DeletedAt TIMESTAMP, Text TEXT)")
+    conn.executemany("INSERT INTO PostCommentView VALUES (?, ?, ?, ?, ?)", rows)
+    monkeypatch.setattr(index_data, 'SOURCE_VIEW', 'PostCommentView')
+    return conn
+
+
+def test_source_watermark_is_the_max_over_all_watermark_columns(monkeypatch):
+    conn = make_view(monkeypatch, [
+        ('p001', '2025-01-01 00:00:00', '2025-01-03 00:00:00', None, 'a'),
+        ('p002', '2025-01-02 00:00:00', None, '2025-01-04 08:00:00', 'b'),
+        ('p003', '2025-01-02 12:00:00', None, None, 'c'),
+    ])
+    # 論理削除された行の日時も含める（差分インデックスは削除も反映するため）
+    assert read_source_watermark(conn) == datetime(2025, 1, 4, 8)
+
+
+def test_source_watermark_of_an_empty_view_is_none(monkeypatch):
+    assert read_source_watermark(make_view(monkeypatch, [])) is None
+
+
+def test_source_watermark_of_a_snapshot(tmp_path):
+    from source_snapshot import Snapshot, write_snapshot
+
+    rows = [{'PostId': 'p001', 'CreatedAt': datetime(2025, 1, 1), 'CommentedAt': datetime(2025, 1, 5)}]
+    recorded = str(tmp_path / 'recorded.ndjson.gz')
+    write_snapshot(recorded, list(rows[0]), [rows], 'view', 'PostId', watermark=datetime(2025, 1, 9))
+    assert read_source_watermark(Snapshot(recorded)) == datetime(2025, 1, 9)
+
+    # 書き出し前の値を記録していないスナップショットは全行の最大値
+    older = str(tmp_path / 'older.ndjson.gz')
+    write_snapshot(older, list(rows[0]), [rows], 'view', 'PostId')
+    assert read_source_watermark(Snapshot(older)) == datetime(2025, 1, 5)
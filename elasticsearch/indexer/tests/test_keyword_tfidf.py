@@ -0,0 +1,124 @@
+"""TF-IDFによるキーワードの順位付けと、IDFの集計のテスト"""
+import json
+from datetime import datetime
+
+import pytest
+
+import index_data
+from index_data import build_keyword_idf, comment_texts, extract_keywords_tfidf
+from keyword_cache import KeywordCache
+from source_snapshot import Snapshot, write_snapshot
+
+IDF = {
+    "version": "20250101000000",
+    "documents": 10,
+    "default_idf": 3.0,
+    "idf": {"東京": 1.0, "ラーメン": 2.0, "天気": 1.5},
+}
+
+
+def split_words(text):
+    """形態素解析の代わりに空白で区切る"""
+    if 'BROKEN' in text:
+        raise RuntimeError('broken text')
+    return text.split()
+
+
+@pytest.fixture(autouse=True)
+def scoring(monkeypatch):
+    monkeypatch.setattr(index_data, 'keyword_candidates', split_words)
+    monkeypatch.setattr(index_data, 'keyword_idf', IDF)
+    monkeypatch.setattr(index_data, 'keyword_cache', None)
+
+
+def test_ranks_by_term_frequency_times_idf():
+    # 東京: 3 * 1.0, ラーメン: 1 * 2.0, 天気: 2 * 1.5, 猫（未知語）: 1 * 3.0
+    text = "東京 ラーメン 東京 天気 天気 東京 猫"
+    assert extract_keywords_tfidf([text], max_keywords=10) == [["東京", "天気", "猫", "ラーメン"]]
+
+
+def test_ties_keep_the_order_of_first_appearance():
+    # 天気（2 * 1.5）、東京（3 * 1.0）、猫（1 * 3.0）は同点
+    text = "天気 東京 猫 東京 天気 東京"
+    assert extract_keywords_tfidf([text], max_keywords=10) == [["天気", "東京", "猫"]]
+
+
+def test_keeps_the_top_keywords_per_document():
+    texts = ["東京 ラーメン 猫", "天気 天気 東京", "ラーメン"]
+    assert extract_keywords_tfidf(texts, max_keywords=2) == [["猫", "ラーメン"], ["天気", "東京"], ["ラーメン"]]
+
+
+def test_empty_texts_return_no_keywords():
+    assert extract_keywords_tfidf([None, "", "東京"], max_keywords=3) == [[], [], ["東京"]]
+
+
+def test_extraction_error_only_affects_its_document(capsys):
+    texts = ["東京 ラーメン", "BROKEN 東京", "天気"]
+    assert extract_keywords_tfidf(texts, max_keywords=3) == [["ラーメン", "東京"], [], ["天気"]]
+    assert 'broken text' in capsys.readouterr().out
+
+
+def test_uses_and_fills_the_cache(monkeypatch):
+    cache = KeywordCache('test')
+    monkeypatch.setattr(index_data, 'keyword_cache', cache)
+    params = f"tfidf:{IDF['version']}:3"
+    cache.put("東京 ラーメン", ["キャッシュ"], params)
+
+    assert extract_keywords_tfidf(["東京 ラーメン", "天気 東京"], max_keywords=3) == [["キャッシュ"], ["天気", "東京"]]
+    assert cache.get("天気 東京", params) == ["天気", "東京"]
+    # 抽出に失敗した本文はキャッシュしない
+    extract_keywords_tfidf(["BROKEN"], max_keywords=3)
+    assert cache.get("BROKEN", params) is None
+
+
+def test_comment_texts_skips_deleted_and_invalid_comments():
+    comments = json.dumps([
+        {"Text": "コメント1"},
+        {"Text": "削除済み", "DeletedAt": "2025-01-01T00:00:00"},
+        {"Text": ""},
+        "not a comment",
+        {"Text": "コメント2"},
+    ], ensure_ascii=False)
+    assert comment_texts(comments) == ["コメント1", "コメント2"]
+    assert comment_texts({"Text": "1件だけ"}) == ["1件だけ"]
+    assert comment_texts("{broken json") == []
+    assert comment_texts(None) == []
+
+
+def test_idf_counts_posts_and_comments_as_documents(tmp_path, monkeypatch):
+    idf_path = str(tmp_path / 'keyword_idf.json')
+    monkeypatch.setattr(index_data, 'KEYWORD_IDF_PATH', idf_path)
+    monkeypatch.setattr(index_data, 'KEYWORD_IDF_MIN_DF', 2)
+    monkeypatch.setattr(index_data, 'EXCLUDE_DELETED', True)
+    rows = [
+        {"PostId": "p1", "Text": "東京 東京 ラーメン", "DeletedAt": None,
+         "Comments": json.dumps([{"Text": "東京 天気"}, {"Text": "天気", "DeletedAt": "2025-01-02"}])},
+        {"PostId": "p2", "Text": None, "DeletedAt": None, "Comments": json.dumps([{"Text": "ラーメン 猫"}])},
+        {"PostId": "p3", "Text": "東京 猫", "DeletedAt": datetime(2025, 1, 3), "Comments": None},
+        {"PostId": "p4", "Text": "天気", "DeletedAt": None, "Comments": None},
+    ]
+    path = str(tmp_path / 'snapshot.ndjson.gz')
+    write_snapshot(path, list(rows[0]), [rows], 'view', 'PostId')
+
+    build_keyword_idf(Snapshot(path), workers=1)
+    table = json.load(open(idf_path, encoding='utf-8'))
+
+    # 文書は投稿p1・p4の本文と、削除されていないコメント2件（削除された投稿p3は数えない）
+    assert table["documents"] == 4
+    # 文書頻度2以上の語だけを保存する（猫は1件）
+    assert set(table["idf"]) == {"東京", "ラーメン", "天気"}
+    assert table["idf"]["東京"] == pytest.approx(1.5108256, abs=1e-6)
+    assert table["default_idf"] == pytest.approx(1.9162907, abs=1e-6)
+
+
+def test_idf_of_a_snapshot_without_deleted_at(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_data, 'KEYWORD_IDF_PATH', str(tmp_path / 'keyword_idf.json'))
+    monkeypatch.setattr(index_data, 'EXCLUDE_DELETED', True)
+    rows = [{"PostId": "p1", "Text": "東京"}, {"PostId": "p2", "Text": "東京 天気"}]
+    path = str(tmp_path / 'snapshot.ndjson.gz')
+    write_snapshot(path, ["PostId", "Text"], [rows], 'view', 'PostId')
+
+    build_keyword_idf(Snapshot(path), workers=1)
+    table = json.load(open(tmp_path / 'keyword_idf.json', encoding='utf-8'))
+    assert table["documents"] == 2
+    assert set(table["idf"]) == {"東京"}
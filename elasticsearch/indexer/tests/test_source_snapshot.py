@@ -0,0 +1,139 @@
+"""source_snapshotの書き出しと読み込みのテスト"""
+import gzip
+import json
+from datetime import datetime, date, time
+from decimal import Decimal
+from uuid import UUID
+
+import pytest
+
+from source_snapshot import Snapshot, write_snapshot, check_columns
+
+COLUMNS = ['PostId', 'CreatedAt', 'PostedOn', 'PostedTime', 'Score', 'Guid', 'Raw', 'Text', 'DeletedAt']
+
+
+def make_rows(count):
+    rows = []
+    for i in range(count):
+        rows.append({
+            'PostId': f"p{i:05d}",
+            'CreatedAt': datetime(2025, 1, 1, 0, i),
+            'PostedOn': date(2025, 1, 1 + i % 28),
+            'PostedTime': time(12, i % 60, 30, 250),
+            'Score': Decimal(f"{i}.50"),
+            'Guid': UUID(int=i),
+            'Raw': bytes([i % 256, 0, 255]),
+            'Text': f"本文{i}" if i % 3 else None,
+            'DeletedAt': datetime(2025, 2, 1) if i % 5 == 0 else None,
+        })
+    return rows
+
+
+def read_all(cursor, size=7):
+    rows = []
+    while True:
+        batch = cursor.fetchmany(size)
+        if not batch:
+            return rows
+        rows.extend(batch)
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    rows = make_rows(40)
+    path = str(tmp_path / 'snapshot.ndjson.gz')
+    # 複数のバッチに分けて書き出す
+    count = write_snapshot(path, COLUMNS, [rows[:15], [], rows[15:]], 'Mspr.PostCommentView', 'PostId',
+                           watermark=datetime(2025, 3, 1))
+    assert count == len(rows)
+    return Snapshot(path), rows
+
+
+def test_round_trip_restores_types(snapshot):
+    snap, rows = snapshot
+    assert snap.rows == len(rows)
+    assert snap.columns == COLUMNS
+    assert snap.key_column == 'PostId'
+    assert snap.watermark == datetime(2025, 3, 1)
+    assert read_all(snap.cursor()) == [[row[column] for column in COLUMNS] for row in rows]
+
+
+def test_bytearray_is_read_back_as_bytes(tmp_path):
+    path = str(tmp_path / 'snapshot.ndjson.gz')
+    write_snapshot(path, ['Raw'], [[{'Raw': bytearray(b'\x00abc')}]], 'view')
+    assert read_all(Snapshot(path).cursor()) == [[b'\x00abc']]
+
+
+def test_subclass_of_supported_type_is_encoded(tmp_path):
+    class LocalDateTime(datetime):
+        pass
+
+    path = str(tmp_path / 'snapshot.ndjson.gz')
+    write_snapshot(path, ['At'], [[{'At': LocalDateTime(2025, 1, 2, 3, 4)}]], 'view')
+    assert read_all(Snapshot(path).cursor()) == [[datetime(2025, 1, 2, 3, 4)]]
+
+
+def test_unsupported_value_fails_and_keeps_no_file(tmp_path):
+    path = str(tmp_path / 'snapshot.ndjson.gz')
+    with pytest.raises(TypeError, match='Column Value'):
+        write_snapshot(path, ['Value'], [[{'Value': object()}]], 'view')
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_check_columns_names_unsupported_columns():
+    check_columns([('Text', str, None), ('Guid', UUID, None), ('Raw', bytearray, None), ('Unknown', None, None)])
+    with pytest.raises(ValueError, match=r'Value \(complex\)'):
+        check_columns([('Text', str, None), ('Value', complex, None)])
+
+
+def test_header_is_a_separate_gzip_member(snapshot):
+    snap, rows = snapshot
+    with gzip.open(snap.path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        assert sum(1 for _ in f) == len(rows)
+    assert header['types']['Guid'] == 'uuid'
+    assert header['types']['Raw'] == 'bytes'
+    assert header['types']['PostedTime'] == 'time'
+
+
+def test_columns_and_where(snapshot):
+    snap, rows = snapshot
+    deleted = COLUMNS.index('DeletedAt')
+    cursor = snap.cursor(columns=['PostId', 'Text'], where=lambda row: row[deleted] is None)
+    assert [column[0] for column in cursor.description] == ['PostId', 'Text']
+    expected = [[row['PostId'], row['Text']] for row in rows if row['DeletedAt'] is None]
+    assert read_all(cursor, size=4) == expected
+    assert snap.count(lambda row: row[deleted] is None) == len(expected)
+    assert snap.count() == len(rows)
+
+
+def test_start_after_resumes_after_the_key(snapshot):
+    snap, rows = snapshot
+    cursor = snap.cursor(columns=['PostId'], start_after='p00012')
+    assert read_all(cursor) == [[row['PostId']] for row in rows[13:]]
+
+
+def test_start_after_last_key_returns_nothing(snapshot):
+    snap, rows = snapshot
+    assert read_all(snap.cursor(start_after=rows[-1]['PostId'])) == []
+
+
+def test_start_after_unknown_key_fails(snapshot):
+    snap, _ = snapshot
+    with pytest.raises(ValueError, match='not found'):
+        snap.cursor(start_after='p99999').fetchmany(1)
+
+
+def test_start_after_requires_key_order(tmp_path):
+    path = str(tmp_path / 'snapshot.ndjson.gz')
+    write_snapshot(path, ['PostId'], [[{'PostId': 'p1'}]], 'view')
+    with pytest.raises(ValueError, match='key order'):
+        Snapshot(path).cursor(start_after='p1')
+
+
+def test_rejects_other_files(tmp_path):
+    path = str(tmp_path / 'other.ndjson.gz')
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write('{"format": "other"}\n')
+    with pytest.raises(ValueError, match='msprdb-snapshot'):
+        Snapshot(path)
@@ -0,0 +1,214 @@
+from flask import Flask, request, jsonify
+from elasticsearch import Elasticsearch, helpers
+from collections import deque
+import logging
+import threading
+import time
+import os
+from suggest_store import SuggestStore, normalize_key
+
+app = Flask(__name__)
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Elasticsearch設定
+ES_HOST = os.environ.get('ELASTICSEARCH_HOST', 'http://localhost:9200')
+# インデクサーが作成するサジェスト専用インデックスと、それが無い場合に語を集計する投稿インデックス
+SUGGEST_INDEX = os.environ.get('SUGGEST_INDEX', 'msprdb-suggest')
+SOURCE_INDEX = os.environ.get('SUGGEST_SOURCE_INDEX', 'msprdb-index')
+# サジェスト専用インデックスのcompletionのコンテキスト（type）で問い合わせるカテゴリ
+SUGGEST_TYPES = ["keyword", "hashtag"]
+# 語彙を読み込み直す間隔（秒）
+REFRESH_SECONDS = int(os.environ.get('SUGGEST_REFRESH_SECONDS', '300'))
+# 接頭辞ごとに事前計算する候補数と、事前計算する接頭辞の最大文字数
+TOP_K = int(os.environ.get('SUGGEST_TOP_K', '10'))
+PRECOMPUTE_DEPTH = int(os.environ.get('SUGGEST_PRECOMPUTE_DEPTH', '2'))
+# 1回のサジェストで返す候補数（リクエストで指定しない場合）と、指定できる最大数
+DEFAULT_SIZE = 5
+MAX_SIZE = 50
+
+es = Elasticsearch([ES_HOST], timeout=10)
+
+# 現在の語彙（読み込み直す際は新しいストアを作ってから差し替える）
+store = None
+loaded_at = None
+load_error = None
+# サジェスト専用インデックスがあるか（語彙を読み込むたびに確認し、Elasticsearchへの問い合わせ先を決める。Noneは未確認）
+suggest_index_exists = None
+_refresh_lock = threading.Lock()
+
+# メトリクス
+_metrics_lock = threading.Lock()
+_latencies = {'local': deque(maxlen=10000), 'elasticsearch': deque(maxlen=10000)}
+_counts = {'local': 0, 'elasticsearch': 0, 'empty': 0}
+
+
+def load_entries():
+    """サジェスト専用インデックスから (語, 重み, 読み) を読み込む（無い場合は投稿インデックスから集計する）"""
+    global suggest_index_exists
+    suggest_index_exists = es.indices.exists(index=SUGGEST_INDEX)
+    if suggest_index_exists:
+        for hit in helpers.scan(es, index=SUGGEST_INDEX, _source=["Term", "Reading", "suggest.weight"], size=5000):
+            source = hit['_source']
+            yield source['Term'], source.get('suggest', {}).get('weight', 1), source.get('Reading')
+        return
+
+    # 投稿インデックスには読みが無いため、表記（カタカナはひらがなにそろえる）だけで一致させる
+    logger.info("Index %s not found; aggregating terms from %s.", SUGGEST_INDEX, SOURCE_INDEX)
+    for field in ("Keywords.keyword", "HashTags.keyword"):
+        after_key = None
+        while True:
+            composite = {"size": 1000, "sources": [{"term": {"terms": {"field": field}}}]}
+            if after_key:
+                composite["after"] = after_key
+            result = es.search(index=SOURCE_INDEX, body={"size": 0, "aggs": {"terms": {"composite": composite}}})
+            buckets = result['aggregations']['terms']['buckets']
+            for bucket in buckets:
+                yield bucket['key']['term'], bucket['doc_count']
+            after_key = result['aggregations']['terms'].get('after_key')
+            if not buckets or not after_key:
+                break
+
+
+def refresh():
+    """語彙を読み込み直し、読み込みが終わってからストアを差し替える"""
+    global store, loaded_at, load_error
+    with _refresh_lock:
+        try:
+            started = time.time()
+            new_store = SuggestStore(load_entries(), top_k=TOP_K, precompute_depth=PRECOMPUTE_DEPTH)
+            store = new_store
+            loaded_at = time.time()
+            load_error = None
+            logger.info("Loaded %d suggestion terms in %.1fs.", len(new_store), loaded_at - started)
+        except Exception as e:
+            load_error = str(e)
+            logger.error("Failed to load suggestion terms: %s", e)
+    return store
+
+
+def refresh_loop():
+    while True:
+        refresh()
+        time.sleep(REFRESH_SECONDS)
+
+
+def suggest_from_elasticsearch(prefix, size):
+    """ローカルに候補が無い場合に、Elasticsearchのcompletion suggesterで取得する
+
+    問い合わせ先は語彙を読み込んだ時に確認した結果で決め、リクエストごとにインデックスの有無を確認しない。
+    """
+    global suggest_index_exists
+    if suggest_index_exists is None:
+        # 語彙の読み込みが一度も始まっていない場合だけ確認する
+        suggest_index_exists = es.indices.exists(index=SUGGEST_INDEX)
+    completion = {"size": size, "skip_duplicates": True}
+    if suggest_index_exists:
+        # サジェスト専用インデックスは正規化した読みも入力にしているため、同じ正規化をした接頭辞で問い合わせる
+        # （completionにtypeのコンテキストがあるため、問い合わせにもカテゴリを指定する）
+        index, prefix = SUGGEST_INDEX, normalize_key(prefix)
+        completion.update({"field": "suggest", "contexts": {"type": SUGGEST_TYPES}})
+    else:
+        index = SOURCE_INDEX
+        completion["field"] = "Keywords.suggest"
+    body = {
+        "_source": ["Term"],
+        "suggest": {
+            "text-suggest": {
+                "prefix": prefix,
+                "completion": completion
+            }
+        }
+    }
+    result = es.search(index=index, body=body)
+    options = result['suggest']['text-suggest'][0]['options']
+    # optionのtextは一致した入力（読みの場合もある）なので、語の表記はTermから取る
+    return [
+        {'text': option.get('_source', {}).get('Term', option['text']), 'weight': option.get('_score', 0)}
+        for option in options
+    ]
+
+
+def _record(source, elapsed):
+    with _metrics_lock:
+        if source in _latencies:
+            _latencies[source].append(elapsed)
+        _counts[source] += 1
+
+
+# ルート設定
+@app.route('/suggest', methods=['GET'])
+def suggest():
+    prefix = request.args.get('q', '')
+    # 数値でない場合は既定値、範囲外の場合は1〜MAX_SIZEに丸める
+    size = min(max(request.args.get('size', DEFAULT_SIZE, type=int), 1), MAX_SIZE)
+
+    started = time.perf_counter()
+    current = store
+    suggestions = current.lookup(prefix, size) if current is not None else []
+    elapsed = time.perf_counter() - started
+    if suggestions:
+        _record('local', elapsed)
+        return jsonify({'query': prefix, 'source': 'local', 'suggestions': suggestions})
+
+    if not prefix.strip():
+        _record('empty', elapsed)
+        return jsonify({'query': prefix, 'source': 'local', 'suggestions': []})
+
+    # ローカルの語彙に無い（誤字や読み込み前など）場合だけElasticsearchに問い合わせる
+    try:
+        suggestions = suggest_from_elasticsearch(prefix, size)
+    except Exception as e:
+        logger.warning("Elasticsearch suggestion failed: %s", e)
+        suggestions = []
+    _record('elasticsearch', time.perf_counter() - started)
+    return jsonify({'query': prefix, 'source': 'elasticsearch', 'suggestions': suggestions})
+
+
+@app.route('/refresh', methods=['POST'])
+def refresh_now():
+    current = refresh()
+    if load_error:
+        return jsonify({'status': 'error', 'error': load_error}), 500
+    return jsonify({'status': 'ok', 'terms': len(current)})
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    if store is not None:
+        return jsonify({'status': 'ready', 'terms': len(store), 'loaded_at': loaded_at})
+    status = {'status': 'loading'}
+    if load_error:
+        status.update({'status': 'error', 'error': load_error})
+    return jsonify(status), 503
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    with _metrics_lock:
+        latencies = {source: sorted(values) for source, values in _latencies.items()}
+        counts = dict(_counts)
+
+    def summary(values):
+        if not values:
+            return {'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+        return {
+            'p50': round(values[len(values) // 2] * 1000, 4),
+            'p99': round(values[min(len(values) - 1, int(len(values) * 0.99))] * 1000, 4),
+            'max': round(values[-1] * 1000, 4)
+        }
+
+    return jsonify({
+        'terms': len(store) if store is not None else 0,
+        'loaded_at': loaded_at,
+        'requests': counts,
+        # localはストアの検索時間、elasticsearchは問い合わせを含む時間
+        'latency_ms': {source: summary(values) for source, values in latencies.items()}
+    })
+
+
+# 起動をブロックせずに語彙を読み込み、以降は定期的に読み込み直す
+threading.Thread(target=refresh_loop, name="suggest-refresh", daemon=True).start()
+
+if __name__ == "__main__":
+    app.run(host='0.0.0.0', port=80)
@@ -0,0 +1,125 @@
+"""
+サジェストの前方一致に使うキーの正規化
+
+インデクサー（サジェスト専用インデックスの入力）とサジェストサービス（検索キー）で
+同じ正規化を行うため、両方のディレクトリに同じ内容で置いている。
+変更した場合は python elasticsearch/check_shared_modules.py でコピーが一致しているか確認する。
+
+- 全角・半角、大文字・小文字の違いをNFKCと小文字化で吸収する
+- カタカナはひらがなにそろえる（「ラーメン」「らーめん」を同じキーにする）
+- 読みがひらがなだけの場合は、ローマ字入力の途中（「ra-men」「toukyo」）でも一致するようローマ字のキーも作る
+"""
+import re
+import unicodedata
+
+# ひらがな（ゔ・ゕ・ゖを含む）と長音記号だけからなる文字列
+_KANA_ONLY = re.compile(r'^[ぁ-ゖー]+$')
+# カタカナの読み（MeCabの読みが使えるものかの判定に使う）
+_KATAKANA_ONLY = re.compile(r'^[ァ-ヺー]+$')
+
+# ローマ字入力で打つ綴り（IMEで変換される綴りにそろえる）
+_ROMAJI = {
+    'あ': 'a', 'い': 'i', 'う': 'u', 'え': 'e', 'お': 'o',
+    'か': 'ka', 'き': 'ki', 'く': 'ku', 'け': 'ke', 'こ': 'ko',
+    'さ': 'sa', 'し': 'shi', 'す': 'su', 'せ': 'se', 'そ': 'so',
+    'た': 'ta', 'ち': 'chi', 'つ': 'tsu', 'て': 'te', 'と': 'to',
+    'な': 'na', 'に': 'ni', 'ぬ': 'nu', 'ね': 'ne', 'の': 'no',
+    'は': 'ha', 'ひ': 'hi', 'ふ': 'fu', 'へ': 'he', 'ほ': 'ho',
+    'ま': 'ma', 'み': 'mi', 'む': 'mu', 'め': 'me', 'も': 'mo',
+    'や': 'ya', 'ゆ': 'yu', 'よ': 'yo',
+    'ら': 'ra', 'り': 'ri', 'る': 'ru', 'れ': 're', 'ろ': 'ro',
+    'わ': 'wa', 'ゐ': 'wi', 'ゑ': 'we', 'を': 'wo', 'ん': 'n',
+    'が': 'ga', 'ぎ': 'gi', 'ぐ': 'gu', 'げ': 'ge', 'ご': 'go',
+    'ざ': 'za', 'じ': 'ji', 'ず': 'zu', 'ぜ': 'ze', 'ぞ': 'zo',
+    'だ': 'da', 'ぢ': 'di', 'づ': 'du', 'で': 'de', 'ど': 'do',
+    'ば': 'ba', 'び': 'bi', 'ぶ': 'bu', 'べ': 'be', 'ぼ': 'bo',
+    'ぱ': 'pa', 'ぴ': 'pi', 'ぷ': 'pu', 'ぺ': 'pe', 'ぽ': 'po',
+    'ゔ': 'vu',
+    'ぁ': 'xa', 'ぃ': 'xi', 'ぅ': 'xu', 'ぇ': 'xe', 'ぉ': 'xo',
+    'ゃ': 'xya', 'ゅ': 'xyu', 'ょ': 'xyo', 'ゎ': 'xwa', 'ゕ': 'xka', 'ゖ': 'xke',
+    'ー': '-',
+}
+
+# 拗音などの2文字で1音になる組み合わせ
+_ROMAJI_DIGRAPHS = {
+    'しゃ': 'sha', 'しゅ': 'shu', 'しぇ': 'she', 'しょ': 'sho',
+    'ちゃ': 'cha', 'ちゅ': 'chu', 'ちぇ': 'che', 'ちょ': 'cho',
+    'じゃ': 'ja', 'じゅ': 'ju', 'じぇ': 'je', 'じょ': 'jo',
+    'ふぁ': 'fa', 'ふぃ': 'fi', 'ふぇ': 'fe', 'ふぉ': 'fo',
+    'てぃ': 'thi', 'でぃ': 'dhi', 'とぅ': 'twu', 'どぅ': 'dwu',
+    'うぃ': 'wi', 'うぇ': 'we', 'うぉ': 'who',
+    'ゔぁ': 'va', 'ゔぃ': 'vi', 'ゔぇ': 've', 'ゔぉ': 'vo',
+}
+for _kana, _romaji in list(_ROMAJI.items()):
+    # きゃ→kya のように、い段の子音にyを付ける
+    if _romaji.endswith('i') and len(_romaji) == 2 and _kana not in ('い', 'ゐ'):
+        for _small, _vowel in (('ゃ', 'a'), ('ゅ', 'u'), ('ょ', 'o')):
+            _ROMAJI_DIGRAPHS.setdefault(_kana + _small, _romaji[0] + 'y' + _vowel)
+
+
+def fold_width(text):
+    """全角・半角と大文字・小文字の違いを吸収し、連続する空白を1つにする"""
+    return ' '.join(unicodedata.normalize('NFKC', text).lower().split())
+
+
+def katakana_to_hiragana(text):
+    """カタカナをひらがなに変換する（ヷ〜ヺなど対応するひらがなが無い文字はそのまま）"""
+    return ''.join(chr(ord(ch) - 0x60) if 'ァ' <= ch <= 'ヶ' else ch for ch in text)
+
+
+def fold_kana(text):
+    """幅・大文字小文字をそろえ、カタカナをひらがなにしたキーを返す"""
+    return katakana_to_hiragana(fold_width(text))
+
+
+def is_kana(text):
+    """ひらがなと長音記号だけからなるか"""
+    return bool(_KANA_ONLY.match(text))
+
+
+def is_katakana(text):
+    """カタカナと長音記号だけからなるか"""
+    return bool(_KATAKANA_ONLY.match(text))
+
+
+def hiragana_to_romaji(text):
+    """ひらがなをローマ字入力の綴りに変換する（ひらがな以外の文字はそのまま）"""
+    # 1音ずつの綴りに分けてから、促音と撥音を前後の音に合わせて綴る
+    units = []
+    i = 0
+    while i < len(text):
+        romaji = _ROMAJI_DIGRAPHS.get(text[i:i + 2])
+        if romaji:
+            i += 2
+        else:
+            romaji = _ROMAJI.get(text[i], text[i]) if text[i] != 'っ' else 'っ'
+            i += 1
+        units.append(romaji)
+
+    parts = []
+    for i, romaji in enumerate(units):
+        following = units[i + 1] if i + 1 < len(units) else ''
+        if romaji == 'っ':
+            # 次の音の子音を重ねる（次が子音で始まらない場合は単独で入力する綴り）
+            romaji = following[0] if following[:1].isalpha() and following[0] not in 'aiueon' else 'xtu'
+        elif romaji == 'n' and (not following or following[0] in 'aiueony'):
+            # 「ん」の後に母音・や行・な行が続く場合や末尾の場合は「nn」と打つ
+            romaji = 'nn'
+        parts.append(romaji)
+    return ''.join(parts)
+
+
+def suggest_keys(term, reading=None):
+    """前方一致に使うキー（表記と読みを正規化したもの、かなのキーはローマ字も）を重複なく返す"""
+    keys = []
+    for text in (term, reading):
+        if not text:
+            continue
+        folded = fold_kana(text)
+        candidates = [folded]
+        if is_kana(folded):
+            candidates.append(hiragana_to_romaji(folded))
+        for key in candidates:
+            if key and key not in keys:
+                keys.append(key)
+    return keys
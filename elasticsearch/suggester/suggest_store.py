@@ -0,0 +1,104 @@
+"""
+前方一致サジェスト用の語彙ストア
+
+語ごとに検索用のキー（表記と読みを正規化したもの）を作り、キーの順に並べた配列で保持して
+二分探索で前方一致する範囲を求める。
+短い接頭辞（precompute_depth文字以下）は重みの上位top_k件を読み込み時に計算しておき、
+それより長い接頭辞は範囲内から上位を選んでLRUキャッシュに保持する。
+"""
+import bisect
+import heapq
+from array import array
+from functools import lru_cache
+from kana_normalize import fold_kana, suggest_keys
+
+# 前方一致の範囲の上端を求めるための、どの文字よりも大きい文字
+_MAX_CHAR = '\U0010ffff'
+
+
+def normalize_key(text):
+    """入力された接頭辞を、語のキーと同じ形（幅・大文字小文字・カタカナをそろえた形）にする"""
+    return fold_kana(text)
+
+
+class SuggestStore:
+    """語と重みの一覧から、接頭辞ごとの上位の候補を返す
+
+    entriesは (語, 重み) または (語, 重み, 読み) の組。表記を正規化したものが同じ語は重みを合算し、
+    重みが最も大きい表記で返す。読みを渡すと、ひらがなやローマ字の接頭辞でもその語に一致する。
+    """
+
+    def __init__(self, entries, top_k=10, precompute_depth=2, cache_size=50000):
+        merged = {}
+        for term, weight, *reading in entries:
+            base = normalize_key(term)
+            if not base:
+                continue
+            total, best_term, best_weight, readings = merged.get(base, (0, term, -1, set()))
+            if weight > best_weight:
+                best_term, best_weight = term, weight
+            if reading and reading[0]:
+                readings.add(reading[0])
+            merged[base] = (total + weight, best_term, best_weight, readings)
+
+        # 語の一覧（位置を語のIDとして使う）
+        self.terms = []
+        self.weights = array('q')
+        pairs = []
+        for base in sorted(merged):
+            total, best_term, _, readings = merged[base]
+            term_id = len(self.terms)
+            # 表記がキーと同じ場合は同じ文字列オブジェクトを使い、メモリを節約する
+            self.terms.append(best_term if best_term != base else base)
+            self.weights.append(total)
+            keys = suggest_keys(base)
+            for reading in sorted(readings):
+                keys.extend(key for key in suggest_keys(reading) if key not in keys)
+            pairs.extend((key, term_id) for key in keys)
+
+        # キーの順に並べ、キーごとに対応する語のIDを持つ
+        pairs.sort()
+        self.keys = [key for key, _ in pairs]
+        self.key_terms = array('l', (term_id for _, term_id in pairs))
+        self.top_k = top_k
+        self.precompute_depth = precompute_depth
+
+        self._top = self._precompute()
+        self._scan_cached = lru_cache(maxsize=cache_size)(self._scan)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def _precompute(self):
+        """precompute_depth文字以下の接頭辞ごとに、重みの上位top_k件の語のIDを求める"""
+        prefixes = [set() for _ in self.terms]
+        for key, term_id in zip(self.keys, self.key_terms):
+            prefixes[term_id].update(key[:depth] for depth in range(1, min(len(key), self.precompute_depth) + 1))
+
+        # 重みの降順（同じ重みはIDの順）にたどり、各接頭辞の候補がtop_k件になるまで追加する
+        order = sorted(range(len(self.terms)), key=lambda i: (-self.weights[i], i))
+        top = {}
+        for i in order:
+            for prefix in prefixes[i]:
+                candidates = top.setdefault(prefix, [])
+                if len(candidates) < self.top_k:
+                    candidates.append(i)
+        return {prefix: tuple(candidates) for prefix, candidates in top.items()}
+
+    def _scan(self, key, size):
+        """前方一致する範囲から重みの上位size件の語のIDを求める（表記と読みの両方で一致した語は1件にする）"""
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_left(self.keys, key + _MAX_CHAR, lo)
+        term_ids = set(self.key_terms[lo:hi])
+        return tuple(heapq.nlargest(size, term_ids, key=lambda i: (self.weights[i], -i)))
+
+    def lookup(self, prefix, size=5):
+        """接頭辞に一致する語を重みの降順に返す"""
+        key = normalize_key(prefix)
+        if not key or size <= 0:
+            return []
+        if len(key) <= self.precompute_depth and size <= self.top_k:
+            term_ids = self._top.get(key, ())[:size]
+        else:
+            term_ids = self._scan_cached(key, size)
+        return [{'text': self.terms[i], 'weight': self.weights[i]} for i in term_ids]
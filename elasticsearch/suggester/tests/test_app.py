@@ -0,0 +1,106 @@
+"""サジェストAPIのテスト（Elasticsearchはスタブに置き換える）"""
+import threading
+from unittest import mock
+
+import pytest
+
+# 読み込み時に起動する語彙の定期読み込みスレッドを止めてからアプリを読み込む
+with mock.patch.object(threading.Thread, 'start'):
+    import app
+
+from suggest_store import SuggestStore
+
+
+class StubIndices:
+    def __init__(self, exists):
+        self.result = exists
+        self.calls = 0
+
+    def exists(self, index):
+        self.calls += 1
+        return self.result
+
+
+class StubES:
+    """indices.existsとsearchの呼び出しを記録し、completionの結果を返さないElasticsearch"""
+
+    def __init__(self, exists=True):
+        self.indices = StubIndices(exists)
+        self.searches = []
+
+    def search(self, index, body):
+        self.searches.append((index, body))
+        return {'suggest': {'text-suggest': [{'options': []}]}}
+
+
+@pytest.fixture
+def stub_es(monkeypatch):
+    stub = StubES()
+    monkeypatch.setattr(app, 'es', stub)
+    monkeypatch.setattr(app, 'suggest_index_exists', None)
+    monkeypatch.setattr(app.helpers, 'scan', lambda es, **kwargs: iter([
+        {'_source': {'Term': f'東京{i}', 'Reading': None, 'suggest': {'weight': 100 - i}}} for i in range(80)
+    ]))
+    return stub
+
+
+@pytest.fixture
+def client(stub_es, monkeypatch):
+    monkeypatch.setattr(app, 'store', SuggestStore([(f'東京{i}', 100 - i) for i in range(80)], top_k=10))
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize('size, expected', [
+    (None, app.DEFAULT_SIZE),
+    ('abc', app.DEFAULT_SIZE),
+    ('-5', 1),
+    ('0', 1),
+    ('3', 3),
+    ('1000', app.MAX_SIZE),
+])
+def test_size_is_parsed_and_clamped(client, size, expected):
+    query = {'q': '東京'}
+    if size is not None:
+        query['size'] = size
+    response = client.get('/suggest', query_string=query)
+    assert response.status_code == 200
+    assert response.get_json()['source'] == 'local'
+    assert len(response.get_json()['suggestions']) == expected
+
+
+def test_empty_prefix_does_not_query_elasticsearch(client, stub_es):
+    response = client.get('/suggest', query_string={'q': '  '})
+    assert response.get_json()['suggestions'] == []
+    assert stub_es.searches == []
+
+
+def test_index_existence_is_checked_on_refresh_not_per_miss(client, stub_es):
+    assert client.post('/refresh').get_json() == {'status': 'ok', 'terms': 80}
+    assert stub_es.indices.calls == 1
+
+    for prefix in ('とうきょ', 'ひ', 'xyz', 'ラ', 'q'):
+        response = client.get('/suggest', query_string={'q': prefix})
+        assert response.get_json()['source'] == 'elasticsearch'
+    assert stub_es.indices.calls == 1
+    assert len(stub_es.searches) == 5
+
+
+def test_fallback_to_suggest_index_uses_normalized_prefix_and_contexts(client, stub_es):
+    app.suggest_index_exists = True
+    client.get('/suggest', query_string={'q': 'ﾗｰﾒ', 'size': '3'})
+    index, body = stub_es.searches[0]
+    assert index == app.SUGGEST_INDEX
+    assert body['suggest']['text-suggest']['prefix'] == 'らーめ'
+    assert body['suggest']['text-suggest']['completion'] == {
+        'size': 3, 'skip_duplicates': True, 'field': 'suggest', 'contexts': {'type': app.SUGGEST_TYPES}
+    }
+    assert stub_es.indices.calls == 0
+
+
+def test_fallback_without_suggest_index_checks_once(client, stub_es):
+    stub_es.indices.result = False
+    client.get('/suggest', query_string={'q': 'ラーメ'})
+    client.get('/suggest', query_string={'q': 'ラーメン'})
+    assert stub_es.indices.calls == 1
+    assert [index for index, _ in stub_es.searches] == [app.SOURCE_INDEX, app.SOURCE_INDEX]
+    assert stub_es.searches[0][1]['suggest']['text-suggest']['completion']['field'] == 'Keywords.suggest'
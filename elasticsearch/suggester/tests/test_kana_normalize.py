@@ -0,0 +1,48 @@
+"""サジェストのキーの正規化のテスト"""
+import pytest
+
+from kana_normalize import fold_kana, hiragana_to_romaji, is_katakana, suggest_keys
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('ラーメン', 'らーめん'),
+    ('ﾗｰﾒﾝ', 'らーめん'),
+    ('ＡＢＣ', 'abc'),
+    ('  Tokyo　 Tower ', 'tokyo tower'),
+    ('ヴァイオリン', 'ゔぁいおりん'),
+    ('東京', '東京'),
+])
+def test_fold_kana_unifies_width_case_and_kana(text, expected):
+    assert fold_kana(text) == expected
+
+
+@pytest.mark.parametrize('kana, romaji', [
+    ('らーめん', 'ra-menn'),
+    ('とうきょう', 'toukyou'),
+    ('しんぶん', 'shinbunn'),
+    ('ほんや', 'honnya'),
+    ('こんにちは', 'konnnichiha'),
+    ('きっぷ', 'kippu'),
+    ('きゃっと', 'kyatto'),
+    ('かっ', 'kaxtu'),
+    ('ちゃんぽん', 'chanponn'),
+    ('ふぁいる', 'fairu'),
+    ('ゔぁいおりん', 'vaiorinn'),
+])
+def test_hiragana_to_romaji_uses_ime_spellings(kana, romaji):
+    assert hiragana_to_romaji(kana) == romaji
+
+
+def test_is_katakana():
+    assert is_katakana('トウキョウ')
+    assert is_katakana('ラーメン')
+    assert not is_katakana('東京')
+    assert not is_katakana('')
+
+
+def test_suggest_keys_adds_reading_and_romaji_without_duplicates():
+    assert suggest_keys('ラーメン') == ['らーめん', 'ra-menn']
+    assert suggest_keys('東京', 'トウキョウ') == ['東京', 'とうきょう', 'toukyou']
+    assert suggest_keys('らーめん', 'ラーメン') == ['らーめん', 'ra-menn']
+    assert suggest_keys('Tokyo') == ['tokyo']
+    assert suggest_keys('', None) == []
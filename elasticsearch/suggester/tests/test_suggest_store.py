@@ -0,0 +1,100 @@
+"""語彙ストアの前方一致検索のテスト"""
+import random
+
+import pytest
+
+from kana_normalize import suggest_keys
+from suggest_store import SuggestStore, normalize_key
+
+ENTRIES = [
+    ('ラーメン', 10, 'ラーメン'),
+    ('らーめん', 5),
+    ('東京', 20, 'トウキョウ'),
+    ('東京タワー', 8, 'トウキョウタワー'),
+    ('Tokyo', 3),
+    ('TOKYO', 4),
+    ('とうふ', 1),
+]
+
+
+@pytest.fixture
+def store():
+    return SuggestStore(ENTRIES, top_k=3, precompute_depth=2)
+
+
+def texts(results):
+    return [result['text'] for result in results]
+
+
+def test_variants_of_the_same_term_are_merged(store):
+    # 「ラーメン」と「らーめん」、「Tokyo」と「TOKYO」は同じキーになり、重みを合算して重みの大きい表記で返す
+    assert len(store) == 5
+    assert store.lookup('らーめ') == [{'text': 'ラーメン', 'weight': 15}]
+    assert store.lookup('tok') == [{'text': 'TOKYO', 'weight': 7}]
+
+
+@pytest.mark.parametrize('prefix', ['ら', 'ラー', 'ﾗｰ', 'ra-', 'ra-me', 'RA-MENN'])
+def test_kana_width_and_romaji_prefixes_match(store, prefix):
+    assert texts(store.lookup(prefix)) == ['ラーメン']
+
+
+@pytest.mark.parametrize('prefix', ['TOK', 'ＴＯＫ', 'ｔｏｋ'])
+def test_width_and_case_variants_match(store, prefix):
+    assert texts(store.lookup(prefix)) == ['TOKYO']
+
+
+def test_reading_matches_kanji_terms(store):
+    assert texts(store.lookup('とうきょ')) == ['東京', '東京タワー']
+    assert texts(store.lookup('toukyo')) == ['東京', '東京タワー']
+    assert texts(store.lookup('トウキョウタ')) == ['東京タワー']
+
+
+def test_results_are_ordered_by_weight_and_limited(store):
+    # 表記・読み・ローマ字のどれで一致しても語は1件だけ返す
+    assert texts(store.lookup('to', 10)) == ['東京', '東京タワー', 'TOKYO', 'とうふ']
+    assert texts(store.lookup('to', 2)) == ['東京', '東京タワー']
+    assert texts(store.lookup('とう', 3)) == ['東京', '東京タワー', 'とうふ']
+
+
+def test_no_match_and_invalid_sizes(store):
+    assert store.lookup('ひ') == []
+    assert store.lookup('') == []
+    assert store.lookup('   ') == []
+    assert store.lookup('to', 0) == []
+    assert store.lookup('to', -5) == []
+
+
+def reference_lookup(entries, prefix, size):
+    """全語を走査して、前方一致する語を重みの降順（同じ重みはキーの順）に返す"""
+    merged = {}
+    for term, weight, *reading in entries:
+        base = normalize_key(term)
+        total, best, best_weight, readings = merged.get(base, (0, term, -1, set()))
+        if weight > best_weight:
+            best, best_weight = term, weight
+        if reading:
+            readings.add(reading[0])
+        merged[base] = (total + weight, best, best_weight, readings)
+    key = normalize_key(prefix)
+    matched = []
+    for base, (total, best, _, readings) in merged.items():
+        keys = suggest_keys(base) + [k for reading in readings for k in suggest_keys(reading)]
+        if any(k.startswith(key) for k in keys):
+            matched.append((-total, base, best, total))
+    return [{'text': best, 'weight': total} for _, _, best, total in sorted(matched)[:size]]
+
+
+def test_precomputed_and_scanned_prefixes_match_a_full_scan():
+    rng = random.Random(7)
+    syllables = ['か', 'き', 'さ', 'し', 'た', 'ら', 'ー', 'ん', 'カ', 'ラ']
+    entries = []
+    for _ in range(400):
+        term = ''.join(rng.choice(syllables) for _ in range(rng.randint(1, 5)))
+        entries.append((term, rng.randint(1, 50)))
+    store = SuggestStore(entries, top_k=5, precompute_depth=2)
+    prefixes = {term[:length] for term, _ in entries for length in range(1, 4)}
+    prefixes |= {'ka', 'shi', 'ra-', 'kan'}
+    for prefix in sorted(prefixes):
+        # top_k以下は事前計算、それより多い場合と長い接頭辞は範囲の走査で求める
+        for size in (1, 5, 8):
+            assert store.lookup(prefix, size) == reference_lookup(entries, prefix, size), (prefix, size)
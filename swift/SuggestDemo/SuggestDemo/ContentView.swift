@@ -309,6 +309,8 @@ class ElasticSearchService {
     // ElasticSearchのベースURL
     private let baseURL = "https://elasticsearch.delightfulwave-1815f7a1.japaneast.azurecontainerapps.io:443"
     private let indexName = "msprdb-index"
+    // サジェストを返すsuggesterサービスのURL
+    private let suggesterURL = "https://suggester.delightfulwave-1815f7a1.japaneast.azurecontainerapps.io"
 
     // 投稿検索API
     func searchPosts(query: String) -> AnyPublisher<[Post], Error> {
@@ -358,69 +360,36 @@ class ElasticSearchService {
             .eraseToAnyPublisher()
     }
 
-    // サジェスト取得API
+    // サジェスト取得API（suggesterサービスが語彙から前方一致の候補を重みの大きい順に返す）
     func getSuggestions(for text: String) -> AnyPublisher<[String], Error> {
         // URL構築
-        let urlString = "\(baseURL)/\(indexName)/_search"
-        guard let url = URL(string: urlString) else {
+        guard var components = URLComponents(string: "\(suggesterURL)/suggest") else {
             return Fail(error: URLError(.badURL)).eraseToAnyPublisher()
         }
-
-        // リクエストボディ構築 - Textフィールドの検索サジェスト用
-        let requestBody: [String: Any] = [
-            "suggest": [
-                "text-suggest": [
-                    "prefix": text,
-                    "completion": [
-                        "field": "Keywords.suggest",
-                        "size": 5,
-                        "fuzzy": [
-                            "fuzziness": "AUTO"
-                        ]
-                    ]
-                ]
-            ],
-            "size": 0  // 実際のドキュメントは不要
+        components.queryItems = [
+            URLQueryItem(name: "q", value: text),
+            URLQueryItem(name: "size", value: "5")
         ]
-
-        // HTTP リクエスト作成
-        var request = URLRequest(url: url)
-        request.httpMethod = "POST"
-        request.addValue("application/json", forHTTPHeaderField: "Content-Type")
-
-        do {
-            request.httpBody = try JSONSerialization.data(withJSONObject: requestBody)
-        } catch {
-            return Fail(error: error).eraseToAnyPublisher()
+        guard let url = components.url else {
+            return Fail(error: URLError(.badURL)).eraseToAnyPublisher()
         }
 
-        // サジェスト結果を返すダミーデータ
-        // 実際の実装では、ElasticSearchのレスポンスからサジェストを抽出します
-        let dummySuggestions = ["投稿テスト", "投稿サンプル", "テスト投稿", "ユーザー投稿", "新しい投稿"]
-        return Just(dummySuggestions)
-            .setFailureType(to: Error.self)
-            .eraseToAnyPublisher()
-
-        // 注意: Elasticsearchの設定でText.suggestフィールドが適切に設定されていない場合、
-        // 以下のような方法でPrefix検索をサジェストとして使用できます
+        // HTTP リクエスト作成（かな・全角半角の違いはsuggester側でそろえる）
+        var request = URLRequest(url: url)
+        request.httpMethod = "GET"
 
-        /*
-        // HTTPリクエスト実行（代替手段）
         return URLSession.shared.dataTaskPublisher(for: request)
-            .map(\.data)
-            .decode(type: SearchResponse.self, decoder: JSONDecoder())
-            .map { response in
-                // テキストから上位の候補を抽出
-                return response.hits.hits.compactMap { hit in
-                    hit._source?.text
+            .tryMap { result -> Data in
+                if let httpResponse = result.response as? HTTPURLResponse, !(200...299).contains(httpResponse.statusCode) {
+                    throw URLError(.badServerResponse)
                 }
-                .filter { $0.localizedCaseInsensitiveContains(text) }
-                .prefix(5)
-                .sorted()
-                .map { String($0) }
+                return result.data
+            }
+            .decode(type: SuggestResponse.self, decoder: JSONDecoder())
+            .map { response in
+                return response.suggestions.map { $0.text }
             }
             .eraseToAnyPublisher()
-        */
     }
 }
 
@@ -492,6 +461,18 @@ struct SearchResponse: Decodable {
     }
 }
 
+// suggesterのレスポンスモデル
+struct SuggestResponse: Decodable {
+    let query: String
+    let source: String
+    let suggestions: [Suggestion]
+
+    struct Suggestion: Decodable {
+        let text: String
+        let weight: Double  // ローカルの語彙は出現数、Elasticsearchから取得した場合はスコア
+    }
+}
+
 // キーボードを閉じるためのヘルパー拡張
 extension View {
     func hideKeyboard() {